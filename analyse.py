@@ -0,0 +1,297 @@
+"""
+Multi-PV analysis of a single Watch Your Back! position
+
+Runs the same search as minimax_module's Player on a given position, but
+scores the best few actions exactly instead of only finding the best one,
+and reports each of them with its principal variation along with statistics
+for every iteration of the search. Positions are given as a position string
+(see parse_position) or taken from a game record file, which makes it easy
+to look into a bad move from a logged game without replaying the whole
+match.
+
+Usage: python analyse.py POSITION [-k LINES] [-d DEPTH] [-t TIME] [-n NODES]
+       python analyse.py -r RECORDS [-g GAME] [-a ACTIONS] [...]
+"""
+import json
+import math
+import time
+import argparse
+import itertools
+
+import gamerecord
+from watchyourback import Board, WHITE, BLACK, CORNER, EMPTY
+from minimax_module import Player, PLACING, MOVING, SHRINK, MOVING_PHASE
+
+# CONSTANTS
+LINES = 3
+SIZE = 8
+
+# HELPER FUNCTIONS
+def format_position(board, phase, turns):
+    """
+    Returns the position string of a Board: its 8 rows (top first) of 'O',
+    '@', 'X' and '-' joined by '/', then the phase and the number of turns
+    into it, e.g. 'X------X/--------/... moving 130'
+    """
+    rows = [''.join(board.grid[x, y] for x in range(SIZE))
+            for y in range(SIZE)]
+    return f"{'/'.join(rows)} {phase} {turns}"
+
+def parse_position(text):
+    """
+    Returns (board, phase, turns) for a position string made by
+    format_position. The board is shrunk according to the turns (the
+    referee shrinks it at the end of turns 127 and 191 of the moving
+    phase). Raises ValueError if the string doesn't describe a position
+    """
+    fields = text.split()
+    if len(fields) != 3:
+        raise ValueError("expected rows, phase and turns")
+    rows, phase, turns = fields[0].split('/'), fields[1], int(fields[2])
+    if len(rows) != SIZE or any(len(row) != SIZE for row in rows):
+        raise ValueError(f"expected {SIZE} rows of {SIZE} squares")
+    if phase not in (PLACING, MOVING):
+        raise ValueError(f"unknown phase {phase!r}")
+    if turns < 0 or (phase == PLACING and turns >= MOVING_PHASE):
+        raise ValueError(f"no turn {turns} in the {phase} phase")
+
+    board = Board(SIZE)
+    if phase == MOVING:
+        for shrink in SHRINK:
+            if turns >= shrink:
+                board.shrink()
+
+    for y, row in enumerate(rows):
+        for x, char in enumerate(row):
+            square = board.grid[x, y]
+            if char in (WHITE, BLACK):
+                if square != EMPTY or (x, y) not in board.playingarea:
+                    raise ValueError(f"piece on unplayable square {(x, y)}")
+                board.add_piece(char, (x, y))
+            elif char not in (CORNER, EMPTY):
+                raise ValueError(f"unknown square {char!r} at {(x, y)}")
+            elif (char == CORNER) != (square == CORNER):
+                raise ValueError(f"corners don't match the board at "
+                                 f"{(x, y)}")
+    return board, phase, turns
+
+def record_position(record, actions=None):
+    """
+    Returns (board, phase, turns) before action number 'actions' (default
+    after the last action) of a GameRecord
+    """
+    played = len(record.actions) - (record.ending == 'invalid')
+    if actions is None:
+        actions = played
+    if not 0 <= actions <= played:
+        raise ValueError(f"game only has {played} valid actions")
+    phase, turns = gamerecord.turn_info(actions)
+    return record.final_board(actions), phase, turns
+
+def format_action(action):
+    """
+    Returns a short string for a placing (x,y) or moving ((a,b),(c,d))
+    action, or 'pass' for None
+    """
+    if action is None:
+        return 'pass'
+    if isinstance(action[0], int):
+        return f'{action[0]},{action[1]}'
+    (a, b), (c, d) = action
+    return f'{a},{b}-{c},{d}'
+
+# CLASSES
+class Analyser(Player):
+    """
+    A Player for the team to move in a given position whose root search
+    scores the best 'lines' actions exactly (multi-PV) rather than just
+    finding the best one
+    """
+    def __init__(self, board, phase, turns, lines=LINES):
+        super().__init__('white' if turns % 2 == 0 else 'black')
+        self.board = board
+        self.phase = phase
+        self.turns = turns
+        self.lines = lines
+        self.scores = {}
+        # every line needs an exact score, so no aspiration windows
+        self.aspiration = math.inf
+
+    def root(self, actions, depth, a, b):
+        """
+        Searches every action at the root in order of their scores from the
+        previous iteration. Each one gets a null window at the score of the
+        'lines'th best action so far, so only the best 'lines' actions are
+        scored exactly (the rest get an upper bound). Returns the best value
+        and the index of the action it belongs to
+        """
+        actions.sort(key=lambda action: self.scores.get(action, -math.inf),
+                     reverse=True)
+        scores = {}
+        top = []
+        for action in actions:
+            bound = top[-1] if len(top) >= self.lines else -math.inf
+            undo = self.make(self.colour, action)
+            value = self.scout(len(top) < self.lines, self.enemy, depth, 1,
+                               bound, math.inf)
+            self.unmake(self.colour, action, undo)
+            if self.stopped:
+                return -math.inf, 0
+            scores[action] = value
+            if value > bound:
+                top = sorted(top + [value], reverse=True)[:self.lines]
+
+        self.scores = scores
+        best = max(range(len(actions)), key=lambda i: scores[actions[i]])
+        return scores[actions[best]], best
+
+    def best_reply(self, colour, depth, ply):
+        """
+        Returns the best action for 'colour' (None if it has none) searching
+        'depth' plies after it, with a full window
+        """
+        enemy = BLACK if colour == WHITE else WHITE
+        best, best_action = -math.inf, None
+        for action in self.ordered_actions(colour):
+            undo = self.make(colour, action)
+            value = -self.negamax(enemy, depth-1, ply+1, -math.inf, -best)
+            self.unmake(colour, action, undo)
+            if best_action is None or value > best:
+                best, best_action = value, action
+        return best_action
+
+    def variation(self, action, depth):
+        """
+        Returns the principal variation of a search 'depth' plies deep
+        starting with our 'action', found by searching for the best reply
+        at each ply in turn
+        """
+        self.stopped = False
+        self.deadline = self.max_nodes = math.inf
+        line = [action]
+        played = [(self.colour, action, self.make(self.colour, action))]
+        colour, ply = self.enemy, 1
+        while not self.cutoff(depth + 1 - ply, ply):
+            reply = self.best_reply(colour, depth + 1 - ply, ply)
+            line.append(reply)
+            if reply is not None:
+                played.append((colour, reply, self.make(colour, reply)))
+            colour = BLACK if colour == WHITE else WHITE
+            ply += 1
+        for colour, action, undo in reversed(played):
+            self.unmake(colour, action, undo)
+        return line
+
+    def analyse(self, depth=None, time_limit=None, nodes=None):
+        """
+        Searches to 'depth' plies (after our action), or until 'time_limit'
+        seconds of CPU time or 'nodes' nodes have been used. Without any
+        limit the search stops after 'action_time' as in a game. Returns a
+        dict describing the position, the best lines with their scores and
+        principal variations and every completed iteration of the search
+        """
+        if depth is not None:
+            self.min_depth[self.phase] = min(self.min_depth[self.phase],
+                                             depth)
+            self.max_depth[self.phase] = depth
+        if time_limit is None:
+            limited = depth is not None or nodes is not None
+            time_limit = math.inf if limited else self.action_time
+        self.max_nodes = math.inf if nodes is None else nodes
+
+        start = time.process_time()
+        self.scores = {}
+        self.search(deadline=start + time_limit)
+        searched = self.nodes
+        elapsed = time.process_time() - start
+
+        lines = []
+        if self.iterations:
+            depth = self.iterations[-1]['depth']
+            ranked = sorted(self.scores, key=self.scores.get, reverse=True)
+            for action in ranked[:self.lines]:
+                lines.append({'action': action,
+                              'score': self.scores[action],
+                              'pv': self.variation(action, depth)})
+
+        return {'position': format_position(self.board, self.phase,
+                                             self.turns),
+                'colour': 'white' if self.colour == WHITE else 'black',
+                'phase': self.phase, 'turns': self.turns,
+                'depth': self.iterations[-1]['depth']
+                         if self.iterations else None,
+                'nodes': searched, 'time': elapsed, 'lines': lines,
+                'iterations': self.iterations}
+
+def analyse(board, phase, turns, lines=LINES, depth=None, time_limit=None,
+            nodes=None):
+    """
+    Returns the analysis (see Analyser.analyse) of a position for the team
+    to move. 'board' is searched in place and left as it was
+    """
+    return Analyser(board, phase, turns, lines).analyse(depth, time_limit,
+                                                        nodes)
+
+def print_analysis(result):
+    print(result['position'])
+    print(f"{result['colour']} to play, depth {result['depth']}, "
+          f"{result['nodes']} nodes, {result['time']:.3f}s")
+    for i, line in enumerate(result['lines']):
+        pv = ' '.join(format_action(action) for action in line['pv'])
+        print(f"{i+1:2d}. {line['score']:9.3f}  {pv}")
+    print("iterations:")
+    for iteration in result['iterations']:
+        print(f"  depth {iteration['depth']}: "
+              f"{format_action(iteration['action'])} "
+              f"{iteration['value']:.3f} ({iteration['nodes']} nodes, "
+              f"{iteration['time']:.3f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Show the best actions in a position of Watch Your "
+                "Back! with their scores and principal variations")
+    parser.add_argument('position', nargs='?',
+            help="position string: 8 rows of O, @, X or - joined by /, "
+                "then the phase and turns into it")
+    parser.add_argument('-r', '--record',
+            help="take the position from this game record file instead")
+    parser.add_argument('-g', '--game', type=int, default=0,
+            help="index of the game in the record file")
+    parser.add_argument('-a', '--actions', type=int, default=None,
+            help="number of actions of the game to play (default all)")
+    parser.add_argument('-k', '--lines', type=int, default=LINES,
+            help="number of best actions to show")
+    parser.add_argument('-d', '--depth', type=int, default=None,
+            help="search depth (plies after our action)")
+    parser.add_argument('-t', '--time', type=float, default=None,
+            help="CPU time limit (seconds)")
+    parser.add_argument('-n', '--nodes', type=int, default=None,
+            help="node limit")
+    parser.add_argument('--json', action='store_true',
+            help="print the analysis as JSON")
+    args = parser.parse_args()
+
+    if args.record:
+        games = gamerecord.read_records(args.record)
+        record = next(itertools.islice(games, args.game, None), None)
+        if record is None:
+            parser.error(f"no game {args.game} in {args.record}")
+    elif not args.position:
+        parser.error("give a position string or a record file")
+    try:
+        if args.record:
+            position = record_position(record, args.actions)
+        else:
+            position = parse_position(args.position)
+    except ValueError as e:
+        parser.error(str(e))
+
+    result = analyse(*position, lines=args.lines, depth=args.depth,
+                     time_limit=args.time, nodes=args.nodes)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_analysis(result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Cheap baseline opponents for a game of Watch Your Back! using referee.py
+
+Three simple players for high volume testing, cheap enough that tournaments
+against them are dominated by the player being tested rather than its
+opponent:
+
+RandomPlayer:   plays a uniformly random legal action
+GreedyPlayer:   plays the action capturing the most pieces (random if none do)
+CautiousPlayer: plays a random action among those leaving the fewest of its
+                pieces able to be captured next turn
+
+None of them search or copy the board. Placements come from the board's
+free squares, moves from random sampling or the board's move cache and
+captures from its threat map, so unlike random_module an action never has
+to retry placements or rebuild the team. RandomPlayer and GreedyPlayer take
+tens of microseconds per action, CautiousPlayer (which tries every action)
+around a millisecond. Load one with referee.py using
+'baseline_module:GreedyPlayer' (Player is RandomPlayer).
+"""
+from watchyourback import Board, WHITE_ZONE, BLACK_ZONE, EMPTY, DIRECTIONS
+from watchyourback import PLAYING_AREAS, step
+import random
+
+DEFAULT_BOARD_SIZE = 8
+MOVING_PHASE = 24
+SHRINK = [128, 192]
+WHITE, BLACK = ['O', '@']
+PLACING, MOVING = ['placing', 'moving']
+TRIES = 16 # random (piece, direction) pairs tried before counting moves
+
+# HELPER FUNCTIONS
+def count_bits(mask):
+    return bin(mask).count('1')
+
+def capturing_actions(board, colour, phase):
+    """
+    Returns list of (action, mask of pieces captured) for every action of
+    'colour' which captures at least one enemy piece
+    """
+    threats = board.get_threats(colour)
+    if not threats:
+        return []
+    if phase == PLACING:
+        zone = WHITE_ZONE if colour == WHITE else BLACK_ZONE
+        return [(pos, mask) for pos, mask in threats.items()
+                if pos[1] in zone]
+    captures = []
+    for pos in threats:
+        for origin in board.arrivals(pos):
+            if board.grid[origin] == colour:
+                mask = board.capture_mask(colour, pos, origin)
+                if mask:
+                    captures.append(((origin, pos), mask))
+    return captures
+
+# CLASSES
+class RandomPlayer:
+    """
+    Player choosing uniformly at random from its legal actions. Subclasses
+    choose differently by overriding choose
+    """
+    def __init__(self, colour):
+        if colour == 'white':
+            self.colour = WHITE
+            self.enemy = BLACK
+        if colour == 'black':
+            self.colour = BLACK
+            self.enemy = WHITE
+        self.board = Board(DEFAULT_BOARD_SIZE)
+        self.phase = PLACING
+        self.turns = 0
+
+    def action(self, turns):
+        """
+        Given the number of turns into the current phase of the game, returns
+        its next action and updates the internal game board
+        """
+        next_action = None  # default value if no moves available
+        self.turns = turns # allow us to know when to shrink in update function
+
+        # Time to shrink the board
+        if turns in SHRINK:
+            self.board.shrink()
+
+        next_action = self.choose()
+        if next_action is not None:
+            self.play(self.colour, next_action)
+
+        # Check if this was our last turn in placing phase
+        if (turns == MOVING_PHASE-2 or turns == MOVING_PHASE-1) and \
+        self.phase == PLACING:
+            self.phase = MOVING
+
+        # Increment our turn count to ensure update shrinks at the right time
+        self.turns += 1
+
+        return next_action
+
+    def update(self, action):
+        """
+        Updates the internal game board with opponents "action" and shrinks
+        the board if it has reached that point in the game
+        """
+        # Check if board has shrunk
+        if self.turns in SHRINK:
+            self.board.shrink()
+
+        # Opponent had no moves available and forfeited its turn
+        if action is not None:
+            self.play(self.enemy, action)
+
+    def pieces(self):
+        """
+        Returns our team's dictionary of alive pieces
+        """
+        if self.colour == WHITE:
+            return self.board.white_pieces
+        return self.board.black_pieces
+
+    def actions(self):
+        """
+        Returns list of our legal actions
+        """
+        if self.phase == PLACING:
+            return self.board.placements(self.colour)
+        return [(pos, move) for pos in self.pieces()
+                for move in self.board.get_moves(pos)]
+
+    def choose(self):
+        """
+        Returns the action to play, or None if we have no legal actions
+        """
+        if self.phase == PLACING:
+            free = self.board.placements(self.colour)
+            return random.choice(free) if free else None
+
+        # Try random pieces and directions: each direction gives a piece at
+        # most one move, so the first legal one is uniform over our moves
+        pieces = list(self.pieces())
+        if not pieces:
+            return None
+        grid = self.board.grid
+        area = PLAYING_AREAS[self.board.numOfShrinks]
+        for _ in range(TRIES):
+            pos = random.choice(pieces)
+            direction = random.choice(DIRECTIONS)
+            square = step(pos, direction)
+            if square in area and grid[square] != EMPTY:
+                square = step(square, direction)
+            if square in area and grid[square] == EMPTY:
+                return pos, square
+
+        # Mostly blocked, so pick the index of a move out of all of our
+        # moves instead (without building the list of them)
+        count = self.board.get_mobility(self.colour)
+        if not count:
+            return None
+        index = random.randrange(count)
+        for pos in self.pieces():
+            moves = self.board.get_moves(pos)
+            if index < len(moves):
+                return pos, moves[index]
+            index -= len(moves)
+
+    def play(self, colour, action):
+        """
+        Plays a placing (x,y) or moving ((a,b),(c,d)) action of 'colour' on
+        the board
+        """
+        if isinstance(action[0], int):
+            self.board.place_piece(colour, action)
+        else:
+            oldpos, newpos = action
+            self.board.get_piece(oldpos).make_move(newpos)
+
+    def make(self, colour, action):
+        """
+        Plays an action on the board only, returning (piece moved or None,
+        eliminated pieces) for unmake
+        """
+        if isinstance(action[0], int):
+            return None, self.board.place_piece(colour, action)
+        piece = self.board.get_piece(action[0])
+        return piece, piece.make_move(action[1])
+
+    def unmake(self, colour, action, undo):
+        piece, eliminated = undo
+        if piece is None:
+            self.board.undo_place(colour, action, eliminated)
+        else:
+            piece.undo_move(action[0], eliminated)
+
+class GreedyPlayer(RandomPlayer):
+    """
+    Player choosing the action which captures the most enemy pieces, or a
+    random one if none capture
+    """
+    def choose(self):
+        best, best_actions = 0, []
+        for action, mask in capturing_actions(self.board, self.colour,
+                                              self.phase):
+            captured = count_bits(mask)
+            if captured > best:
+                best, best_actions = captured, [action]
+            elif captured == best:
+                best_actions.append(action)
+        if best_actions:
+            return random.choice(best_actions)
+        return super().choose()
+
+class CautiousPlayer(RandomPlayer):
+    """
+    Player choosing randomly between the actions which lose the fewest of
+    its pieces, counting those eliminated by the action itself and those the
+    enemy could capture with its next action
+    """
+    def choose(self):
+        actions = self.actions()
+        if not actions:
+            return None
+
+        # The enemy's next action is a move if this is the last placement
+        phase = self.phase
+        if phase == PLACING and self.turns + 1 >= MOVING_PHASE:
+            phase = MOVING
+        best, best_actions = None, []
+        for action in actions:
+            undo = self.make(self.colour, action)
+            lost = sum(piece.player == self.colour for piece in undo[1])
+            threatened = 0
+            for _, mask in capturing_actions(self.board, self.enemy, phase):
+                threatened |= mask
+            self.unmake(self.colour, action, undo)
+            lost += count_bits(threatened)
+            if best is None or lost < best:
+                best, best_actions = lost, [action]
+            elif lost == best:
+                best_actions.append(action)
+        return random.choice(best_actions)
+
+Player = RandomPlayer
@@ -0,0 +1,112 @@
+"""
+Vectorised version of Player.evaluate_board for scoring many positions at once
+
+Positions are given either as an (N, 8, 8) array of square codes indexed
+[n, y, x] (see encode_board) or as an (N, 2) array of packed (white, black)
+masks (see Board.get_masks). The same terms and weights as evaluate_board in
+minimax_module are used so the two always agree, the only difference being
+that everything is done with NumPy over the whole batch.
+"""
+import math
+import numpy as np
+
+from minimax_module import WEIGHTS, MIDDLE_SQUARES, manhattan_distance
+from minimax_module import WHITE, BLACK, MOVING
+from watchyourback import CORNER
+
+# CONSTANTS
+# Square codes used in encoded (N, 8, 8) batches
+EMPTY_CODE, WHITE_CODE, BLACK_CODE, CORNER_CODE = range(4)
+CODES = {WHITE: WHITE_CODE, BLACK: BLACK_CODE, CORNER: CORNER_CODE}
+
+# Distance of each square (indexed y*8+x) to its closest middle square
+DISTANCE_FROM_MIDDLE = np.array([min(manhattan_distance((x, y), square)
+                                     for square in MIDDLE_SQUARES)
+                                 for y in range(8) for x in range(8)],
+                                dtype=np.float64)
+
+# Names of the columns returned by extract_features
+FEATURES = ['own', 'enemy', 'distance']
+
+# HELPER FUNCTIONS
+def encode_board(board):
+    """
+    Returns an (8, 8) int8 array of square codes for an instance of Board,
+    indexed [y, x] like the referee's board
+    """
+    encoded = np.zeros((8, 8), dtype=np.int8)
+    for (x, y), char in board.grid.items():
+        encoded[y, x] = CODES.get(char, EMPTY_CODE)
+    return encoded
+
+def encode_boards(boards):
+    """
+    Returns an (N, 8, 8) batch for a sequence of N instances of Board
+    """
+    return np.stack([encode_board(board) for board in boards])
+
+def unpack_masks(masks):
+    """
+    Takes an (N, 2) array of (white, black) masks and returns two (N, 64)
+    boolean arrays of white and black occupancy indexed y*8+x
+    """
+    masks = np.ascontiguousarray(masks, dtype='<u8').reshape(-1, 2)
+    bits = np.unpackbits(masks.view(np.uint8).reshape(-1, 2, 8),
+                         axis=2, bitorder='little').astype(bool)
+    return bits[:, 0, :], bits[:, 1, :]
+
+def split_batch(batch):
+    """
+    Takes an (N, 8, 8) batch of square codes and returns two (N, 64)
+    boolean arrays of white and black occupancy indexed y*8+x
+    """
+    flat = np.asarray(batch).reshape(-1, 64)
+    return flat == WHITE_CODE, flat == BLACK_CODE
+
+def extract_features(white, black, colour):
+    """
+    Given (N, 64) occupancy arrays returns an (N, 3) array holding the terms
+    of evaluate_board for 'colour' (see FEATURES): number of our pieces,
+    number of enemy pieces and total distance of our pieces from the middle
+    """
+    own, enemy = (white, black) if colour == WHITE else (black, white)
+    features = np.empty((own.shape[0], len(FEATURES)), dtype=np.float64)
+    features[:, 0] = own.sum(axis=1)
+    features[:, 1] = enemy.sum(axis=1)
+    features[:, 2] = own @ DISTANCE_FROM_MIDDLE
+    return features
+
+# EVALUATION FUNCTIONS
+def evaluate_occupancy(white, black, colour, phase, weights=None):
+    """
+    Returns an (N,) array of utility values for 'colour', equal to what
+    evaluate_board would return for each of the N positions
+    """
+    if weights is None:
+        weights = WEIGHTS
+    vector = np.array([weights[name] for name in FEATURES])
+    features = extract_features(white, black, colour)
+    values = features @ vector
+
+    # End game conditions only apply during the moving phase
+    if phase == MOVING:
+        own, enemy = features[:, 0], features[:, 1]
+        values[(own >= 2) & (enemy < 2)] = math.inf
+        values[(own < 2) & (enemy >= 2)] = -math.inf
+        values[(own < 2) & (enemy < 2)] = weights['tie']
+
+    return values
+
+def evaluate_batch(batch, colour, phase, weights=None):
+    """
+    Evaluates an (N, 8, 8) batch of encoded positions for 'colour'
+    """
+    white, black = split_batch(batch)
+    return evaluate_occupancy(white, black, colour, phase, weights)
+
+def evaluate_masks(masks, colour, phase, weights=None):
+    """
+    Evaluates an (N, 2) array of packed (white, black) masks for 'colour'
+    """
+    white, black = unpack_masks(masks)
+    return evaluate_occupancy(white, black, colour, phase, weights)
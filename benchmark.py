@@ -0,0 +1,203 @@
+"""
+Fixed position benchmark for minimax_module's search
+
+Searches each position of a small curated suite (placing, the start and
+middle of the moving phase, just before and after a shrink and a couple of
+endgames) to a fixed depth and measures the time taken to complete each
+depth, the nodes searched per second and the action chosen. Results are
+written as JSON, and can be compared against a saved baseline to flag any
+position which has got slower.
+
+Usage: python benchmark.py [-o RESULTS] [-r REPEAT] [-c BASELINE]
+       python benchmark.py -i RESULTS -c BASELINE
+"""
+import gc
+import sys
+import json
+import math
+import argparse
+import platform
+
+from analyse import parse_position, format_action
+from minimax_module import Player
+
+# CONSTANTS
+REPEAT = 3        # runs per position, the fastest is kept
+THRESHOLD = 0.10  # relative slowdown counted as a regression
+
+# Positions are position strings (see analyse.py) set up by hand to cover
+# each stage of the game, searched to 'depth' plies after our action. The
+# turns of a placing position are the pieces placed so far (those on the
+# board plus any captured), which also decides the team to move
+SUITE = [
+    {'name': 'placing-opening', 'depth': 3, 'position':
+     'X------X/---O----/-----@--/---OO---/-------@/--------/--------/'
+     'X------X placing 5'},
+    {'name': 'placing-late', 'depth': 3, 'position':
+     'X------X/---O----/---OO@--/-O-OO-O-/@--OO--@/--------/------@-/'
+     'X--@---X placing 17'},
+    {'name': 'placing-crowded', 'depth': 3, 'position':
+     'X------X/---OO---/--OOO---/--OO@@@-/--OO@@@-/---@@---/--------/'
+     'X------X placing 17'},
+    {'name': 'moving-start', 'depth': 4, 'position':
+     'X------X/---O----/-O-OO-O-/-OOOO-O-/@--OO--@/---@----/-----@@-/'
+     'X--@@--X moving 0'},
+    {'name': 'moving-middle', 'depth': 4, 'position':
+     'X------X/---O----/---OO---/-OOOOO@-/-@OOOO-@/-------@/--@-@@--/'
+     'X------X moving 40'},
+    {'name': 'moving-crowded', 'depth': 4, 'position':
+     'X----O-X/---OO---/--OOO@--/-OOO@@@-/-OOO@@--/--@@@@--/---@@---/'
+     'X------X moving 40'},
+    {'name': 'before-shrink', 'depth': 4, 'position':
+     'X------X/---O----/-@-OO---/-OOOOO-@/--OOOO-@/@-------/--@--@@-/'
+     'X------X moving 124'},
+    {'name': 'after-shrink', 'depth': 4, 'position':
+     '--------/-X--O-X-/---OO---/-OOOOO--/--OOOO--/--------/-X@--@X-/'
+     '-------- moving 129'},
+    {'name': 'endgame-attack', 'depth': 5, 'position':
+     '--------/-X-O--X-/---OO---/-OOOOO--/--OOOO--/--@-----/-X--@-X-/'
+     '-------- moving 132'},
+    {'name': 'endgame-defend', 'depth': 5, 'position':
+     '--------/-X----X-/---OO---/--OOOOO-/-@OOOO--/--@@----/-X----X-/'
+     '-------- moving 133'},
+    {'name': 'second-shrink', 'depth': 6, 'position':
+     '--------/--------/--XO-X--/--O--@--/---O@---/--X-@X--/--------/'
+     '-------- moving 200'},
+]
+
+# HELPER FUNCTIONS
+def position_player(position):
+    """
+    Returns a Player for the team to move in a position string
+    """
+    board, phase, turns = parse_position(position)
+    player = Player('white' if turns % 2 == 0 else 'black')
+    player.board = board
+    player.phase = phase
+    player.turns = turns
+    return player
+
+def run_position(entry, repeat=REPEAT):
+    """
+    Searches a suite entry to its depth 'repeat' times and returns the
+    results of the fastest run
+    """
+    best = None
+    for _ in range(repeat):
+        player = position_player(entry['position'])
+        player.max_depth[player.phase] = entry['depth']
+        gc.collect()
+        action = player.search(deadline=math.inf)
+        iterations = player.iterations
+        last = iterations[-1] if iterations else {}
+        elapsed = last.get('time', 0.0)
+        if best is None or elapsed < best['time']:
+            best = {'name': entry['name'], 'depth': entry['depth'],
+                    'reached': last.get('depth'),
+                    'action': format_action(action),
+                    'value': last.get('value'),
+                    'nodes': player.nodes, 'time': elapsed,
+                    'nps': player.nodes / elapsed if elapsed else 0.0,
+                    'depths': [{'depth': it['depth'], 'nodes': it['nodes'],
+                                'time': it['time']} for it in iterations]}
+    return best
+
+def run_suite(suite=SUITE, repeat=REPEAT, progress=None):
+    """
+    Runs every position of 'suite', calling progress(result) after each
+    one. Returns the results as a dict ready to be saved as JSON
+    """
+    results = []
+    for entry in suite:
+        result = run_position(entry, repeat)
+        results.append(result)
+        if progress is not None:
+            progress(result)
+    nodes = sum(result['nodes'] for result in results)
+    elapsed = sum(result['time'] for result in results)
+    return {'python': platform.python_version(), 'repeat': repeat,
+            'positions': results,
+            'total': {'nodes': nodes, 'time': elapsed,
+                      'nps': nodes / elapsed if elapsed else 0.0}}
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """
+    Compares two sets of results position by position. Returns a list of
+    (name, base time, time, notes, regression) where a regression is a
+    position (or the total) which took more than 'threshold' longer than
+    in the baseline. Changes in nodes or the chosen action are noted since
+    they mean the search itself has changed
+    """
+    base = {result['name']: result for result in baseline['positions']}
+    rows = []
+    for result in current['positions']:
+        old = base.get(result['name'])
+        if old is None:
+            rows.append((result['name'], None, result['time'], 'new', False))
+            continue
+        notes = []
+        if result['nodes'] != old['nodes']:
+            notes.append(f"nodes {old['nodes']} -> {result['nodes']}")
+        if result['action'] != old['action']:
+            notes.append("action changed")
+        if result['reached'] != old['reached']:
+            notes.append(f"depth {old['reached']} -> {result['reached']}")
+        regression = result['time'] > old['time'] * (1 + threshold)
+        rows.append((result['name'], old['time'], result['time'],
+                     ', '.join(notes), regression))
+
+    old, new = baseline['total'], current['total']
+    rows.append(('total', old['time'], new['time'],
+                 f"nps {old['nps']:.0f} -> {new['nps']:.0f}",
+                 new['time'] > old['time'] * (1 + threshold)))
+    return rows
+
+def print_result(result):
+    print(f"{result['name']:16s} depth {result['reached']}/{result['depth']}"
+          f" {result['nodes']:8d} nodes {result['time']:7.3f}s "
+          f"{result['nps']:8.0f} nps  {result['action']}")
+
+def print_comparison(rows):
+    for name, old, new, notes, regression in rows:
+        change = f"{(new - old) / old:+7.1%}" if old else '    n/a'
+        flag = 'REGRESSION' if regression else ''
+        old = f"{old:7.3f}s" if old is not None else '      -'
+        print(f"{name:16s} {old} -> {new:7.3f}s {change} {flag:10s} {notes}")
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Benchmark the search on a fixed set of positions")
+    parser.add_argument('-o', '--output',
+            help="write the results to this JSON file")
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT,
+            help="runs per position (the fastest is kept)")
+    parser.add_argument('-i', '--input',
+            help="use saved results instead of running the suite")
+    parser.add_argument('-c', '--compare',
+            help="baseline results to compare against")
+    parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD,
+            help="relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input) as file:
+            results = json.load(file)
+    else:
+        results = run_suite(repeat=args.repeat, progress=print_result)
+        total = results['total']
+        print(f"total: {total['nodes']} nodes {total['time']:.3f}s "
+              f"{total['nps']:.0f} nps")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        rows = compare(baseline, results, args.threshold)
+        print_comparison(rows)
+        if any(regression for *_, regression in rows):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+Compact binary storage for recorded games of Watch Your Back!
+
+A record file starts with a short magic header followed by any number of
+length-prefixed game records. Each record holds the names of both players, how
+the game ended, every action in order (a placement in 1 byte, a move in
+2 bytes) and the CPU time taken for each action. Records are only ever
+appended so a file can be written to as games finish, and read back one game
+at a time without loading the whole file.
+"""
+import struct
+from array import array
+
+from watchyourback import Board
+
+# CONSTANTS
+MAGIC = b'WYBR\x01'
+MOVING_PHASE = 24
+SHRINK = [128, 192]
+WHITE, BLACK = ['O', '@']
+PLACING, MOVING = ['placing', 'moving']
+
+# Possible winners and ways a game can end (stored as their index)
+RESULTS = ['W', 'B', 'draw', None]
+ENDINGS = ['completed', 'invalid', 'resource', 'unfinished']
+
+# Move with both bytes set to FORFEIT is a forfeited (None) move. An action
+# which isn't a placement or move on the board (the last action of an
+# 'invalid' game can be anything) is stored as the byte UNENCODABLE, or a
+# move with both bytes set to it, and read back as INVALID
+FORFEIT = 0xFF
+UNENCODABLE = 0xFE
+INVALID = 'invalid'
+MAX_NAME = 255 # bytes of a player's name stored (length is a single byte)
+
+LENGTH = struct.Struct('<I')
+HEADER = struct.Struct('<BBHBB')  # result, ending, actions, name lengths
+
+# HELPER FUNCTIONS
+def encode_square(pos):
+    """
+    Takes position (x,y) and returns its index y*8+x
+    """
+    x, y = pos
+    return y*8 + x
+
+def valid_square(pos):
+    """
+    Returns true if 'pos' is an (x,y) position on the board
+    """
+    return isinstance(pos, (tuple, list)) and len(pos) == 2 and \
+        all(isinstance(i, int) and 0 <= i < 8 for i in pos)
+
+def encode_name(name):
+    """
+    Returns a player's name as UTF-8, cut down to MAX_NAME bytes (without
+    splitting a character)
+    """
+    data = name.encode('utf-8')
+    if len(data) > MAX_NAME:
+        data = data[:MAX_NAME].decode('utf-8', 'ignore').encode('utf-8')
+    return data
+
+def decode_square(index):
+    """
+    Takes index y*8+x and returns position (x,y)
+    """
+    return (index % 8, index // 8)
+
+def encode_actions(actions):
+    """
+    Returns bytes for a list of actions, the first MOVING_PHASE of which are
+    placements
+    """
+    data = bytearray()
+    for i, action in enumerate(actions):
+        if i < MOVING_PHASE:
+            if valid_square(action):
+                data.append(encode_square(action))
+            else:
+                data.append(UNENCODABLE)
+        elif action is None:
+            data += bytes([FORFEIT, FORFEIT])
+        elif isinstance(action, (tuple, list)) and len(action) == 2 and \
+        all(valid_square(pos) for pos in action):
+            oldpos, newpos = action
+            data.append(encode_square(oldpos))
+            data.append(encode_square(newpos))
+        else:
+            data += bytes([UNENCODABLE, UNENCODABLE])
+    return bytes(data)
+
+def decode_actions(data, n):
+    """
+    Returns list of 'n' actions decoded from 'data' (inverse of
+    encode_actions)
+    """
+    placing = min(n, MOVING_PHASE)
+    actions = [decode_square(i) if i != UNENCODABLE else INVALID
+               for i in data[:placing]]
+    for i in range(placing, placing + 2*(n - placing), 2):
+        if data[i] == FORFEIT:
+            actions.append(None)
+        elif data[i] == UNENCODABLE:
+            actions.append(INVALID)
+        else:
+            actions.append((decode_square(data[i]), decode_square(data[i+1])))
+    return actions
+
+def action_size(n):
+    """
+    Returns the number of bytes used to store the first 'n' actions of a game
+    """
+    return min(n, MOVING_PHASE) + 2*max(0, n - MOVING_PHASE)
+
+def turn_info(index):
+    """
+    Takes the index of an action in a game and returns (phase, turns) as seen
+    by the player making that action
+    """
+    if index < MOVING_PHASE:
+        return PLACING, index
+    return MOVING, index - MOVING_PHASE
+
+# CLASSES
+class GameRecord:
+    """
+    A class representing one recorded game: the module names of the white
+    and black players, the winner ('W', 'B', 'draw' or None if unknown),
+    how the game ended (see ENDINGS), the list of actions in the order they
+    were played and the CPU time (seconds) taken to choose each action
+    """
+    def __init__(self, white, black, winner=None, ending='unfinished',
+                 actions=None, times=None):
+        self.white = white
+        self.black = black
+        self.winner = winner
+        self.ending = ending
+        self.actions = actions if actions is not None else []
+        self.times = times if times is not None else []
+
+    def __repr__(self):
+        return (f'GameRecord({self.white!r}, {self.black!r}, '
+                f'winner={self.winner!r}, ending={self.ending!r}, '
+                f'actions={len(self.actions)})')
+
+    def add(self, action, time=0.0):
+        """
+        Appends an action and the CPU time taken to choose it
+        """
+        self.actions.append(action)
+        self.times.append(time)
+
+    def to_bytes(self):
+        """
+        Returns the record (without its length prefix) as bytes
+        """
+        white = encode_name(self.white)
+        black = encode_name(self.black)
+        header = HEADER.pack(RESULTS.index(self.winner),
+                             ENDINGS.index(self.ending),
+                             len(self.actions), len(white), len(black))
+        times = array('f', self.times)
+        return b''.join([header, white, black,
+                         encode_actions(self.actions), times.tobytes()])
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Returns a GameRecord decoded from the output of to_bytes
+        """
+        result, ending, n, wlen, blen = HEADER.unpack_from(data)
+        i = HEADER.size
+        white = data[i:i+wlen].decode('utf-8')
+        i += wlen
+        black = data[i:i+blen].decode('utf-8')
+        i += blen
+        size = action_size(n)
+        actions = decode_actions(data[i:i+size], n)
+        i += size
+        times = array('f')
+        times.frombytes(data[i:i+4*n])
+        return cls(white, black, RESULTS[result], ENDINGS[ending], actions,
+                   times.tolist())
+
+    def replay(self, upto=None):
+        """
+        Generator which plays the first 'upto' actions (default all) on a new
+        Board, shrinking it at the same turns as the referee. Yields
+        (index, action, board) after each action; the same Board instance is
+        yielded each time so copy it if it needs to be kept. The final action
+        of an 'invalid' game is never played since it broke the rules
+        """
+        board = Board(8)
+        actions = self.actions
+        if self.ending == 'invalid':
+            actions = actions[:-1]
+        if upto is not None:
+            actions = actions[:upto]
+        for index, action in enumerate(actions):
+            colour = WHITE if index % 2 == 0 else BLACK
+            phase, turns = turn_info(index)
+            if phase == PLACING:
+                board.place_piece(colour, action)
+            else:
+                if action is not None:
+                    oldpos, newpos = action
+                    board.get_piece(oldpos).make_move(newpos)
+                if turns + 1 in SHRINK:
+                    board.shrink()
+            yield index, action, board
+
+    def final_board(self, upto=None):
+        """
+        Returns the Board after playing the first 'upto' actions (default all)
+        """
+        board = Board(8)
+        for _, _, board in self.replay(upto):
+            pass
+        return board
+
+class RecordWriter:
+    """
+    Append-only writer for a record file. Can be used as a context manager
+    """
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def write(self, record):
+        """
+        Appends a GameRecord to the end of the file
+        """
+        data = record.to_bytes()
+        self.file.write(LENGTH.pack(len(data)))
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+def read_records(path):
+    """
+    Generator which yields each GameRecord stored in the file at 'path', one
+    at a time
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a game record file')
+        while True:
+            prefix = file.read(LENGTH.size)
+            if len(prefix) < LENGTH.size:
+                return
+            size, = LENGTH.unpack(prefix)
+            data = file.read(size)
+            if len(data) < size:
+                return  # truncated final record (writer was interrupted)
+            yield GameRecord.from_bytes(data)
+
+def write_records(path, records):
+    """
+    Appends every GameRecord in 'records' to the file at 'path'
+    """
+    with RecordWriter(path) as writer:
+        for record in records:
+            writer.write(record)
@@ -13,8 +13,11 @@ and the textbook "Artificial Intelligence: A Modern Approach"
 Authors: Ckyever Gaviola, Samuel Fatone
 May 2018
 """
-from watchyourback import Board, Piece
-import random, math, copy
+from watchyourback import Board, WHITE_ZONE, BLACK_ZONE
+import pns
+import nnue
+import tracing
+import math, json, os, time
 
 DEFAULT_BOARD_SIZE = 8
 MOVING_PHASE = 24
@@ -26,7 +29,72 @@ MIDDLE_SQUARES = [(3,3), (4,3), (3,4), (4,4)]
 PLACE_DEPTH = 1
 MOVE_DEPTH = 0
 
-# HELPER FUNCTION
+# Search (both phases): iterative deepening from PLACE_DEPTH/MOVE_DEPTH up to
+# MAX_PLACE_DEPTH/MAX_MOVE_DEPTH (plies searched after our action) within 
+# the action's share of our time (see action_budget), using aspiration
+# windows of +/- ASPIRATION_WINDOW around the previous iteration's value and
+# null windows one step of the evaluation wide (see next_value)
+MAX_PLACE_DEPTH = 4
+MAX_MOVE_DEPTH = 8
+ASPIRATION_WINDOW = 10.0
+CHECK_NODES = 256 # how often (in nodes) to check the clock
+
+# Time management: the referee allows GAME_TIME seconds of CPU time for the
+# whole game (the limit in the spec). Each action gets at most ACTION_TIME
+# seconds, and no more than an equal share of what is left of GAME_TIME 
+# (less TIME_RESERVE) between our actions up to turn EXPECTED_TURNS of the
+# moving phase, or at least MIN_TURNS_LEFT turns after that
+GAME_TIME = 120.0
+TIME_RESERVE = 5.0
+ACTION_TIME = 0.5
+EXPECTED_TURNS = 200
+MIN_TURNS_LEFT = 32
+
+# Selective search (switched off with SELECTIVE = False).
+# Null move pruning: let the side to move pass and search NULL_MOVE_REDUCTION
+# plies shallower, pruning if that still fails high. Only used in the moving
+# phase, and not in the last NULL_MOVE_MIN_DEPTH plies or if the side to move
+# has fewer than NULL_MOVE_MIN_PIECES pieces (passing is never really an 
+# option then).
+# Late move reductions: quiet moves (no eliminations) ordered at LMR_MIN_INDEX
+# or later are searched LMR_REDUCTION plies shallower with a null window
+# first, and only searched fully if they turn out better
+SELECTIVE = True
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_MIN_PIECES = 4
+LMR_REDUCTION = 1
+LMR_MIN_DEPTH = 3
+LMR_MIN_INDEX = 4
+
+# Quiescence search (switched off with QUIESCENCE = False): at the depth limit
+# keep searching actions which capture (found with the board's threat map) 
+# for up to QUIESCENCE_DEPTH more plies, so positions aren't evaluated in the
+# middle of an exchange. Capturing actions are also tried first everywhere
+QUIESCENCE = True
+QUIESCENCE_DEPTH = 2
+
+# Proof-number search (see pns.py) for forced wins and losses before the next
+# shrink in the moving phase (switched off with PROVE = False). First we try
+# to prove a win for ourselves, then a win for the enemy to find our moves
+# which lose by force. Each search creates at most PROOF_NODES nodes and 
+# uses at most PROOF_TIME seconds of the action's time
+PROVE = True
+PROOF_NODES = 5000
+PROOF_TIME = 0.1
+
+# Evaluation weights used by evaluate_board (and batch_eval), replaced by
+# the contents of WEIGHTS_FILE if it exists (see tune.py)
+WEIGHTS = {'own': 20.0, 'enemy': -15.0, 'distance': -1.0, 'tie': -100.0}
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'weights.json')
+
+# Evaluation network (see nnue.py) used by evaluate_board in place of 
+# WEIGHTS if NNUE_FILE exists and NumPy is installed
+NNUE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'nnue.npz')
+
+# HELPER FUNCTIONS
 def manhattan_distance(a, b):
     """
     Takes two tuples (ax,ay) and (bx,by) and returns the Manhattan distance
@@ -36,6 +104,29 @@ def manhattan_distance(a, b):
     bx, by = b
     return abs(ay - by) + abs(ax - bx)
 
+def next_value(value):
+    """
+    Returns the smallest value above 'value', so that (value, 
+    next_value(value)) is a null window: a score above 'value' fails high
+    however finely the evaluation is graded (tuned weights, the network)
+    """
+    return math.nextafter(value, math.inf)
+
+def load_weights(path=WEIGHTS_FILE):
+    """
+    Updates WEIGHTS with the values stored in the JSON file at 'path' (if it
+    exists) and returns WEIGHTS
+    """
+    if os.path.exists(path):
+        with open(path) as file:
+            weights = json.load(file)
+        WEIGHTS.update((key, float(weights[key]))
+                       for key in WEIGHTS if key in weights)
+    return WEIGHTS
+
+load_weights()
+NETWORK = nnue.load_network(NNUE_FILE)
+
 # CLASSES
 class Player:
     """
@@ -53,6 +144,30 @@ class Player:
         self.phase = PLACING
         self.turns = 0
         
+        # Search limits and statistics. 'clock' is the CPU time we have
+        # used so far in the game
+        self.action_time = ACTION_TIME
+        self.clock = 0.0
+        self.min_depth = {PLACING: PLACE_DEPTH, MOVING: MOVE_DEPTH}
+        self.max_depth = {PLACING: MAX_PLACE_DEPTH, MOVING: MAX_MOVE_DEPTH}
+        self.aspiration = ASPIRATION_WINDOW
+        self.max_nodes = math.inf
+        self.selective = SELECTIVE
+        self.quiescence = QUIESCENCE
+        self.nodes = 0
+        self.iterations = []
+        self.deadline = math.inf
+        self.stopped = False
+        self.history = {}
+        self.prove = PROVE
+        self.network = NETWORK
+        self.losing = []
+        
+        # Trace of each turn (see tracing.py), None unless WYB_TRACE is set
+        self.tracer = tracing.get_tracer()
+        if self.tracer is not None:
+            self.track = self.tracer.track(f'{colour} ({__name__})')
+        
         if colour == 'white':
             self.colour = WHITE
             self.enemy = BLACK
@@ -67,64 +182,46 @@ class Player:
         ((a,b),(c,d)) ) and updates the internal game board. Also shrinks the
         board when it has reached that point in the game
         """
+        start = time.process_time()
         next_action = None  # default value if no moves available
         self.turns = turns # allow us to know when to shrink in update function
+        deadline = start + self.action_budget()
         
         # Time to shrink the board
         if turns in SHRINK:
             self.board.shrink()
-            
-        # Placing phase
-        if self.phase == PLACING:
-            
-            # Choose square to place next piece on
-            next_action = self.alpha_beta_place()
-            
-            # Place piece on our representation of the game board
-            self.board.place_piece(self.colour, next_action)
         
-        # Moving phase
-        elif self.phase == MOVING:            
-            # Variable which will determine whether moves to a border piece will be allowed 
-            exclude_borders = 0
+        with self.trace('turn', 'turn', turns=turns, phase=self.phase) as span:
+            # Placing phase
+            if self.phase == PLACING:
+                
+                # Choose square to place next piece on
+                next_action = self.alpha_beta_place(deadline)
+                
+                # Place piece on our representation of the game board
+                self.board.place_piece(self.colour, next_action)
             
-            while True:
-                # If the number of turns for the colour is less than or equal to the number of pieces on the border,
-                # will move them first
-                if self.board.count_outside(self.colour) >= (SHRINK[0] - self.turns)/2 and self.turns < SHRINK[0]:
-                    team = list(self.board.get_border_pieces(self.colour).values())
-                    exclude_borders = 1
-                elif self.board.count_outside(self.colour) >= (SHRINK[1] - self.turns)/2 and self.turns < SHRINK[1]:
-                    team = list(self.board.get_border_pieces(self.colour).values())
-                    exclude_borders = 1
-                    
-                # If not use default move strategy
-                else:
+            # Moving phase
+            elif self.phase == MOVING:
+                # Play a forced win if we can prove one, then get pieces off
+                # the border if the next shrink is close, otherwise use 
+                # default move strategy
+                next_action = self.proven_move(deadline)
+                if next_action is None:
+                    with self.trace('escape', 'escape') as escape:
+                        next_action = self.escape_move()
+                        escape.set(action=next_action)
+                if next_action is None:
                     # Choose piece (oldpos) and square to move it to (newpos)
-                    next_action = self.alpha_beta_move()
+                    next_action = self.alpha_beta_move(deadline)
+                
+                # Move piece on our representation of the game board
+                if next_action is not None:
                     oldpos, newpos = next_action
-            
-                    # Move piece on our representation of the game board
                     self.board.get_piece(oldpos).make_move(newpos)
-                    break
-                
-                # In the case board shrink eliminates all of our team
-                if not team:
-                    break
-                
-                # Choose random piece and a random move
-                while True:
-                    piece = random.choice(team)
-                    moves = piece.listmoves(exclude_borders)
-                    if len(moves) > 0:
-                        break
-                
-                # Check piece has moves available, then make move
-                if moves:
-                    newpos = random.choice(moves)
-                    next_action = (piece.pos, newpos)
-                    piece.make_move(newpos)
-                    break
+            span.set(action=next_action, nodes=self.nodes)
+        if self.tracer is not None:
+            self.tracer.maybe_flush()
             
         # Check if this was our last turn in placing phase
         if (turns == MOVING_PHASE-2 or turns == MOVING_PHASE-1) and \
@@ -134,19 +231,111 @@ class Player:
         # Increment our turn count to ensure update shrinks at the right time
         self.turns += 1
         
+        self.clock += time.process_time() - start
         return next_action
 
+    def action_budget(self):
+        """
+        Returns the CPU time for this action: an equal share of the game
+        time we have left between the actions we expect to still make, up
+        to 'action_time'
+        """
+        if self.phase == PLACING:
+            placing = (MOVING_PHASE - self.turns + 1) // 2
+            moving_turns = EXPECTED_TURNS
+        else:
+            placing = 0
+            moving_turns = max(EXPECTED_TURNS - self.turns, MIN_TURNS_LEFT)
+        actions_left = placing + (moving_turns + 1) // 2
+        left = max(GAME_TIME - TIME_RESERVE - self.clock, 0.0)
+        return min(self.action_time, left / actions_left)
+
+    def next_shrink(self):
+        """
+        Returns the turn of the next shrink, or infinity if there are none
+        left
+        """
+        upcoming = [shrink for shrink in SHRINK if self.turns < shrink]
+        return upcoming[0] if upcoming else math.inf
+
+    def proven_move(self, deadline=math.inf):
+        """
+        Returns a move which is proven to win by force before the next 
+        shrink, otherwise None. Also sets 'losing' to our moves which are
+        proven to lose by force (unless they all do) for alpha_beta_move to
+        avoid
+        """
+        self.losing = []
+        if not self.prove:
+            return None
+        horizon = self.next_shrink()
+        
+        solver = pns.ProofSearch(self.board, self.colour, self.colour, 
+                                 self.turns, horizon)
+        with self.trace('prove win', 'solver') as span:
+            solver.run(PROOF_NODES, 
+                       min(deadline, time.process_time() + PROOF_TIME))
+            span.set(nodes=solver.nodes, proven=solver.root.pn == 0)
+        if solver.winning_action() is not None:
+            return solver.winning_action()
+        
+        solver = pns.ProofSearch(self.board, self.enemy, self.colour, 
+                                 self.turns, horizon)
+        with self.trace('prove loss', 'solver') as span:
+            solver.run(PROOF_NODES, 
+                       min(deadline, time.process_time() + PROOF_TIME))
+            span.set(nodes=solver.nodes, proven=solver.root.pn == 0)
+        if solver.root.pn != 0:
+            self.losing = solver.losing_actions()
+        return None
+
+    def escape_move(self):
+        """
+        Returns a move which takes one of our pieces off the border if there
+        are only just enough turns left to save them all before the next 
+        shrink, otherwise None
+        """
+        upcoming = self.next_shrink()
+        if math.isinf(upcoming):
+            return None
+        
+        # Number of moves we have left before the board shrinks
+        remaining = (upcoming - self.turns + 1) // 2
+        if self.board.escape_cost(self.colour) < remaining:
+            return None
+        
+        plan = self.board.escape_plan(self.colour, remaining)
+        if not plan:
+            return None
+        moves, piece, newpos = plan[0]
+        return (piece.pos, newpos)
+
+    def trace(self, name, cat, **args):
+        """
+        Returns a span (see tracing.py) recording the code it wraps on our 
+        track of the trace, or one which does nothing if tracing is off
+        """
+        if self.tracer is None:
+            return tracing.NULL_SPAN
+        return self.tracer.span(name, cat, self.track, args)
+
     def update(self, action):
         """
         Updates the internal game board with opponents "action" and shrinks the
         board if it has reached that point in the game
         """
+        start = time.process_time()
+        
         # Check if board has shrunk
         if self.turns in SHRINK:
             self.board.shrink()
         
+        # Opponent had no moves available and forfeited its turn
+        if action is None:
+            pass
+        
         # First element of action has length 1, indicating it is a placing move
-        if isinstance(action[0], int):
+        elif isinstance(action[0], int):
             self.board.place_piece(self.enemy, action)
         
         # Otherwise must be a nested tuples indicating a move    
@@ -154,6 +343,8 @@ class Player:
             oldpos, newpos = action
             piece = self.board.get_piece(oldpos)
             piece.make_move(newpos)
+        
+        self.clock += time.process_time() - start
                     
     # Evaluation function that returns the utility value for a given 
     # board state for this player
@@ -161,7 +352,8 @@ class Player:
         """
         Given an instance of Board returns a utility value based on the
         number of pieces alive on each team and positioning of our pieces
-        relative to the middle of the board
+        relative to the middle of the board, or the value given by the 
+        evaluation network if one was loaded (see NNUE_FILE)
         """
         value = 0.0
         
@@ -174,12 +366,17 @@ class Player:
                 return -math.inf
             # Should only take a draw if other moves lead to a very low value
             elif result == TIE:
-                return -100 
+                return WEIGHTS['tie']
+        
+        # The network's accumulator follows the board's changes, so this 
+        # only costs the pieces changed since the last evaluation
+        if self.network is not None:
+            return self.network.evaluate(board, self.colour)
         
         # Compare number of our pieces to number of enemy pieces
         # Give more value to our pieces (defensive strategy)
-        value += len(board.get_alive(self.colour)) * 20.0
-        value += len(board.get_alive(self.enemy)) * -15.0
+        value += len(board.get_alive(self.colour)) * WEIGHTS['own']
+        value += len(board.get_alive(self.enemy)) * WEIGHTS['enemy']
         
         # How good is our positioning (closer to middle 4 squares is favoured)
         for piece in board.get_alive(self.colour).values():
@@ -190,134 +387,316 @@ class Player:
             distance = min(dfm)
             
             # Lower the value the more further our pieces are from the centre
-            value += distance * -1.0
+            value += distance * WEIGHTS['distance']
             
         return value
             
-    def alpha_beta_place(self):
+    def alpha_beta_place(self, deadline=None):
         """
-        Wrapper function for minimax with alpha-beta pruning which returns the
-        placing move with the highest minimax value by recursion
+        Returns the placing action with the highest minimax value
         """
-        values = {} # dictionary of placing moves and their minimax value
+        return self.search(deadline=deadline)
+    
+    def alpha_beta_move(self, deadline=None):
+        """
+        Returns the moving action with the highest minimax value, or None if
+        we have no moves. Moves proven to lose (see proven_move) are only
+        considered if there are no others
+        """
+        return self.search(self.losing, deadline)
+    
+    # Phase specific parts of the search: action source, making and undoing
+    # actions and the cutoff test
+    def actions(self, colour):
+        """
+        Returns list of every action for the team in the current phase
+        (squares to place on, or (oldpos, newpos) moves)
+        """
+        if self.phase == PLACING:
+            return self.board.placements(colour)
+        return [(pos, move) for pos in self.board.get_alive(colour)
+                for move in self.board.get_moves(pos)]
+    
+    def make(self, colour, action):
+        """
+        Applies an action to the board, returning (piece, eliminated) for
+        undo (piece is None when placing)
+        """
+        if self.phase == PLACING:
+            return None, self.board.place_piece(colour, action)
+        oldpos, newpos = action
+        piece = self.board.get_piece(oldpos)
+        return piece, piece.make_move(newpos)
+    
+    def unmake(self, colour, action, undo):
+        """
+        Reverses an action applied by make
+        """
+        piece, eliminated = undo
+        if piece is None:
+            self.board.undo_place(colour, action, eliminated)
+        else:
+            piece.undo_move(action[0], eliminated)
+    
+    def captures(self, colour):
+        """
+        Returns list of the team's actions which capture at least one enemy
+        piece
+        """
+        threats = self.board.get_threats(colour)
+        if not threats:
+            return []
+        if self.phase == PLACING:
+            zone = WHITE_ZONE if colour == WHITE else BLACK_ZONE
+            return [pos for pos in threats if pos[1] in zone]
+        return [(origin, pos) for pos in threats
+                for origin in self.board.arrivals(pos)
+                if self.board.grid[origin] == colour and
+                self.board.capture_mask(colour, pos, origin)]
+    
+    def cutoff(self, depth, ply):
+        """
+        Cutoff test: reached depth limit, end of placing phase (placing) or
+        an end game condition (moving)
+        """
+        if depth <= 0:
+            return True
+        if self.phase == PLACING:
+            return self.turns + ply >= MOVING_PHASE
+        return self.board.check_win(self.colour) != CONTINUE
+    
+    # Search core shared by both phases
+    def evaluate(self, colour):
+        """
+        Returns evaluate_board from the point of view of 'colour' (negamax)
+        """
+        value = self.evaluate_board(self.board)
+        return value if colour == self.colour else -value
+    
+    def search(self, exclude=(), deadline=None):
+        """
+        Iterative deepening negamax search from the current board. Searches 
+        deeper each iteration until out of time (CPU time 'deadline', by
+        default 'action_time' from now), starting each iteration with an
+        aspiration window around the previous iteration's value and trying
+        the best action from the previous iteration first. Actions in 
+        'exclude' are skipped unless there are no others. Each completed 
+        iteration is recorded in 'iterations'. Returns None if we have no 
+        actions.
+        """
+        start = time.process_time()
+        self.nodes = 0
+        self.stopped = False
+        if deadline is None:
+            deadline = start + self.action_time
+        self.deadline = deadline
+        self.history = {}
+        self.iterations = []
         
-        # Iterate through all possible placing moves for current board state
-        for pos in self.board.starting_zone(self.colour):
-            # Check square isn't already taken
-            if self.board.get_piece(pos) == None:
-                # Find minimax value
-                eliminated = self.board.place_piece(self.colour, pos)
-                values[pos] = self.max_place(PLACE_DEPTH, -math.inf, math.inf)
-                self.board.undo_place(self.colour, pos, eliminated)
+        actions = self.actions(self.colour)
+        if not actions:
+            return None
+        actions = [action for action in actions
+                   if action not in exclude] or actions
         
-        # Return placing move with highest minimax value
-        return max(values, key=values.get)
+        value = None
+        for depth in range(self.min_depth[self.phase],
+                           self.max_depth[self.phase] + 1):
+            # Aspiration window, widened on the side it fails
+            if value is None or math.isinf(value):
+                a, b = -math.inf, math.inf
+            else:
+                a, b = value - self.aspiration, value + self.aspiration
+            with self.trace('iteration', 'search', depth=depth) as span:
+                while True:
+                    span.set(window=[a, b])
+                    result, best = self.root(actions, depth, a, b)
+                    if self.stopped:
+                        break
+                    if result <= a and a > -math.inf:
+                        a = -math.inf
+                    elif result >= b and b < math.inf:
+                        b = math.inf
+                    else:
+                        break
+                span.set(value=result, nodes=self.nodes, 
+                         stopped=self.stopped)
+            
+            # Only use completed iterations, moving the best action first
+            if self.stopped:
+                break
+            actions.insert(0, actions.pop(best))
+            value = result
+            self.iterations.append({'depth': depth, 'value': value,
+                                    'action': actions[0], 
+                                    'nodes': self.nodes,
+                                    'time': time.process_time() - start})
+            
+            # Game is decided or next iteration is unlikely to finish
+            if math.isinf(value) or time.process_time() > self.deadline:
+                break
+        
+        return actions[0]
     
-    def max_place(self, depth, a, b):
+    def root(self, actions, depth, a, b):
         """
-        Finds highest minimax value for each possible action during our 
-        player's (MAX) turn
+        Principal variation search over our actions at the root. Returns 
+        the best value and the index of the action it belongs to
         """
-        # Cutoff test: either we've reached end of placing phase or depth limit
-        if (self.turns + (PLACE_DEPTH-depth)) >= MOVING_PHASE or depth == 0:
-            return self.evaluate_board(self.board)
-        
-        # Iterate through each placing move
-        for pos in self.board.starting_zone(self.colour):
-            if self.board.get_piece(pos) == None:
-                eliminated = self.board.place_piece(self.colour, pos)
-                a = max(a, self.min_place(depth-1, a, b))
-                self.board.undo_place(self.colour, pos, eliminated)
-                
-                # Alpha-beta pruning
-                if a >= b:
-                    return b
-                
-        return a
+        best, best_index = -math.inf, 0
+        for i, action in enumerate(actions):
+            with self.trace('root move', 'root', action=action) as span:
+                undo = self.make(self.colour, action)
+                value = self.scout(i == 0, self.enemy, depth, 1, 
+                                   max(a, best), b)
+                self.unmake(self.colour, action, undo)
+                span.set(value=value)
+            if self.stopped:
+                break
+            if value > best:
+                best, best_index = value, i
+            if best >= b:
+                break
+        return best, best_index
     
-    def min_place(self, depth, a, b):
+    def ordered_actions(self, colour):
         """
-        Returns the lowest minimax value for each possible action during
-        opponent's (MIN) turn
+        Returns list of actions for the team, with captures first and then
+        actions that caused cutoffs elsewhere in the tree (history heuristic)
         """
-        # Cutoff test (same as max_place)
-        if (self.turns + (PLACE_DEPTH-depth)) >= MOVING_PHASE or depth == 0:
-            return self.evaluate_board(self.board)
+        actions = self.actions(colour)
+        captures = self.captures(colour)
+        if captures:
+            captures = set(captures)
+            actions.sort(key=lambda action: (action in captures,
+                                             self.history.get(action, 0)),
+                         reverse=True)
+        else:
+            actions.sort(key=lambda action: self.history.get(action, 0),
+                         reverse=True)
+        return actions
     
-        # Iterate through each placing move
-        for pos in self.board.starting_zone(self.enemy):
-            if self.board.get_piece(pos) == None:
-                eliminated = self.board.place_piece(self.enemy, pos)
-                b = min(b, self.max_place(depth-1, a, b))
-                self.board.undo_place(self.enemy, pos, eliminated)
-                
-                # Alpha-beta pruning
-                if b <= a:
-                    return a
-                
-        return b
-
-    def alpha_beta_move(self):
+    def count_node(self):
+        """
+        Counts a searched node and sets 'stopped' once out of time or past
+        'max_nodes' nodes
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_NODES == 0 and \
+        (time.process_time() > self.deadline or self.nodes >= self.max_nodes):
+            self.stopped = True
+    
+    def scout(self, first, colour, depth, ply, a, b):
+        """
+        Searches the node reached by an action of the team before 'colour',
+        returning its value for that team. The first action gets the full 
+        window, the others a null window which is only re-searched with the
+        full window if the action turns out better
+        """
+        if first or math.isinf(a) or b <= next_value(a):
+            return -self.negamax(colour, depth, ply, -b, -a)
+        value = -self.negamax(colour, depth, ply, -next_value(a), -a)
+        if value > a and not self.stopped:
+            value = -self.negamax(colour, depth, ply, -b, -a)
+        return value
+    
+    def null_move_allowed(self, colour, depth):
+        """
+        Returns true if the team may pass for null move pruning
+        """
+        return self.selective and self.phase == MOVING and \
+            depth >= NULL_MOVE_MIN_DEPTH and \
+            len(self.board.get_alive(colour)) >= NULL_MOVE_MIN_PIECES
+    
+    def reduce_move(self, i, depth, eliminated):
         """
-        Wrapper function for minimax with alpha-beta pruning for moving phase.
-        Only slightly different to placing algorithm would be better to merge
-        these two functions somehow.
+        Returns true if the i'th (ordered) action at this depth is searched 
+        with a late move reduction first
         """
-        values = {} # dictionary of moves and corresponding minimax values
+        return self.selective and i >= LMR_MIN_INDEX and \
+            depth >= LMR_MIN_DEPTH and not eliminated
+    
+    def negamax(self, colour, depth, ply, a, b, null=True):
+        """
+        Returns the minimax value (fail-hard, within [a, b]) for 'colour' who
+        is to move, 'ply' actions below the root. If 'null' is true the team
+        may try passing first (null move pruning)
+        """
+        self.count_node()
+        
+        if self.stopped or self.cutoff(depth, ply):
+            if depth <= 0 and self.quiescence and not self.stopped:
+                # Only a sample of quiescence searches are traced
+                if self.tracer is not None and \
+                self.tracer.sample('quiescence'):
+                    with self.trace('quiescence', 'quiescence', ply=ply):
+                        return self.quiesce(colour, QUIESCENCE_DEPTH, ply, 
+                                            a, b)
+                return self.quiesce(colour, QUIESCENCE_DEPTH, ply, a, b)
+            return self.evaluate(colour)
+        enemy = BLACK if colour == WHITE else WHITE
         
-        # Iterate through possible moves for each of our pieces
-        for piece in self.board.get_alive(self.colour).values():
-            for move in piece.listmoves(0):
-                oldpos = piece.pos
-                eliminated = piece.make_move(move)
-                values[oldpos, move] = self.max_move(MOVE_DEPTH, -math.inf, math.inf)
-                piece.undo_move(oldpos, eliminated) 
+        # Null move: if passing is still too good for the enemy then so is 
+        # any action
+        if null and b < math.inf and self.null_move_allowed(colour, depth):
+            value = -self.negamax(enemy, depth-1-NULL_MOVE_REDUCTION, ply+1,
+                                  -b, next_value(-b), null=False)
+            if value >= b and not self.stopped:
+                return b
         
-        return max(values, key=values.get)
+        actions = self.ordered_actions(colour)
+        
+        # A team with no moves forfeits its turn
+        if not actions:
+            return max(a, min(b, self.scout(True, enemy, depth-1, ply+1, 
+                                             a, b)))
+        
+        for i, action in enumerate(actions):
+            undo = self.make(colour, action)
+            if a > -math.inf and self.reduce_move(i, depth, undo[1]):
+                value = -self.negamax(enemy, depth-1-LMR_REDUCTION, ply+1,
+                                      -next_value(a), -a)
+                if value > a and not self.stopped:
+                    value = self.scout(False, enemy, depth-1, ply+1, a, b)
+            else:
+                value = self.scout(i == 0, enemy, depth-1, ply+1, a, b)
+            self.unmake(colour, action, undo)
+            
+            a = max(a, value)
+            
+            # Alpha-beta pruning
+            if a >= b:
+                self.record_cutoff(action, depth)
+                return b
+        
+        return a
     
-    def max_move(self, depth, a, b):
+    def quiesce(self, colour, depth, ply, a, b):
         """
-        Finds highest minimax value for each possible action during our 
-        player's (MAX) turn
+        Quiescence search: returns the value (fail-hard, within [a, b]) for
+        'colour' of either stopping here or making a capture, looking at 
+        captures only for up to 'depth' more plies
         """
-        # Cutoff test: reached end game condition or depth limit
-        if self.board.check_win(self.colour) != CONTINUE or depth == 0:
-            return self.evaluate_board(self.board)
+        value = self.evaluate(colour)
+        if depth <= 0 or self.cutoff(1, ply):
+            return value
+        if value >= b:
+            return b
+        a = max(a, value)
+        enemy = BLACK if colour == WHITE else WHITE
         
-        # Iterate through each move for each of MAX's pieces
-        for piece in self.board.get_alive(self.colour).values():
-            for move in piece.listmoves(0):
-                oldpos = piece.pos
-                eliminated = piece.make_move(move)
-                a = max(a, self.min_move(depth-1, a, b))
-                piece.undo_move(oldpos, eliminated)
-                
-                # Alpha-beta pruning
-                if a >= b:
-                    return b
-                
+        for action in self.captures(colour):
+            self.count_node()
+            undo = self.make(colour, action)
+            value = -self.quiesce(enemy, depth-1, ply+1, -b, -a)
+            self.unmake(colour, action, undo)
+            if value >= b:
+                return b
+            a = max(a, value)
         return a
     
-    # Returns lowest minimax value for opponents turn (MIN)
-    def min_move(self, depth, a, b):
+    def record_cutoff(self, action, depth):
         """
-        Returns the lowest minimax value for each possible action during
-        opponent's (MIN) turn
+        Rewards an action which caused a cutoff (history heuristic)
         """
-        # Cutoff test (same as above)
-        if self.board.check_win(self.colour) != CONTINUE or depth == 0:
-            return self.evaluate_board(self.board)
-        
-        # Iterate through each move for each of MIN's pieces
-        for piece in self.board.get_alive(self.enemy).values():
-            for move in piece.listmoves(0):
-                oldpos = piece.pos
-                eliminated = piece.make_move(move)
-                b = min(b, self.max_move(depth-1, a, b))
-                piece.undo_move(oldpos, eliminated)
-                
-                # Alpha-beta pruning
-                if b <= a:
-                    return a
-                
-        return b
\ No newline at end of file
+        self.history[action] = self.history.get(action, 0) + depth * depth
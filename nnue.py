@@ -0,0 +1,220 @@
+"""
+Small neural network evaluation for Watch Your Back! with an incrementally
+updated first layer (NNUE style)
+
+The network's inputs are piece-square features seen from each team's side:
+for every piece, whether it is the team's own or the enemy's and which square
+it is on (mirrored top to bottom for black, so both teams see their starting
+zone at the top), plus the number of shrinks. The first layer is a sum of one
+row of W1 for each of these features, so rather than being recomputed for
+every position it is kept in an Accumulator attached to the Board. The board
+records the squares set_square changes in the accumulator's 'dirty' dict (in
+the same way as the threat map and move cache), and when a position is
+evaluated only the rows of the pieces placed, moved, captured or restored
+since the last evaluation are added or subtracted. Interior nodes of a search
+which are never evaluated cost nothing, and an action undone before the next
+evaluation cancels out.
+
+The two accumulator halves (that of the team evaluated for first, which
+for Player.evaluate_board is the player itself) go through a clipped
+ReLU, a hidden layer of the same kind and a linear output, giving a value in
+the same units as Player.evaluate_board. The later layers run with NumPy.
+Weights are stored in a .npz file with the arrays w1 (FEATURES x H), b1 (H),
+w2 (2H x H2), b2 (H2), w3 (H2) and b3 (a single value), which train_nnue.py
+fits to a position database; no trained weights come with the player. NumPy
+is only imported once a network is loaded, and load_network returns None
+without it.
+"""
+import os
+
+from watchyourback import WHITE, BLACK
+
+# NumPy, imported by import_numpy when a network is first loaded so that
+# players without one never pay for it
+np = None
+
+# CONSTANTS
+SQUARES = 64
+SHRINKS = 3
+FEATURES = 2*SQUARES + SHRINKS # own pieces, enemy pieces, number of shrinks
+
+# Row of the combined first layer for each (square, team) feature, as seen
+# from white (first half of the accumulator) and black (second half)
+FEATURE_INDEX = {((x, y), colour): index
+                 for index, (colour, y, x) in enumerate(
+                     (colour, y, x) for colour in [WHITE, BLACK]
+                     for y in range(8) for x in range(8))}
+
+# HELPER FUNCTIONS
+def import_numpy():
+    """
+    Imports NumPy if it hasn't been already, returning false if it isn't
+    installed
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+def feature(pos, colour, perspective):
+    """
+    Returns the index of the input feature for a piece of 'colour' on 'pos'
+    as seen by the team 'perspective'
+    """
+    x, y = pos
+    if perspective == BLACK:
+        y = 7 - y
+    own = 0 if colour == perspective else 1
+    return own*SQUARES + y*8 + x
+
+def load_network(path):
+    """
+    Returns the Network stored in the .npz file at 'path', or None if the
+    file doesn't exist or NumPy isn't installed
+    """
+    if not os.path.exists(path) or not import_numpy():
+        return None
+    with np.load(path) as data:
+        return Network(data['w1'], data['b1'], data['w2'], data['b2'],
+                       data['w3'], data['b3'])
+
+def random_network(hidden=32, hidden2=16, seed=None):
+    """
+    Returns a Network with small random weights, as a starting point for
+    training
+    """
+    import_numpy()
+    rng = np.random.default_rng(seed)
+    return Network(rng.normal(0, 0.1, (FEATURES, hidden)),
+                   np.zeros(hidden),
+                   rng.normal(0, 1 / np.sqrt(2*hidden), (2*hidden, hidden2)),
+                   np.zeros(hidden2),
+                   rng.normal(0, 1 / np.sqrt(hidden2), hidden2),
+                   np.zeros(1))
+
+# CLASSES
+class Network:
+    """
+    Weights of an evaluation network. 'table' holds the first layer for
+    both perspectives side by side, one row per (square, team) in the order
+    of FEATURE_INDEX followed by one row per number of shrinks
+    """
+    def __init__(self, w1, b1, w2, b2, w3, b3):
+        import_numpy()
+        self.w1 = np.asarray(w1, dtype=np.float64)
+        self.b1 = np.asarray(b1, dtype=np.float64)
+        self.w2 = np.asarray(w2, dtype=np.float64)
+        self.b2 = np.asarray(b2, dtype=np.float64)
+        self.w3 = np.asarray(w3, dtype=np.float64)
+        self.b3 = float(np.asarray(b3).reshape(-1)[0])
+        if self.w1.shape[0] != FEATURES:
+            raise ValueError(f"w1 has {self.w1.shape[0]} rows, "
+                             f"expected {FEATURES}")
+        self.hidden = hidden = self.w1.shape[1]
+
+        table = np.empty((len(FEATURE_INDEX) + SHRINKS, 2*hidden),
+                         dtype=np.float64)
+        for (pos, colour), index in FEATURE_INDEX.items():
+            table[index, :hidden] = self.w1[feature(pos, colour, WHITE)]
+            table[index, hidden:] = self.w1[feature(pos, colour, BLACK)]
+        for shrinks in range(SHRINKS):
+            row = self.w1[2*SQUARES + shrinks]
+            table[len(FEATURE_INDEX) + shrinks] = np.concatenate([row, row])
+        self.table = table
+        self.bias = np.concatenate([self.b1, self.b1])
+
+        # Second layer with its rows in the order of the accumulator halves
+        # for each team evaluated for (its own half first)
+        self.layer2 = {WHITE: self.w2,
+                       BLACK: np.concatenate([self.w2[hidden:],
+                                              self.w2[:hidden]])}
+
+    def save(self, path):
+        np.savez(path, w1=self.w1, b1=self.b1, w2=self.w2, b2=self.b2,
+                 w3=self.w3, b3=np.array([self.b3]))
+
+    def attach(self, board):
+        """
+        Returns the board's Accumulator for this network, attaching a new
+        one if it has none (or one for a different network)
+        """
+        accumulator = board.accumulator
+        if accumulator is None or accumulator.network is not self:
+            accumulator = board.accumulator = Accumulator(self, board)
+        return accumulator
+
+    def accumulate(self, board):
+        """
+        Returns the first layer (both perspectives) for a board from scratch
+        """
+        rows = [FEATURE_INDEX[pos, colour]
+                for colour in [WHITE, BLACK]
+                for pos in board.get_alive(colour)]
+        rows.append(len(FEATURE_INDEX) + board.numOfShrinks)
+        return self.bias + self.table[rows].sum(axis=0)
+
+    def forward(self, values, colour):
+        """
+        Returns the output of the network for accumulator 'values' with
+        'colour' to evaluate for
+        """
+        layer = np.minimum(np.maximum(values, 0.0), 1.0) @ self.layer2[colour]
+        layer += self.b2
+        return float(np.minimum(np.maximum(layer, 0.0), 1.0) @ self.w3) \
+               + self.b3
+
+    def evaluate(self, board, colour):
+        """
+        Returns the value of the board for 'colour', bringing its
+        accumulator up to date first
+        """
+        return self.forward(self.attach(board).refresh(), colour)
+
+class Accumulator:
+    """
+    First layer of a Network for the position on a Board, kept up to date
+    from the squares changed since the last refresh. Board.set_square adds
+    each changed square to 'dirty' with its value at the last refresh
+    """
+    def __init__(self, network, board):
+        self.network = network
+        self.board = board
+        self.values = network.accumulate(board)
+        self.shrinks = board.numOfShrinks
+        self.dirty = {}
+
+    def refresh(self):
+        """
+        Applies the changes since the last refresh and returns the values
+        """
+        board = self.board
+        if board.numOfShrinks != self.shrinks:
+            # Shrinking can't be undone, so start again from scratch
+            self.values = self.network.accumulate(board)
+            self.shrinks = board.numOfShrinks
+            self.dirty = {}
+            return self.values
+
+        dirty = self.dirty
+        if dirty:
+            grid = board.grid
+            added, removed = [], []
+            for pos, old in dirty.items():
+                new = grid[pos]
+                if new == old:
+                    continue
+                if old == WHITE or old == BLACK:
+                    removed.append(FEATURE_INDEX[pos, old])
+                if new == WHITE or new == BLACK:
+                    added.append(FEATURE_INDEX[pos, new])
+            table = self.network.table
+            for row in added:
+                self.values += table[row]
+            for row in removed:
+                self.values -= table[row]
+            self.dirty = {}
+        return self.values
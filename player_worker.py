@@ -0,0 +1,251 @@
+"""
+Runs a Player class in its own long-lived process
+
+The worker loads a player module once and then serves requests read from its
+standard input, replying on its standard output, so the same process can play
+any number of games without re-importing the module. Each reply includes the
+CPU time the worker spent on the request and its peak resident memory during
+the current game (less what the interpreter used before the player module was
+imported, as the referee measures it), so that every player's resources are
+accounted for separately and a reused worker isn't charged for its earlier
+games.
+
+Messages are framed as a 1 byte opcode and a 2 byte payload length followed
+by the payload. Actions use the encoding of gamerecord.py, where the length
+tells them apart: no bytes for a forfeit (None), 1 byte for a placement and
+2 bytes for a move. An action which isn't one of these (e.g. a square off the
+board) is sent as the single byte gamerecord.UNENCODABLE and decoded as
+gamerecord.INVALID, which the referee rejects as an invalid action.
+
+Usage: python player_worker.py MODULE
+"""
+import gc
+import os
+import sys
+import time
+import random
+import struct
+import importlib
+import subprocess
+
+from gamerecord import encode_square, decode_square, valid_square
+from gamerecord import UNENCODABLE, INVALID
+
+# CONSTANTS
+NEW_GAME, ACTION, UPDATE, QUIT = b'n', b'a', b'u', b'q'
+REPLY, ERROR = b'r', b'e'
+COLOURS = ['white', 'black']
+NO_SEED = -1
+
+FRAME = struct.Struct('<cH')
+NEW_GAME_ARGS = struct.Struct('<Bq')  # colour index, seed
+TURNS = struct.Struct('<H')
+STATS = struct.Struct('<dd')          # CPU seconds, peak memory (MB)
+
+WORKER_PATH = os.path.abspath(__file__)
+
+# HELPER FUNCTIONS
+def encode_action(action):
+    """
+    Returns bytes for a placing (x,y) or moving ((a,b),(c,d)) action or None,
+    or the byte UNENCODABLE for anything else
+    """
+    if action is None:
+        return b''
+    if valid_square(action):
+        return bytes([encode_square(action)])
+    if isinstance(action, (tuple, list)) and len(action) == 2 and \
+    all(valid_square(pos) for pos in action):
+        oldpos, newpos = action
+        return bytes([encode_square(oldpos), encode_square(newpos)])
+    return bytes([UNENCODABLE])
+
+def decode_action(data):
+    """
+    Returns the action encoded by encode_action (INVALID for UNENCODABLE)
+    """
+    if len(data) == 0:
+        return None
+    if data[0] == UNENCODABLE:
+        return INVALID
+    if len(data) == 1:
+        return decode_square(data[0])
+    return (decode_square(data[0]), decode_square(data[1]))
+
+def write_frame(stream, opcode, payload=b''):
+    stream.write(FRAME.pack(opcode, len(payload)) + payload)
+    stream.flush()
+
+def read_frame(stream):
+    """
+    Returns (opcode, payload) of the next frame, or (None, b'') if the
+    stream has been closed
+    """
+    header = stream.read(FRAME.size)
+    if len(header) < FRAME.size:
+        return None, b''
+    opcode, length = FRAME.unpack(header)
+    return opcode, stream.read(length)
+
+def memory_usage():
+    """
+    Returns (current, peak) resident memory of this process in MB (VmRSS
+    and VmHWM), or zeros where they can't be measured. Unlike VmPeak, the
+    peak can be reset (see reset_peak) so it can be measured per game
+    """
+    usage = {}
+    try:
+        with open('/proc/self/status') as proc_status:
+            for line in proc_status:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    usage[line[:5]] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return usage.get('VmRSS', 0.0), usage.get('VmHWM', 0.0)
+
+def reset_peak():
+    """
+    Resets the peak resident memory to the current usage. Where this isn't
+    supported the peak stays that of the whole life of the process
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+def load_player(modulename):
+    """
+    Returns the Player class of the named module, or another class of it
+    named after a colon ('module:Class')
+    """
+    modulename, _, classname = modulename.partition(':')
+    return getattr(importlib.import_module(modulename), classname or 'Player')
+
+# WORKER PROCESS
+def serve(modulename, requests, replies):
+    """
+    Loads the named player module then serves requests until QUIT or the
+    request stream is closed. Memory is reported as the peak since the
+    current game started, less the usage from before the module was
+    imported (so the module is charged to the player, as in the referee's
+    own process, but earlier games aren't)
+    """
+    gc.collect()
+    baseline, _ = memory_usage()
+    player_class = load_player(modulename)
+    player = None
+
+    while True:
+        opcode, payload = read_frame(requests)
+        if opcode is None or opcode == QUIT:
+            return
+
+        gc.collect() # off the clock
+        start = time.process_time()
+        try:
+            if opcode == NEW_GAME:
+                colour, seed = NEW_GAME_ARGS.unpack(payload)
+                if seed != NO_SEED:
+                    random.seed(seed)
+                player = None
+                gc.collect()
+                reset_peak()
+                player = player_class(COLOURS[colour])
+                result = b''
+            elif opcode == ACTION:
+                turns, = TURNS.unpack(payload)
+                result = encode_action(player.action(turns))
+            elif opcode == UPDATE:
+                player.update(decode_action(payload))
+                result = b''
+            else:
+                raise ValueError(f'unknown request {opcode!r}')
+        except Exception as e:
+            write_frame(replies, ERROR, repr(e).encode('utf-8')[:60000])
+            continue
+        elapsed = time.process_time() - start
+        _, peak = memory_usage()
+        stats = STATS.pack(elapsed, max(peak - baseline, 0.0))
+        write_frame(replies, REPLY, stats + result)
+
+def main():
+    # Keep the real stdout for replies and send anything the player prints
+    # to stderr instead so it can't corrupt the protocol
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    serve(sys.argv[1], sys.stdin.buffer, replies)
+
+# CLIENT
+class WorkerError(Exception):
+    """For when a player raises an exception or its worker dies"""
+
+def parse_reply(opcode, payload):
+    """
+    Returns (result bytes, CPU seconds, peak MB) from a reply frame
+    """
+    if opcode is None:
+        raise WorkerError('player worker exited')
+    if opcode == ERROR:
+        raise WorkerError(payload.decode('utf-8'))
+    elapsed, peak = STATS.unpack_from(payload)
+    return payload[STATS.size:], elapsed, peak
+
+class WorkerClient:
+    """
+    Starts and talks to a worker process for the named player module. Each
+    request returns the CPU time and peak memory reported by the worker
+    """
+    def __init__(self, modulename):
+        self.modulename = modulename
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_PATH, modulename],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            cwd=os.path.dirname(WORKER_PATH))
+
+    def _request(self, opcode, payload=b''):
+        write_frame(self.process.stdin, opcode, payload)
+        return parse_reply(*read_frame(self.process.stdout))
+
+    def new_game(self, colour, seed=None):
+        """
+        Creates a new Player for 'colour' ('white' or 'black'). Returns
+        (CPU seconds, peak MB)
+        """
+        seed = NO_SEED if seed is None else seed
+        payload = NEW_GAME_ARGS.pack(COLOURS.index(colour), seed)
+        _, elapsed, peak = self._request(NEW_GAME, payload)
+        return elapsed, peak
+
+    def action(self, turns):
+        """
+        Returns (action, CPU seconds, peak MB)
+        """
+        result, elapsed, peak = self._request(ACTION, TURNS.pack(turns))
+        return decode_action(result), elapsed, peak
+
+    def update(self, action):
+        """
+        Returns (CPU seconds, peak MB)
+        """
+        _, elapsed, peak = self._request(UPDATE, encode_action(action))
+        return elapsed, peak
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                write_frame(self.process.stdin, QUIT)
+            except OSError:
+                pass
+            self.process.stdin.close()
+            self.process.wait()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+if __name__ == '__main__':
+    main()
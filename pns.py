@@ -0,0 +1,211 @@
+"""
+Proof-number search for forced wins in the moving phase of Watch Your Back!
+
+Board.check_win gives an exact result as soon as a team drops below two
+pieces, so a forced sequence of eliminations can be proven outright instead
+of being estimated by the evaluation function. Proof-number search grows the
+game tree towards the position which is cheapest to prove (or disprove),
+which finds forced wins in far fewer nodes than a full width alpha-beta
+search to the same depth.
+
+The search runs on the Player's Board using make_move/undo_move, so it
+stops at the next shrink (which can't be undone): positions past it, and
+positions repeated along a line of play, are treated as not won. Because of
+this only proofs are exact, a disproof just means no forced win was found
+within the horizon.
+"""
+import math
+import time
+
+from watchyourback import OPPONENT, WIN, CONTINUE
+
+# CONSTANTS
+INF = math.inf
+MAX_NODES = 20000 # default node budget
+CHECK_NODES = 256 # how often (in nodes) to check the clock
+
+# CLASSES
+class Node:
+    """
+    A node of the proof tree: the position after 'action' (a move, or None
+    when the team had no moves and forfeited its turn). 'attacking' is true
+    if the attacker is to move (an OR node). 'children' is None until the
+    node is expanded
+    """
+    __slots__ = ['action', 'parent', 'key', 'attacking', 'children', 'pn',
+                 'dn']
+
+    def __init__(self, action, parent, key, attacking):
+        self.action = action
+        self.parent = parent
+        self.key = key
+        self.attacking = attacking
+        self.children = None
+        self.pn = 1
+        self.dn = 1
+
+    def set_result(self, proven):
+        """
+        Marks the node as proven (a forced win for the attacker) or
+        disproven
+        """
+        self.pn, self.dn = (0, INF) if proven else (INF, 0)
+
+    def update(self):
+        """
+        Recomputes the proof and disproof numbers from the children
+        """
+        if self.attacking:
+            self.pn = min(child.pn for child in self.children)
+            self.dn = sum(child.dn for child in self.children)
+        else:
+            self.pn = sum(child.pn for child in self.children)
+            self.dn = min(child.dn for child in self.children)
+
+    def solved(self):
+        return self.pn == 0 or self.dn == 0
+
+class ProofSearch:
+    """
+    Proof-number search on 'board' for whether 'attacker' can force a win,
+    with 'colour' to move on turn 'turns' of the moving phase. Positions on
+    turn 'horizon' or later are not searched (the next shrink).
+    """
+    def __init__(self, board, attacker, colour, turns, horizon=INF):
+        self.board = board
+        self.attacker = attacker
+        self.colour = colour
+        self.turns = turns
+        self.horizon = horizon
+        self.nodes = 0
+        self.root = None
+
+    def run(self, max_nodes=MAX_NODES, deadline=INF):
+        """
+        Searches until the root is solved, 'max_nodes' nodes have been
+        created or the CPU clock passes 'deadline'. Returns true if a
+        forced win for the attacker was proven
+        """
+        self.nodes = 0
+        self.root = Node(None, None, self.key(self.colour),
+                         self.colour == self.attacker)
+        self.evaluate(self.root, 0, set())
+
+        checked = 0
+        while not self.root.solved() and self.nodes < max_nodes:
+            if self.nodes >= checked + CHECK_NODES:
+                checked = self.nodes
+                if time.process_time() > deadline:
+                    break
+            self.iterate()
+
+        return self.root.pn == 0
+
+    def key(self, colour):
+        """
+        Returns a key identifying the current position with 'colour' to move
+        """
+        return self.board.get_masks() + (colour,)
+
+    def evaluate(self, node, depth, path):
+        """
+        Sets the result of a new node if it is already decided: the game is
+        over, the next shrink has been reached or the position repeats one
+        earlier in 'path'
+        """
+        result = self.board.check_win(self.attacker)
+        if result != CONTINUE:
+            node.set_result(result == WIN)
+        elif self.turns + depth >= self.horizon or node.key in path:
+            node.set_result(False)
+
+    def iterate(self):
+        """
+        Expands the most proving node then updates the proof and disproof
+        numbers of its ancestors
+        """
+        # Descend to the most proving node, playing out its line
+        node = self.root
+        path = {node.key}
+        line = []
+        colour = self.colour
+        while node.children is not None:
+            if node.attacking:
+                node = min(node.children, key=lambda child: child.pn)
+            else:
+                node = min(node.children, key=lambda child: child.dn)
+            line.append((node.action, self.make(node.action)))
+            colour = OPPONENT[colour]
+            path.add(node.key)
+
+        self.expand(node, colour, len(line), path)
+
+        # Back up to the root, freeing the subtrees of solved nodes
+        while node.parent is not None:
+            node = node.parent
+            node.update()
+            for child in node.children:
+                if child.solved():
+                    child.children = ()
+
+        for action, undo in reversed(line):
+            self.unmake(action, undo)
+
+    def expand(self, node, colour, depth, path):
+        """
+        Creates a child for every action of 'colour' (who is to move at
+        'node', 'depth' turns from the root)
+        """
+        enemy = OPPONENT[colour]
+        actions = [(pos, move) for pos in self.board.get_alive(colour)
+                   for move in self.board.get_moves(pos)]
+        if not actions:
+            actions = [None]
+
+        node.children = []
+        for action in actions:
+            undo = self.make(action)
+            child = Node(action, node, self.key(enemy),
+                         enemy == self.attacker)
+            self.evaluate(child, depth + 1, path)
+            self.unmake(action, undo)
+            node.children.append(child)
+            self.nodes += 1
+        node.update()
+
+    def make(self, action):
+        """
+        Plays a move on the board, returning (piece, eliminated) for unmake
+        """
+        if action is None:
+            return None
+        oldpos, newpos = action
+        piece = self.board.get_piece(oldpos)
+        return piece, piece.make_move(newpos)
+
+    def unmake(self, action, undo):
+        if action is not None:
+            piece, eliminated = undo
+            piece.undo_move(action[0], eliminated)
+
+    def winning_action(self):
+        """
+        Returns the attacker's first move of a proven forced win, or None
+        """
+        if self.root is None or self.root.pn != 0 or not self.root.attacking:
+            return None
+        for child in self.root.children:
+            if child.pn == 0:
+                return child.action
+        return None
+
+    def losing_actions(self):
+        """
+        Returns the defender's moves at the root which are proven to lose by
+        force
+        """
+        if self.root is None or self.root.attacking or \
+        self.root.children is None:
+            return []
+        return [child.action for child in self.root.children
+                if child.pn == 0]
@@ -0,0 +1,314 @@
+"""
+Memory-mapped database of Watch Your Back! positions
+
+Each position is stored as a fixed-width record (both teams' piece masks,
+number of shrinks, turn, phase plus the game result and an optional search
+score) in a flat file which is opened with numpy.memmap, so even very large
+databases open instantly and their pages are shared between processes that
+read the same file. A second file holds the position hashes in sorted order
+along with the row each one refers to, allowing O(log n) lookups and
+deduplication when new positions are appended. A position reached more than
+once is stored once, with the number of times it was reached in games with a
+known result and the sum of those results, so the mean result tune.py fits
+to counts every game rather than only the first.
+"""
+import os
+import numpy as np
+
+import gamerecord
+
+# CONSTANTS
+RECORD = np.dtype([('hash', '<u8'), ('white', '<u8'), ('black', '<u8'),
+                   ('shrinks', 'u1'), ('turns', '<u2'), ('phase', 'u1'),
+                   ('result', 'i1'), ('score', '<f4'), ('games', '<u4'),
+                   ('result_sum', '<i4')])
+INDEX = np.dtype([('hash', '<u8'), ('row', '<u8')])
+
+# Values stored in 'phase'
+PLACING_CODE, MOVING_CODE = range(2)
+PHASES = {gamerecord.PLACING: PLACING_CODE, gamerecord.MOVING: MOVING_CODE}
+
+# Values stored in 'result' (always from white's point of view). 'result' is
+# the result of the first game stored with the position, while 'games' and
+# 'result_sum' count every time it was reached in a game with a known result
+WHITE_WIN, DRAW, BLACK_WIN, UNKNOWN = 1, 0, -1, -128
+RESULTS = {'W': WHITE_WIN, 'B': BLACK_WIN, 'draw': DRAW, None: UNKNOWN}
+
+# HELPER FUNCTIONS
+def _mix(values):
+    """
+    SplitMix64 finaliser applied to an array of uint64 values
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        values = values ^ (values >> np.uint64(30))
+        values = values * np.uint64(0xBF58476D1CE4E5B9)
+        values = values ^ (values >> np.uint64(27))
+        values = values * np.uint64(0x94D049BB133111EB)
+        values = values ^ (values >> np.uint64(31))
+    return values
+
+def position_hash(white, black, shrinks, turns, phase):
+    """
+    Returns an array of 64 bit hashes identifying positions by their piece
+    masks, number of shrinks, phase and the team to move (parity of turns).
+    Takes arrays (or scalars) of equal length
+    """
+    state = (np.asarray(shrinks, dtype=np.uint64)
+             | (np.asarray(phase, dtype=np.uint64) << np.uint64(2))
+             | ((np.asarray(turns, dtype=np.uint64) & np.uint64(1))
+                << np.uint64(3)))
+    with np.errstate(over='ignore'):
+        return (_mix(white) ^ _mix(np.asarray(black, dtype=np.uint64)
+                                   ^ np.uint64(0x9E3779B97F4A7C15))
+                ^ _mix(state + np.uint64(0x632BE59BD9B4E019)))
+
+def make_records(white, black, shrinks, turns, phase, result=UNKNOWN,
+                 score=np.nan):
+    """
+    Returns a RECORD array (with hashes filled in) from arrays of fields
+    """
+    white = np.atleast_1d(np.asarray(white, dtype=np.uint64))
+    records = np.zeros(len(white), dtype=RECORD)
+    records['white'] = white
+    records['black'] = black
+    records['shrinks'] = shrinks
+    records['turns'] = turns
+    records['phase'] = phase
+    records['result'] = result
+    records['score'] = score
+    known = records['result'] != UNKNOWN
+    records['games'] = known
+    records['result_sum'] = np.where(known, records['result'], 0)
+    records['hash'] = position_hash(records['white'], records['black'],
+                                    records['shrinks'], records['turns'],
+                                    records['phase'])
+    return records
+
+def board_record(board, turns, phase, result=UNKNOWN, score=np.nan):
+    """
+    Returns a single RECORD array entry for an instance of Board
+    """
+    white, black = board.get_masks()
+    return make_records([white], [black], board.numOfShrinks, turns,
+                        PHASES[phase], result, score)
+
+def game_positions(record):
+    """
+    Returns a RECORD array of the position before each action of a
+    GameRecord (the position seen by the team about to act), labelled with
+    the result of the game
+    """
+    n = len(record.actions)
+    if record.ending == 'invalid':
+        n -= 1
+    fields = np.zeros((max(n, 0), 4), dtype=np.uint64)
+    shrinks = np.zeros(max(n, 0), dtype=np.uint8)
+
+    # Position before action i is the board after action i-1
+    for index, _, board in record.replay(n - 1 if n > 0 else 0):
+        fields[index+1, :2] = board.get_masks()
+        shrinks[index+1] = board.numOfShrinks
+    for index in range(n):
+        phase, turns = gamerecord.turn_info(index)
+        fields[index, 2] = turns
+        fields[index, 3] = PHASES[phase]
+
+    return make_records(fields[:, 0], fields[:, 1], shrinks, fields[:, 2],
+                        fields[:, 3], RESULTS[record.winner])
+
+def _open(path, dtype, start=0):
+    """
+    Memory-maps the file at 'path' from row 'start' on as a read only array
+    of 'dtype', or returns an empty array if there are no rows there
+    """
+    offset = start * dtype.itemsize
+    if not os.path.exists(path) or os.path.getsize(path) <= offset:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset)
+
+def merge_duplicates(records):
+    """
+    Returns the records of a RECORD array with the repeats of a position
+    removed (keeping its first record, in their original order) and the
+    games and results of every repeat added to the one kept
+    """
+    _, first, inverse = np.unique(records['hash'], return_index=True,
+                                  return_inverse=True)
+    if len(first) == len(records):
+        return records
+    games = np.bincount(inverse, weights=records['games'])
+    result_sum = np.bincount(inverse, weights=records['result_sum'])
+    merged = np.array(records[first])
+    merged['games'] = games
+    merged['result_sum'] = result_sum
+    return merged[np.argsort(first)]
+
+def build_index(records, start=0):
+    """
+    Returns a sorted INDEX array for a RECORD array whose first row is row
+    'start' of the database
+    """
+    index = np.zeros(len(records), dtype=INDEX)
+    index['hash'] = records['hash']
+    index['row'] = np.arange(start, start + len(records))
+    index.sort(order='hash')
+    return index
+
+def write_replace(path, array):
+    """
+    Writes an array to the file at 'path' in one step (through a temporary
+    file) so readers never see it half written
+    """
+    temp = path + '.tmp'
+    array.tofile(temp)
+    os.replace(temp, path)
+
+# CLASSES
+class PositionDB:
+    """
+    A class representing a position database stored at 'path' (records) and
+    'path'.idx (sorted hash index). Positions are unique by hash; appending
+    a position that is already stored keeps the existing record and adds
+    the new one's games and results to it
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self._reload()
+        if len(self.index) != len(self.records):
+            self.rebuild_index()
+
+    def _reload(self):
+        """
+        (Re)maps both files, e.g. after they have been appended to
+        """
+        self.records = _open(self.path, RECORD)
+        self.index = _open(self.index_path, INDEX)
+
+    def rebuild_index(self):
+        """
+        Rebuilds the index from the records. Needed if an append was
+        interrupted after writing records but before the index was replaced,
+        leaving records the index doesn't know about (which may repeat
+        positions that are already stored)
+        """
+        records = merge_duplicates(np.array(self.records))
+        if len(records) < len(self.records):
+            write_replace(self.path, records)
+        write_replace(self.index_path, build_index(records))
+        self._reload()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    def find(self, hashes):
+        """
+        Returns an array of rows for each hash in 'hashes', -1 where the hash
+        is not stored
+        """
+        hashes = np.atleast_1d(np.asarray(hashes, dtype=np.uint64))
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        if len(self.index) == 0:
+            return rows
+        found = np.searchsorted(self.index['hash'], hashes)
+        found = np.minimum(found, len(self.index) - 1)
+        hit = self.index['hash'][found] == hashes
+        rows[hit] = self.index['row'][found[hit]]
+        return rows
+
+    def lookup(self, board, turns, phase):
+        """
+        Returns the stored record for an instance of Board, or None
+        """
+        row = self.find(board_record(board, turns, phase)['hash'])[0]
+        return None if row < 0 else self.records[row]
+
+    def append(self, records):
+        """
+        Appends a RECORD array, skipping positions that are already stored
+        (or repeated within 'records'). Returns the number of new positions
+        """
+        return self.extend([records])
+
+    def extend(self, batches):
+        """
+        Appends every RECORD array in the iterable 'batches'. Positions that
+        are already stored or repeated are stored once, with the games and
+        results of the repeats added to the record kept. Each batch is
+        written out as it comes, but the index is only merged and rewritten
+        once at the end, so loading N positions costs O(N) rather than a
+        full index rewrite per batch. Returns the number of new positions
+        """
+        start = len(self.records)
+        stored_rows, stored_games, stored_sums = [], [], []
+        with open(self.path, 'ab') as file:
+            for records in batches:
+                records = merge_duplicates(np.asarray(records, dtype=RECORD))
+                rows = self.find(records['hash'])
+                stored = rows >= 0
+                stored_rows.append(rows[stored])
+                stored_games.append(records['games'][stored])
+                stored_sums.append(records['result_sum'][stored])
+                file.write(records[~stored].tobytes())
+
+        # Merge positions repeated between batches, which the index didn't
+        # know about yet
+        added = _open(self.path, RECORD, start)
+        merged = merge_duplicates(added)
+        if len(merged) < len(added):
+            del added
+            os.truncate(self.path, start * RECORD.itemsize)
+            with open(self.path, 'ab') as file:
+                file.write(merged.tobytes())
+
+        # Add the games of positions which were already stored to their
+        # records, before the index is replaced: if we are interrupted
+        # before then, the index is rebuilt from the records when the
+        # database is next opened
+        rows = np.concatenate(stored_rows) if stored_rows else []
+        if len(rows):
+            records = np.memmap(self.path, dtype=RECORD, mode='r+',
+                                shape=(start,))
+            np.add.at(records['games'], rows, np.concatenate(stored_games))
+            np.add.at(records['result_sum'], rows,
+                      np.concatenate(stored_sums))
+            records.flush()
+            del records
+        if len(merged) == 0:
+            self._reload()
+            return 0
+
+        # Merge the new hashes into the sorted index, replacing the file in
+        # one step so readers never see a half written index
+        entries = build_index(merged, start)
+        del merged
+        positions = np.searchsorted(self.index['hash'], entries['hash'])
+        write_replace(self.index_path,
+                      np.insert(np.asarray(self.index), positions, entries))
+        self._reload()
+        return len(entries)
+
+    def add_games(self, games, batch=4096):
+        """
+        Appends the positions of every GameRecord in 'games' (e.g. from
+        gamerecord.read_records), reading them in batches of about 'batch'
+        positions. Returns the number of new positions
+        """
+        def batches():
+            pending = []
+            size = 0
+            for game in games:
+                positions = game_positions(game)
+                pending.append(positions)
+                size += len(positions)
+                if size >= batch:
+                    yield np.concatenate(pending)
+                    pending, size = [], 0
+            if pending:
+                yield np.concatenate(pending)
+
+        return self.extend(batches())
@@ -93,8 +93,12 @@ class Player:
         if self.turns in SHRINK:
             self.board.shrink()
         
+        # Opponent had no moves available and forfeited its turn
+        if action is None:
+            pass
+        
         # First element of action has length 1, indicating it is a placing move
-        if isinstance(action[0], int):
+        elif isinstance(action[0], int):
             self.board.place_piece(self.enemy, action)
         
         # Otherwise must be a nested tuples indicating a move    
@@ -5,9 +5,15 @@ version: v1.2
 """
 
 import gc
+import os
 import time
 import argparse
 import importlib
+import contextlib
+import tracemalloc
+
+import gamerecord
+import player_worker
 
 VERSION_INFO = """Referee version 1.2 (released May 07 2018)
 Plays a basic game of Watch Your Back! between two Player classes
@@ -24,14 +30,37 @@ def main():
 
     # initialise the game and players
     game  = _Game()
+    record = _new_record(options)
+    if options.memory:
+        tracemalloc.start(MEMORY_FRAMES)
     try:
-        white = _Player(options.white_player,'white',options.time,options.space)
-        black = _Player(options.black_player,'black',options.time,options.space)
+        if options.workers:
+            white = _WorkerPlayer(options.white_module, 'white',
+                options.time, options.space)
+            black = _WorkerPlayer(options.black_module, 'black',
+                options.time, options.space)
+        else:
+            white = _Player(options.white_player,'white',options.time,
+                options.space, options.memory)
+            black = _Player(options.black_player,'black',options.time,
+                options.space, options.memory)
     except _ResourceLimitException as e:
         print(f"resource limit exceeded during initialisation:", e)
+        _save_record(options, record, game, 'resource')
         return
 
     # now, play the game!
+    try:
+        _play(options, game, record, white, black)
+    finally:
+        white.close()
+        black.close()
+        if options.memory:
+            white.memory.report()
+            black.memory.report()
+
+def _play(options, game, record, white, black):
+    """Play out a game between two initialised players."""
     player, opponent = white, black # white has first move
     print(game)
 
@@ -45,6 +74,7 @@ def main():
             # looks like one of the players exceeded their resource limits
             # during calculation of 'action'---that's the end of this game, then
             print(f"resource limit exceeded during action():", e)
+            _save_record(options, record, game, 'resource')
             return
         
         try:
@@ -54,6 +84,9 @@ def main():
             # print the error message
             print(f"invalid action ({game.loser}):", e)
             break
+        finally:
+            if record is not None:
+                record.add(action, player.timer.elapsed)
         
         print(game)
         
@@ -63,12 +96,15 @@ def main():
             # looks like one of the players exceeded their resource limits
             # during calculation of 'update'
             print(f"resource limit exceeded during update():", e)
+            _save_record(options, record, game, 'resource')
             return
         
         # other player's turn!
         player, opponent = opponent, player
 
     print(f'winner: {game.winner}!')
+    _save_record(options, record, game,
+        'invalid' if game.phase == 'invalid' else 'completed')
 
 # --------------------------------------------------------------------------- #
 
@@ -84,6 +120,10 @@ DELAY_NOVALUE = 1.0 # seconds
 SPACE_LIMIT_NOVALUE = 100.0 # MB (each)
 TIME_LIMIT_NOVALUE  = 120.0 # seconds (each)
 
+# memory accounting (-m): frames kept per allocation, sites in the report
+MEMORY_FRAMES = 1
+MEMORY_TOP_SITES = 10
+
 
 class _Options:
     """
@@ -91,13 +131,15 @@ class _Options:
     
     --- help message: ---
     usage: referee.py [-h] [-d [DELAY]] [-s [SPACE_LIMIT]] [-t [TIME_LIMIT]]
-                      white_module black_module
+                      [-r RECORD] [-w] [-m] white_module black_module
 
     Plays a game of Watch Your Back! between two Player classes
 
     positional arguments:
       white_module          full name of module containing White Player class
+                            (or module:Class to use another class)
       black_module          full name of module containing Black Player class
+                            (or module:Class to use another class)
 
     optional arguments:
       -h, --help            show this help message and exit
@@ -107,6 +149,11 @@ class _Options:
                             limit on memory space (float, MB) for each player
       -t [TIME_LIMIT], --time_limit [TIME_LIMIT]
                             limit on CPU time (float, seconds) for each player
+      -r RECORD, --record RECORD
+                            append a record of the game to this file
+      -w, --workers         run each player in its own worker process
+      -m, --memory          account for each player's memory allocations with
+                            tracemalloc (slows the players down)
     ---------------------
     """
     def __init__(self):
@@ -114,9 +161,11 @@ class _Options:
                 description="Plays a game of Watch Your Back! between two "
                     "Player classes")
         parser.add_argument('white_module',
-                help="full name of module containing White Player class")
+                help="full name of module containing White Player class "
+                    "(or module:Class to use another class)")
         parser.add_argument('black_module',
-                help="full name of module containing Black Player class")
+                help="full name of module containing Black Player class "
+                    "(or module:Class to use another class)")
         parser.add_argument('-d', '--delay',
                 type=float, default=DELAY_DEFAULT, nargs="?",
                 help="how long (float, seconds) to wait between turns")
@@ -126,11 +175,32 @@ class _Options:
         parser.add_argument('-t', '--time_limit',
                 type=float, default=TIME_LIMIT_DEFAULT,  nargs="?",
                 help="limit on CPU time (float, seconds) for each player")
+        parser.add_argument('-r', '--record',
+                default=None,
+                help="append a record of the game to this file")
+        parser.add_argument('-w', '--workers',
+                action='store_true',
+                help="run each player in its own worker process")
+        parser.add_argument('-m', '--memory',
+                action='store_true',
+                help="account for each player's memory allocations with "
+                    "tracemalloc (slows the players down)")
 
         args = parser.parse_args()
-
-        self.white_player = _load_player(args.white_module)
-        self.black_player = _load_player(args.black_module)
+        if args.memory and args.workers:
+            parser.error("memory accounting needs the players in this "
+                "process (not -w)")
+
+        self.white_module = args.white_module
+        self.black_module = args.black_module
+        self.record = args.record
+        self.workers = args.workers
+        self.memory = args.memory
+
+        # worker processes load the player modules themselves
+        if not self.workers:
+            self.white_player = _load_player(args.white_module)
+            self.black_player = _load_player(args.black_module)
         self.delay = _novalue_check(args.delay, DELAY_NOVALUE)
         self.space = _novalue_check(args.space_limit, SPACE_LIMIT_NOVALUE)
         self.time  = _novalue_check(args.time_limit, TIME_LIMIT_NOVALUE)
@@ -148,14 +218,35 @@ def _load_player(modulename, package='.'):
     """
     Load a Player class given the name of a module.
     
-    :param modulename: where to look for the Player class (name of a module)
+    :param modulename: where to look for the Player class (name of a module,
+        optionally followed by ':' and the name of another class to use)
     :param package: where to look for the module (relative package)
     :return: the Player class (a class object)
     """
+    modulename, _, classname = modulename.partition(':')
     module = importlib.import_module(modulename, package=package)
-    player_class = module.Player
+    player_class = getattr(module, classname or 'Player')
     return player_class
 
+def _new_record(options):
+    """
+    Create an empty game record if the game is being recorded, else None
+    """
+    if not options.record:
+        return None
+    return gamerecord.GameRecord(options.white_module, options.black_module)
+
+def _save_record(options, record, game, ending):
+    """
+    Fill in the result of a recorded game and append it to the record file
+    """
+    if record is None:
+        return
+    record.winner = game.winner
+    record.ending = ending
+    with gamerecord.RecordWriter(options.record) as writer:
+        writer.write(record)
+
 # --------------------------------------------------------------------------- #
 
 # PLAYER WRAPPER CLASS
@@ -164,28 +255,73 @@ class _Player:
     """
     Wrapper for a Player class to simplify initialization and resource limiting
     """
-    def __init__(self, player_class, colour, time_limit, space_limit):
+    def __init__(self, player_class, colour, time_limit, space_limit,
+            memory=False):
         self.timer = _CountdownTimer(time_limit)
         self.space_limit = space_limit
+        if memory:
+            self.memory = _MemoryAccount(f"{colour} "
+                f"({player_class.__module__}.{player_class.__name__})")
+        else:
+            self.memory = contextlib.nullcontext()
 
         gc.collect() # off the clock
-        with self.timer:
+        with self.memory, self.timer:
             self.player = player_class(colour)
         _space_check(self.space_limit)
 
     def update(self, move):
         gc.collect()
-        with self.timer:
+        with self.memory, self.timer:
             self.player.update(move)
         _space_check(self.space_limit)
 
     def action(self, turns):
         gc.collect()
-        with self.timer:
+        with self.memory, self.timer:
             action = self.player.action(turns)
         _space_check(self.space_limit)
         return action
 
+    def close(self):
+        pass
+
+class _WorkerPlayer:
+    """
+    Player running in a separate worker process (see player_worker.py),
+    used the same way as _Player. Time and space are measured by the worker
+    itself, so each player is only charged for its own resource usage
+    """
+    def __init__(self, modulename, colour, time_limit, space_limit,
+            worker=None, seed=None):
+        self.timer = _CountdownTimer(time_limit)
+        self.space_limit = space_limit
+        self.worker = worker or player_worker.WorkerClient(modulename)
+        self._owns_worker = worker is None
+        self.peak = 0
+
+        elapsed, peak = self.worker.new_game(colour, seed)
+        self._charge(elapsed, peak)
+
+    def _charge(self, elapsed, peak):
+        self.timer.add(elapsed)
+        self.peak = peak
+        print(f"space: {peak:.3f}MB (max usage) (this player)")
+        if self.space_limit and peak > self.space_limit:
+            raise _ResourceLimitException("Player exceeded space limit")
+
+    def update(self, move):
+        self._charge(*self.worker.update(move))
+
+    def action(self, turns):
+        action, elapsed, peak = self.worker.action(turns)
+        self._charge(elapsed, peak)
+        return action
+
+    def close(self):
+        if self._owns_worker:
+            self.worker.close()
+
 # HELPER CLASSES AND FUNCTIONS
 
 class _ResourceLimitException(Exception):
@@ -238,6 +374,75 @@ def _space_check(limit):
     if limit and peak_mem_usage > 2 * limit:
         raise _ResourceLimitException("Players exceeded shared space limit")
 
+class _MemoryAccount:
+    """
+    Reusable context manager accounting for the memory allocated by one
+    player (tracemalloc must be tracing)
+
+    * compares tracemalloc snapshots taken around each call to the player,
+      so allocations are charged to the player whose call made them even in
+      modules both players share
+    * keeps the net size allocated at each site (file and line) and prints
+      the growth and transient peak of every call
+    """
+    def __init__(self, name):
+        self.name = name
+        self.sites = {}
+        self.held = 0
+        self.peak = 0
+        self.growth = []
+        self.filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, __file__)]
+        # filtering compiles and caches the patterns, so do it once now
+        # rather than during the first call
+        tracemalloc.take_snapshot().filter_traces(self.filters)
+    def __enter__(self):
+        # off the clock: the timer is entered after this
+        self.before = tracemalloc.take_snapshot().filter_traces(self.filters)
+        tracemalloc.reset_peak()
+        self.start, _ = tracemalloc.get_traced_memory()
+        return self
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect() # only count memory the player is still holding
+        after = tracemalloc.take_snapshot().filter_traces(self.filters)
+        growth = 0
+        for stat in after.compare_to(self.before, 'lineno'):
+            if stat.size_diff:
+                frame = stat.traceback[0]
+                site = (frame.filename, frame.lineno)
+                self.sites[site] = self.sites.get(site, 0) + stat.size_diff
+                growth += stat.size_diff
+        self.before = None
+        self.held += growth
+        self.growth.append(growth)
+        self.peak = max(self.peak, self.held - growth + peak - self.start)
+        print(f"memory: {growth / 1024:+.1f}KB (this turn), "
+            + f"{self.held / 1024:.1f}KB (held) "
+            + f"{(peak - self.start) / 1024:.1f}KB (peak this turn) "
+            + "(this player)")
+    def report(self, top=MEMORY_TOP_SITES):
+        """
+        Print the memory held by the player at the end of the game by module
+        and its top allocation sites
+        """
+        print(f"memory for {self.name}: {self.held / 1024:.1f}KB held, "
+            + f"{self.peak / 1024:.1f}KB peak, largest turn "
+            + f"{max(self.growth, default=0) / 1024:+.1f}KB")
+        modules = {}
+        for (filename, _), size in self.sites.items():
+            module = os.path.basename(filename)
+            modules[module] = modules.get(module, 0) + size
+        print("  by module:")
+        for module, size in sorted(modules.items(), key=lambda item: -item[1]):
+            if size:
+                print(f"    {size / 1024:10.1f}KB  {module}")
+        print("  top allocation sites:")
+        sites = sorted(self.sites.items(), key=lambda item: -item[1])
+        for (filename, lineno), size in sites[:top]:
+            print(f"    {size / 1024:10.1f}KB  "
+                + f"{os.path.basename(filename)}:{lineno}")
+
 # TIME MANAGEMENT
 
 class _CountdownTimer:
@@ -255,13 +460,19 @@ class _CountdownTimer:
         """
         self.limit = limit
         self.clock = 0
+        self.elapsed = 0
     def __enter__(self):
         # start timing
         self.start = time.process_time()
         return self # unused
     def __exit__(self, exc_type, exc_val, exc_tb):
         # accumulate elapsed time since __enter__
-        elapsed = time.process_time() - self.start
+        self.add(time.process_time() - self.start)
+    def add(self, elapsed):
+        """
+        Accumulate time measured elsewhere (e.g. by a worker process)
+        """
+        self.elapsed = elapsed
         self.clock += elapsed
         print(f"time: {elapsed:.3f}s (this turn), {self.clock:.3f}s (total)")
 
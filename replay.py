@@ -0,0 +1,239 @@
+"""
+Latency replay of recorded games of Watch Your Back!
+
+Drives a Player class through the games in a record file (see gamerecord.py)
+the same way the referee does, calling action() on its turns and update()
+with the opponent's actions, but keeps to the recorded actions instead of
+the player's own: when one of its actions differs from the recorded one,
+the player's board is replaced with a copy of the recorded position (so
+its caches are only rebuilt from scratch after a divergence, which is
+counted). Every call is timed (CPU and wall
+clock) and the latencies are summarised with percentiles and the worst
+turns, split by phase and by the number of turns until the next shrink,
+since the turns around a shrink are where time limits are usually broken.
+
+Usage: python replay.py RECORDS MODULE [-c COLOUR] [-g FIRST] [-n GAMES]
+                        [-w WORST] [--json]
+"""
+import gc
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+
+import gamerecord
+from player_worker import load_player
+from watchyourback import Board
+from gamerecord import PLACING, MOVING, SHRINK, WHITE, BLACK
+
+# CONSTANTS
+COLOURS = {'white': WHITE, 'black': BLACK}
+PERCENTILES = [50, 95, 99]
+WORST = 10
+
+# Groups of turns by the number of turns until the next shrink (the
+# player shrinks its board at the start of the turn itself, distance 0)
+SHRINK_DISTANCES = [(0, 0), (1, 2), (3, 8), (9, 32), (33, math.inf)]
+
+# HELPER FUNCTIONS
+def shrink_distance(phase, turns):
+    """
+    Returns the number of turns until the next shrink from a turn of the
+    moving phase, or None in the placing phase or after the last shrink
+    """
+    if phase == PLACING:
+        return None
+    upcoming = [shrink for shrink in SHRINK if shrink >= turns]
+    return upcoming[0] - turns if upcoming else None
+
+def distance_group(distance):
+    """
+    Returns the name of the group of SHRINK_DISTANCES a distance is in
+    """
+    if distance is None:
+        return 'none'
+    for low, high in SHRINK_DISTANCES:
+        if low <= distance <= high:
+            if low == high:
+                return str(low)
+            return f'{low}+' if math.isinf(high) else f'{low}-{high}'
+
+def percentile(values, q):
+    """
+    Returns the q'th percentile of a sorted list (nearest rank)
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+def timed(call, *args):
+    """
+    Calls call(*args) after a collection (off the clock, as the referee
+    does) and returns (result, CPU seconds, wall seconds)
+    """
+    gc.collect()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = call(*args)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    return result, cpu, wall
+
+def replay_game(player_class, record, colours, game=0, seed=None):
+    """
+    Replays a GameRecord with a new player of player_class for each colour
+    in 'colours', returning a list with a dict for every call to one of
+    them: game, colour, call ('action' or 'update'), phase, turns, cpu,
+    wall, and for action calls the shrink distance and whether the action
+    differed from the recorded one
+    """
+    if seed is not None:
+        random.seed(seed)
+    actions = record.actions
+    if record.ending == 'invalid':
+        actions = actions[:-1]
+
+    players = {colour: player_class(name)
+               for name, colour in COLOURS.items() if colour in colours}
+    board = Board(8)
+    turns_log = []
+    for index, action in enumerate(actions):
+        colour = WHITE if index % 2 == 0 else BLACK
+        enemy = BLACK if colour == WHITE else WHITE
+        phase, turns = gamerecord.turn_info(index)
+
+        # Our board shrinks at the start of the turn, as the players' do
+        if phase == MOVING and turns in SHRINK:
+            board.shrink()
+
+        if colour in players:
+            chosen, cpu, wall = timed(players[colour].action, turns)
+            diverged = chosen != action
+            turns_log.append({'game': game, 'colour': colour,
+                              'call': 'action', 'phase': phase,
+                              'turns': turns, 'cpu': cpu, 'wall': wall,
+                              'distance': shrink_distance(phase, turns),
+                              'diverged': diverged})
+
+        if phase == PLACING:
+            board.place_piece(colour, action)
+        elif action is not None:
+            oldpos, newpos = action
+            board.get_piece(oldpos).make_move(newpos)
+
+        # Put the recorded action in place of the player's own
+        if colour in players and diverged:
+            players[colour].board = board.clone()
+
+        if enemy in players:
+            _, cpu, wall = timed(players[enemy].update, action)
+            turns_log.append({'game': game, 'colour': enemy,
+                              'call': 'update', 'phase': phase,
+                              'turns': turns, 'cpu': cpu, 'wall': wall,
+                              'distance': None})
+    return turns_log
+
+def summarise(calls, worst=WORST):
+    """
+    Returns a dict of latency statistics for a list of calls from
+    replay_game: the percentiles and maximum of CPU and wall time for
+    actions overall, by phase and by shrink distance (moving phase), the
+    same for updates, the 'worst' slowest actions by CPU time and the
+    number of actions which differed from the recorded ones
+    """
+    def stats(group):
+        result = {'count': len(group)}
+        for clock in ['cpu', 'wall']:
+            values = sorted(call[clock] for call in group)
+            for q in PERCENTILES:
+                result[f'{clock}_p{q}'] = percentile(values, q)
+            result[f'{clock}_max'] = values[-1] if values else None
+        return result
+
+    actions = [call for call in calls if call['call'] == 'action']
+    updates = [call for call in calls if call['call'] == 'update']
+    groups = {'all actions': actions}
+    for phase in [PLACING, MOVING]:
+        groups[phase] = [call for call in actions if call['phase'] == phase]
+    moving = groups[MOVING]
+    names = [distance_group(low) for low, _ in SHRINK_DISTANCES] + ['none']
+    for name in names:
+        groups[f'shrink in {name}'] = [
+                call for call in moving
+                if distance_group(call['distance']) == name]
+    groups['updates'] = updates
+
+    slowest = sorted(actions, key=lambda call: call['cpu'], reverse=True)
+    return {'groups': {name: stats(group)
+                       for name, group in groups.items() if group},
+            'worst': slowest[:worst],
+            'diverged': sum(call['diverged'] for call in actions)}
+
+def print_summary(summary):
+    keys = [f'p{q}' for q in PERCENTILES] + ['max']
+    header = ''.join(f"{f'{clock} {key}':>10s}"
+                     for clock in ['cpu', 'wall'] for key in keys)
+    print(f"times in ms{'count':>13s}{header}")
+    for name, stats in summary['groups'].items():
+        line = f"{name:18s}{stats['count']:6d}"
+        for clock in ['cpu', 'wall']:
+            for key in keys:
+                line += f"{stats[f'{clock}_{key}'] * 1000:10.1f}"
+        print(line)
+    print("worst actions:")
+    for call in summary['worst']:
+        distance = call['distance']
+        shrink = f", shrink in {distance}" if distance is not None else ''
+        print(f"  game {call['game']} {call['colour']} {call['phase']} "
+              f"turn {call['turns']}{shrink}: cpu {call['cpu']*1000:.1f}ms "
+              f"wall {call['wall']*1000:.1f}ms")
+    actions = summary['groups'].get('all actions', {'count': 0})['count']
+    print(f"{summary['diverged']} of {actions} actions differed from the "
+          f"record (board replaced by the recorded position)")
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Replay recorded games through a Player and report "
+                "its latency per turn")
+    parser.add_argument('records', help="game record file")
+    parser.add_argument('module',
+            help="module containing the Player class (or module:Class)")
+    parser.add_argument('-c', '--colour', choices=['white', 'black', 'both'],
+            default='both', help="which side(s) the player takes")
+    parser.add_argument('-g', '--first', type=int, default=0,
+            help="index of the first game to replay")
+    parser.add_argument('-n', '--games', type=int, default=None,
+            help="number of games to replay (default all)")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+            help="random seed (game i uses SEED+i)")
+    parser.add_argument('-w', '--worst', type=int, default=WORST,
+            help="number of slowest actions to list")
+    parser.add_argument('--json', action='store_true',
+            help="print the summary as JSON")
+    args = parser.parse_args()
+
+    player_class = load_player(args.module)
+    if args.colour == 'both':
+        colours = [WHITE, BLACK]
+    else:
+        colours = [COLOURS[args.colour]]
+
+    games = gamerecord.read_records(args.records)
+    last = None if args.games is None else args.first + args.games
+    calls = []
+    for game, record in enumerate(itertools.islice(games, args.first, last),
+                                  args.first):
+        calls += replay_game(player_class, record, colours, game,
+                             args.seed + game)
+
+    summary = summarise(calls, args.worst)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print_summary(summary)
+
+if __name__ == '__main__':
+    main()
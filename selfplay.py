@@ -0,0 +1,301 @@
+"""
+Parallel self-play generator of labelled Watch Your Back! positions
+
+Plays a Player class (minimax_module's by default, or any module:Class)
+against itself in a pool of worker processes and streams every position of
+every game, labelled with the final result and the score of the search made
+from it, to a flat file of posdb.RECORD rows. The file can be read with
+numpy.fromfile(path, posdb.RECORD) or appended to a PositionDB for tune.py.
+
+Each game starts with a number of uniformly random placements (seeded from
+the game's number, so openings differ between games but are reproducible)
+before the players take over, with their search budget set by the time,
+depth and node options. Games are independent, so throughput grows with the
+number of processes, and the main process only writes results. After each
+game the sizes of the output files and the number of the next game are saved
+to a checkpoint (OUTPUT.ckpt), and running the same command again resumes
+from it, dropping anything written after the last checkpoint. Without a
+checkpoint it refuses to add to files which already hold anything (they
+would get the same games again from game 0) unless given --force, with a
+different --seed to make new games. The workers only play games: NumPy is
+only loaded by the main process, to build records.
+
+Usage: python selfplay.py OUTPUT [-p MODULE] [-n GAMES] [-j PROCESSES]
+                          [-r RANDOM] [-t TIME] [-d DEPTH] [--nodes NODES]
+                          [-s SEED] [-g RECORDS] [--force]
+"""
+import os
+import json
+import math
+import time
+import random
+import argparse
+import multiprocessing
+
+import gamerecord
+from player_worker import load_player
+from watchyourback import Board, WHITE, BLACK, OPPONENT
+from watchyourback import WIN, LOSS, TIE, CONTINUE
+from gamerecord import PLACING, MOVING, SHRINK, MOVING_PHASE
+
+# CONSTANTS
+RANDOM_PLIES = 4        # random placements at the start of each game
+MAX_MOVING_TURNS = 256  # games still going after this are left unfinished
+WINNERS = {WIN: 'W', LOSS: 'B', TIE: 'draw'}
+
+# State of each worker process, set up by init_worker
+_worker = {}
+
+# HELPER FUNCTIONS
+def configure(player, time_limit=None, depth=None, nodes=None):
+    """
+    Sets the search budget of a player which has one (minimax_module's):
+    CPU time per action, maximum depth in both phases and maximum nodes
+    """
+    if time_limit is not None and hasattr(player, 'action_time'):
+        player.action_time = time_limit
+    if depth is not None and hasattr(player, 'max_depth'):
+        player.max_depth = dict.fromkeys(player.max_depth, depth)
+    if nodes is not None and hasattr(player, 'max_nodes'):
+        player.max_nodes = nodes
+
+def search_score(player, iterations):
+    """
+    Returns the value of the last completed search iteration of a player if
+    it searched during its last action ('iterations' is its list of
+    iterations from before the action), otherwise NaN
+    """
+    current = getattr(player, 'iterations', None)
+    if not current or current is iterations:
+        return math.nan
+    return current[-1]['value']
+
+def legal(board, colour, phase, action):
+    """
+    Returns true if 'action' is a legal action of 'colour' on the board
+    """
+    try:
+        if phase == PLACING:
+            return action in board.free[colour]
+        if action is None:
+            return board.get_mobility(colour) == 0
+        oldpos, newpos = action
+        return board.grid.get(oldpos) == colour and \
+            newpos in board.get_moves(oldpos)
+    except (TypeError, ValueError):
+        return False
+
+def play(board, colour, phase, action):
+    if phase == PLACING:
+        board.place_piece(colour, action)
+    elif action is not None:
+        oldpos, newpos = action
+        board.get_piece(oldpos).make_move(newpos)
+
+def play_game(player_class, name, game, seed=0, random_plies=RANDOM_PLIES,
+              **budget):
+    """
+    Plays one game of a player class against itself, returning a GameRecord,
+    a list of (white mask, black mask, shrinks, turns, phase) for the
+    position before each action and a list of the mover's search score for
+    each (from white's point of view)
+    """
+    random.seed(seed + game)
+    record = gamerecord.GameRecord(name, name)
+    board = Board(8)
+    players = {}
+    positions, scores = [], []
+    index = 0
+    while True:
+        colour = WHITE if index % 2 == 0 else BLACK
+        phase, turns = gamerecord.turn_info(index)
+        if phase == MOVING and turns >= MAX_MOVING_TURNS:
+            break
+
+        score = math.nan
+        if index < random_plies:
+            action = random.choice(board.placements(colour))
+            cpu = 0.0
+        else:
+            if not players:
+                # The players start from the position after the opening
+                for team, team_name in [(WHITE, 'white'), (BLACK, 'black')]:
+                    players[team] = player_class(team_name)
+                    configure(players[team], **budget)
+                    players[team].board = board.clone()
+            player = players[colour]
+            iterations = getattr(player, 'iterations', None)
+            cpu = time.process_time()
+            action = player.action(turns)
+            cpu = time.process_time() - cpu
+            score = search_score(player, iterations)
+
+        # An invalid action loses the game, as with the referee
+        if not legal(board, colour, phase, action):
+            record.add(gamerecord.INVALID, cpu)
+            record.winner = 'B' if colour == WHITE else 'W'
+            record.ending = 'invalid'
+            break
+
+        record.add(action, cpu)
+        positions.append(board.get_masks() + (board.numOfShrinks, turns,
+                                              phase))
+        scores.append(score if colour == WHITE else -score)
+        play(board, colour, phase, action)
+        if players:
+            players[OPPONENT[colour]].update(action)
+
+        # End of the game is checked from the last placement on, and the
+        # board shrinks after the same turns as the referee's
+        index += 1
+        if index >= MOVING_PHASE:
+            if phase == MOVING and turns + 1 in SHRINK:
+                board.shrink()
+            result = board.check_win(WHITE)
+            if result != CONTINUE:
+                record.winner = WINNERS[result]
+                record.ending = 'completed'
+                break
+
+    return record, positions, scores
+
+def position_records(record, positions, scores):
+    """
+    Returns a posdb.RECORD array of the positions of a game from play_game,
+    labelled with its result. Only the main process builds these, so the
+    workers never import NumPy (through posdb), which would cost each of
+    them tens of MB
+    """
+    import posdb
+    import numpy as np
+    white, black, shrinks, turns, phases = zip(*positions) if positions \
+                                           else [()] * 5
+    return posdb.make_records(np.array(white, dtype=np.uint64), black,
+                              shrinks, turns,
+                              [posdb.PHASES[phase] for phase in phases],
+                              posdb.RESULTS[record.winner], scores)
+
+def init_worker(module, seed, random_plies, budget):
+    _worker.update(player_class=load_player(module), name=module, seed=seed,
+                   random_plies=random_plies, budget=budget)
+
+def run_game(game):
+    """
+    Plays game number 'game' in a worker, returning (game, GameRecord,
+    positions, scores)
+    """
+    return (game,) + play_game(_worker['player_class'], _worker['name'],
+                               game, _worker['seed'], _worker['random_plies'],
+                               **_worker['budget'])
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+def save_checkpoint(path, checkpoint):
+    """
+    Replaces the checkpoint in one step so it is never half written
+    """
+    temp = path + '.tmp'
+    with open(temp, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(temp, path)
+
+def truncate(path, size):
+    """
+    Drops anything written to the file at 'path' after its first 'size'
+    bytes (since the last checkpoint)
+    """
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        os.truncate(path, size)
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Generate labelled positions by self-play")
+    parser.add_argument('output', help="file of posdb records to append to")
+    parser.add_argument('-p', '--player', default='minimax_module',
+            help="module containing the Player class (or module:Class)")
+    parser.add_argument('-n', '--games', type=int, default=100,
+            help="total number of games to play (including resumed ones)")
+    parser.add_argument('-j', '--processes', type=int,
+            default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('-r', '--random', type=int, default=RANDOM_PLIES,
+            help="random placements at the start of each game")
+    parser.add_argument('-t', '--time', type=float, default=None,
+            help="CPU seconds per action")
+    parser.add_argument('-d', '--depth', type=int, default=None,
+            help="maximum search depth")
+    parser.add_argument('--nodes', type=int, default=None,
+            help="maximum nodes per search")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+            help="random seed (game i uses SEED+i)")
+    parser.add_argument('-g', '--records', default=None,
+            help="game record file to also write the games to")
+    parser.add_argument('--force', action='store_true',
+            help="append to output files which have no checkpoint")
+    args = parser.parse_args()
+    if args.random >= MOVING_PHASE - 2:
+        parser.error(f"at most {MOVING_PHASE - 3} random placements")
+
+    # Resume from the checkpoint if there is one. Otherwise games are
+    # numbered (and seeded) from 0 again, so only add them after whatever
+    # the files already hold if told to
+    checkpoint_path = args.output + '.ckpt'
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        checkpoint = {'games': 0, 'positions': 0, 'size': 0,
+                      'records_size': 0}
+        for key, path in [('size', args.output),
+                          ('records_size', args.records)]:
+            if path is not None and os.path.exists(path):
+                checkpoint[key] = os.path.getsize(path)
+                if checkpoint[key] and not args.force:
+                    parser.error(f"{path} already holds games but there is "
+                                 f"no checkpoint ({checkpoint_path}) to "
+                                 f"resume from; use --force (with a "
+                                 f"different --seed) to add to it")
+    else:
+        print(f"resuming from game {checkpoint['games']} "
+              f"({checkpoint['positions']} positions)")
+    truncate(args.output, checkpoint['size'])
+    output = open(args.output, 'ab')
+    writer = None
+    if args.records is not None:
+        truncate(args.records, checkpoint['records_size'])
+        writer = gamerecord.RecordWriter(args.records)
+
+    budget = {'time_limit': args.time, 'depth': args.depth,
+              'nodes': args.nodes}
+    games = range(checkpoint['games'], args.games)
+    start = time.perf_counter()
+    total = 0
+    with multiprocessing.Pool(args.processes, init_worker,
+            (args.player, args.seed, args.random, budget)) as pool:
+        for game, record, positions, scores in pool.imap(run_game, games):
+            positions = position_records(record, positions, scores)
+            output.write(positions.tobytes())
+            output.flush()
+            if writer is not None:
+                writer.write(record)
+
+            total += len(positions)
+            checkpoint['games'] = game + 1
+            checkpoint['positions'] += len(positions)
+            checkpoint['size'] = output.tell()
+            if writer is not None:
+                checkpoint['records_size'] = writer.file.tell()
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            rate = total / (time.perf_counter() - start)
+            print(f"game {game}: {len(positions)} positions, winner "
+                  f"{record.winner} ({record.ending}), "
+                  f"{rate:.1f} positions/s")
+
+    output.close()
+    if writer is not None:
+        writer.close()
+
+if __name__ == '__main__':
+    main()
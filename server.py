@@ -0,0 +1,345 @@
+"""
+Local asyncio service which plays many referee matches at once
+
+Clients connect over TCP and send match requests as lines of JSON, e.g.
+
+    {"white": "minimax_module", "black": "random_module", "seed": 1,
+     "time": 120, "space": 100, "move_time": 5, "move_wall": 10}
+
+Every player runs in a worker process (see player_worker.py) and each action
+is validated with the referee's _Game. Per-move wall clock and CPU deadlines,
+the total CPU time limit and the space limit are enforced for each player
+separately. Progress is streamed back to the client as lines of JSON: one
+"action" event per turn and a final "result" event, or an "error" event for
+a line that can't be read. Worker processes are kept warm between matches
+and reused for the same module, except those killed for running out of wall
+clock time. Workers measure their peak memory from the start of each game,
+so a match on a reused worker is only checked against its own usage.
+
+Usage: python server.py serve [--port PORT] [--games N]
+       python server.py play WHITE BLACK [--port PORT] [--seed SEED]
+"""
+import sys
+import json
+import asyncio
+import argparse
+import itertools
+
+import gamerecord
+import player_worker as pw
+from referee import _Game, _InvalidActionException
+
+# CONSTANTS
+HOST = '127.0.0.1'
+PORT = 30024
+MAX_GAMES = 8
+DEFAULTS = {'seed': None, 'time': 0, 'space': 0, 'move_time': 0,
+            'move_wall': 0}
+
+# CLASSES
+class ForfeitException(Exception):
+    """For when a player breaks a deadline or resource limit, or crashes"""
+
+class AsyncWorker:
+    """
+    asyncio version of player_worker.WorkerClient
+    """
+    def __init__(self, modulename, process):
+        self.modulename = modulename
+        self.process = process
+        self.killed = False
+
+    @classmethod
+    async def start(cls, modulename):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, pw.WORKER_PATH, modulename,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+        return cls(modulename, process)
+
+    def alive(self):
+        """
+        Returns true if the worker can take requests. A killed worker is
+        never alive again, even before its process has been reaped
+        """
+        return not self.killed and self.process.returncode is None
+
+    async def _request(self, opcode, payload=b''):
+        self.process.stdin.write(pw.FRAME.pack(opcode, len(payload)) + payload)
+        await self.process.stdin.drain()
+        try:
+            header = await self.process.stdout.readexactly(pw.FRAME.size)
+            opcode, length = pw.FRAME.unpack(header)
+            payload = await self.process.stdout.readexactly(length)
+        except asyncio.IncompleteReadError:
+            opcode, payload = None, b''
+        return pw.parse_reply(opcode, payload)
+
+    async def new_game(self, colour, seed=None):
+        seed = pw.NO_SEED if seed is None else seed
+        payload = pw.NEW_GAME_ARGS.pack(pw.COLOURS.index(colour), seed)
+        _, elapsed, peak = await self._request(pw.NEW_GAME, payload)
+        return elapsed, peak
+
+    async def action(self, turns):
+        result, elapsed, peak = await self._request(pw.ACTION,
+                                                    pw.TURNS.pack(turns))
+        return pw.decode_action(result), elapsed, peak
+
+    async def update(self, action):
+        _, elapsed, peak = await self._request(pw.UPDATE,
+                                               pw.encode_action(action))
+        return elapsed, peak
+
+    async def close(self):
+        if self.alive():
+            try:
+                self.process.stdin.write(pw.FRAME.pack(pw.QUIT, 0))
+                self.process.stdin.close()
+            except (OSError, RuntimeError):
+                pass
+            await self.process.wait()
+
+    async def kill(self):
+        if self.alive():
+            self.killed = True
+            self.process.kill()
+            await self.process.wait()
+
+class MatchPlayer:
+    """
+    One side of a match: a worker plus the limits and CPU clock used to
+    decide whether it has to forfeit
+    """
+    def __init__(self, worker, colour, request):
+        self.worker = worker
+        self.colour = colour
+        self.time = request['time']
+        self.space = request['space']
+        self.move_time = request['move_time']
+        self.move_wall = request['move_wall']
+        self.clock = 0.0
+        self.peak = 0.0
+
+    async def call(self, request):
+        """
+        Awaits a request to the worker, enforcing every limit. Returns the
+        request's result and the CPU time it took
+        """
+        try:
+            if self.move_wall:
+                result = await asyncio.wait_for(request, self.move_wall)
+            else:
+                result = await request
+        except asyncio.TimeoutError:
+            await self.worker.kill()
+            raise ForfeitException('exceeded wall clock time for a move')
+        except pw.WorkerError as e:
+            raise ForfeitException(f'player error: {e}')
+
+        *value, elapsed, peak = result
+        self.clock += elapsed
+        self.peak = max(self.peak, peak)
+        if self.move_time and elapsed > self.move_time:
+            raise ForfeitException('exceeded CPU time for a move')
+        if self.time and self.clock > self.time:
+            raise ForfeitException('exceeded available CPU time')
+        if self.space and self.peak > self.space:
+            raise ForfeitException('exceeded space limit')
+        return (value[0] if value else None), elapsed
+
+class MatchServer:
+    """
+    Accepts match requests and runs up to 'max_games' of them at a time,
+    optionally appending a record of every finished game to 'record'
+    """
+    def __init__(self, max_games=MAX_GAMES, record=None):
+        self.slots = asyncio.Semaphore(max_games)
+        self.record = record
+        self.idle = {}  # module name -> list of warm workers
+        self.ids = itertools.count()
+
+    async def get_worker(self, modulename):
+        workers = self.idle.get(modulename, [])
+        while workers:
+            worker = workers.pop()
+            if worker.alive():
+                return worker
+        return await AsyncWorker.start(modulename)
+
+    def release_worker(self, worker):
+        if worker.alive():
+            self.idle.setdefault(worker.modulename, []).append(worker)
+
+    async def play(self, request, emit):
+        """
+        Plays one match, calling the coroutine 'emit' with each event.
+        Returns the final result event
+        """
+        request = {**DEFAULTS, **request}
+        match = next(self.ids)
+        seed = request['seed']
+        game = _Game()
+        record = gamerecord.GameRecord(request['white'], request['black'])
+        result = {'match': match, 'event': 'result'}
+
+        async with self.slots:
+            workers = [await self.get_worker(request['white']),
+                       await self.get_worker(request['black'])]
+            players = [MatchPlayer(worker, colour, request)
+                       for worker, colour in zip(workers, pw.COLOURS)]
+            current = players[0]
+            try:
+                for i, player in enumerate(players):
+                    current = player
+                    await player.call(player.worker.new_game(
+                        player.colour, None if seed is None else seed + i))
+
+                while game.playing():
+                    # white moves on even turns in both phases
+                    turns = game.turns
+                    current = players[turns % 2]
+                    other = players[1 - turns % 2]
+                    action, elapsed = await current.call(
+                        current.worker.action(turns))
+                    record.add(action, elapsed)
+                    try:
+                        game.update(action)
+                    except _InvalidActionException as e:
+                        result.update(winner=game.winner, ending='invalid',
+                                      reason=str(e))
+                        break
+                    await emit({'match': match, 'event': 'action',
+                                'colour': current.colour, 'turns': turns,
+                                'action': action, 'cpu': elapsed})
+                    current = other
+                    await other.call(other.worker.update(action))
+                else:
+                    result.update(winner=game.winner, ending='completed')
+            except ForfeitException as e:
+                winner = 'B' if current.colour == 'white' else 'W'
+                result.update(winner=winner, ending='resource',
+                              reason=f'{current.colour}: {e}')
+            finally:
+                for worker in workers:
+                    self.release_worker(worker)
+
+        result['cpu'] = {player.colour: player.clock for player in players}
+        result['space'] = {player.colour: player.peak for player in players}
+        result['actions'] = len(record.actions)
+        record.winner = result['winner']
+        record.ending = result['ending']
+        if self.record:
+            with gamerecord.RecordWriter(self.record) as writer:
+                writer.write(record)
+        await emit(result)
+        return result
+
+    async def handle(self, reader, writer):
+        """
+        Serves one client connection: every line is a match request, and
+        the matches run concurrently with their events interleaved
+        """
+        lock = asyncio.Lock()
+
+        async def emit(event):
+            async with lock:
+                writer.write(json.dumps(event).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        async def run(request):
+            try:
+                await self.play(request, emit)
+            except Exception as e:
+                await emit({'event': 'error', 'request': request,
+                            'reason': repr(e)})
+
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                await emit({'event': 'error',
+                            'line': line.decode('utf-8', 'replace').strip(),
+                            'reason': repr(e)})
+                continue
+            tasks.append(asyncio.ensure_future(run(request)))
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def close(self):
+        for workers in self.idle.values():
+            for worker in workers:
+                await worker.close()
+        self.idle = {}
+
+# CLIENT
+async def request_matches(requests, host=HOST, port=PORT):
+    """
+    Stand-in client: sends a list of match requests and yields every event
+    streamed back until all of the matches have finished
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    for request in requests:
+        writer.write(json.dumps(request).encode('utf-8') + b'\n')
+    await writer.drain()
+    writer.write_eof()
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        yield json.loads(line)
+    writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Serve or request concurrent games of Watch Your "
+                "Back!")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="run the match server")
+    serve.add_argument('--games', type=int, default=MAX_GAMES,
+            help="number of matches to run at once")
+    serve.add_argument('-r', '--record',
+            help="append a record of each game to this file")
+    play = commands.add_parser('play', help="request matches from a server")
+    play.add_argument('white')
+    play.add_argument('black')
+    play.add_argument('-n', '--matches', type=int, default=1)
+    play.add_argument('--seed', type=int, default=None)
+    for name in ['time', 'space', 'move_time', 'move_wall']:
+        play.add_argument('--' + name, type=float, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = MatchServer(args.games, args.record)
+        asyncio.run(server.serve(args.host, args.port))
+    else:
+        requests = []
+        for i in range(args.matches):
+            request = {name: getattr(args, name) for name in
+                       ['white', 'black', 'time', 'space', 'move_time',
+                        'move_wall']}
+            request['seed'] = None if args.seed is None else args.seed + 2*i
+            requests.append(request)
+
+        async def show():
+            async for event in request_matches(requests, args.host,
+                                               args.port):
+                if event['event'] != 'action':
+                    print(json.dumps(event))
+        asyncio.run(show())
+
+if __name__ == '__main__':
+    main()
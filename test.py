@@ -1,23 +1,319 @@
-from minimax_module import Player, Board, Piece
+"""
+Tests of Board and Piece. Most play random games in which every turn also
+tries a few random lines of actions and undoes them (as the search does),
+checking something the Board keeps up to date incrementally against the
+same thing worked out from scratch at every position reached
 
-white = Player('white')
-black = Player('black')
+Usage: python -m pytest test.py
+"""
+import random
 
-white.board.place_piece('@', (1,2))
-white.board.place_piece('@', (3,2))
-eliminated = white.board.place_piece('O', (2,1))
-white.board.print_grid()
-print(white.board.white_pieces)
+import numpy as np
 
-print("\n")
+import nnue
+from minimax_module import Player
+from watchyourback import Board, WHITE, BLACK, EMPTY, CORNER, OPPONENT
+from watchyourback import CONTINUE, DIRECTIONS, PHASES, SNAPSHOT, square_bit
+from watchyourback import IDENTITY, PLACING_SYMMETRIES, MOVING_SYMMETRIES
+from watchyourback import transform_mask, transform_square, transform_action
 
-eliminated = white.board.white_pieces[(2,1)].make_move((2,2))
-white.board.print_grid()
-print(white.board.white_pieces)
+# CONSTANTS
+MOVING_PHASE = 24
+SHRINK = [128, 192]
+MAX_MOVING_TURNS = 220
+GAMES = 6
+BRANCHES = 3  # actions tried (and undone) at each node of the random lines
+DEPTH = 2     # length of the random lines
 
-print("\n")
+# HELPER FUNCTIONS
+def actions(board, colour, moving):
+    """
+    Returns list of every action for the team (squares to place on, or
+    (oldpos, newpos) moves)
+    """
+    if not moving:
+        return [pos for pos in board.starting_zone(colour)
+                if board.grid[pos] == EMPTY]
+    return [(pos, move)
+            for pos, piece in sorted(board.get_alive(colour).items())
+            for move in piece.listmoves(0)]
 
-white.board.white_pieces[(2,2)].undo_move((2,1), eliminated)
-white.board.print_grid()
-print(white.board.white_pieces)
+def make(board, colour, moving, action):
+    """
+    Applies an action, returning (piece, eliminated) for unmake (piece is
+    None when placing)
+    """
+    if not moving:
+        return None, board.place_piece(colour, action)
+    piece = board.get_piece(action[0])
+    return piece, piece.make_move(action[1])
 
+def unmake(board, colour, action, undo):
+    piece, eliminated = undo
+    if piece is None:
+        board.undo_place(colour, action, eliminated)
+    else:
+        piece.undo_move(action[0], eliminated)
+
+def pieces(board):
+    """
+    Returns the grid and which piece object is on each square, to check
+    that undoing an action puts back exactly what was there
+    """
+    return (dict(board.grid),
+            {pos: id(piece) for pos, piece in board.white_pieces.items()},
+            {pos: id(piece) for pos, piece in board.black_pieces.items()})
+
+def explore(board, colour, index, depth, rng, check):
+    """
+    Tries up to BRANCHES random actions of the team from the position,
+    following each with 'depth'-1 more plies before undoing it, and calls
+    check(board) after every action and every undo
+    """
+    if depth == 0:
+        return
+    moving = index >= MOVING_PHASE
+    choices = actions(board, colour, moving)
+    for action in rng.sample(choices, min(BRANCHES, len(choices))):
+        before = pieces(board)
+        undo = make(board, colour, moving, action)
+        check(board)
+        explore(board, OPPONENT[colour], index + 1, depth - 1, rng, check)
+        unmake(board, colour, action, undo)
+        assert pieces(board) == before
+        check(board)
+
+def random_play(check, games=GAMES, seed=0):
+    """
+    Plays 'games' random games (shrinking the board at the same turns as the
+    referee), exploring random lines of DEPTH plies before every action and
+    calling check(board) on every position reached
+    """
+    rng = random.Random(seed)
+    for _ in range(games):
+        board = Board(8)
+        check(board)
+        for index in range(MOVING_PHASE + MAX_MOVING_TURNS):
+            colour = WHITE if index % 2 == 0 else BLACK
+            moving = index >= MOVING_PHASE
+            explore(board, colour, index, DEPTH, rng, check)
+            choices = actions(board, colour, moving)
+            if choices:
+                make(board, colour, moving, rng.choice(choices))
+            if moving and index - MOVING_PHASE + 1 in SHRINK:
+                board.shrink()
+            check(board)
+            if moving and board.check_win(WHITE) != CONTINUE:
+                break
+
+def sample(check, every=10):
+    """
+    Returns a check which only calls 'check' on every 'every'th position,
+    for checks too slow to make at every one
+    """
+    positions = 0
+    def sampled(board):
+        nonlocal positions
+        positions += 1
+        if positions % every == 0:
+            check(board)
+    return sampled
+
+def mirrored(board, transform, swap=False):
+    """
+    Returns a new Board holding the position on 'board' after one of the
+    board symmetries, with the teams swapped if 'swap' is true
+    """
+    copy = Board(8)
+    for _ in range(board.numOfShrinks):
+        copy.shrink()
+    for colour, team in [(WHITE, board.white_pieces),
+                         (BLACK, board.black_pieces)]:
+        if swap:
+            colour = OPPONENT[colour]
+        for pos in team:
+            assert copy.place_piece(colour,
+                                    transform_square(pos, transform)) == []
+    return copy
+
+def scratch_threats(board, colour):
+    """
+    Returns the threat map of a team worked out from the whole grid: every
+    empty square of the playing area where a piece of 'colour' would
+    capture, mapped to the mask of the enemy pieces it would capture
+    """
+    threats = {}
+    for x, y in board.playingarea:
+        if board.grid[x, y] != EMPTY:
+            continue
+        mask = 0
+        for dx, dy in DIRECTIONS:
+            neighbour, beyond = (x + dx, y + dy), (x + 2*dx, y + 2*dy)
+            if beyond in board.grid and \
+               board.grid[neighbour] == OPPONENT[colour] and \
+               board.grid[beyond] in (colour, CORNER):
+                mask |= square_bit(neighbour)
+        if mask:
+            threats[x, y] = mask
+    return threats
+
+# TESTS
+def test_undo_move():
+    white = Player('white')
+
+    white.board.place_piece('@', (1,2))
+    white.board.place_piece('@', (3,2))
+    eliminated = white.board.place_piece('O', (2,1))
+    assert eliminated == []
+    piece = white.board.white_pieces[(2,1)]
+
+    # Moving between the two black pieces eliminates it
+    eliminated = piece.make_move((2,2))
+    assert eliminated == [piece]
+    assert white.board.white_pieces == {}
+    assert white.board.grid[(2,2)] == EMPTY
+
+    piece.undo_move((2,1), eliminated)
+    assert white.board.white_pieces == {(2,1): piece}
+    assert piece.alive and piece.pos == (2,1)
+    assert white.board.grid[(2,1)] == WHITE
+    assert white.board.grid[(2,2)] == EMPTY
+
+def test_pool():
+    def check(board):
+        for colour, team in [(WHITE, board.white_pieces),
+                             (BLACK, board.black_pieces)]:
+            assert set(team) == {pos for pos, value in board.grid.items()
+                                 if value == colour}
+            for pos, piece in team.items():
+                assert piece.alive and piece.pos == pos
+                assert piece.player == colour and piece.board is board
+            pool = board.pool[colour]
+            assert not any(piece.alive for piece in pool)
+            assert not {id(piece) for piece in pool} & \
+                       {id(piece) for piece in team.values()}
+    random_play(check)
+
+    # Placing takes a piece from the pool and undoing returns the same one
+    board = Board(8)
+    piece = board.pool[WHITE][-1]
+    eliminated = board.place_piece(WHITE, (3, 3))
+    assert board.white_pieces[(3, 3)] is piece
+    board.undo_place(WHITE, (3, 3), eliminated)
+    assert board.pool[WHITE][-1] is piece and not piece.alive
+
+def test_canonical_key():
+    def check(board):
+        white, black = board.get_masks()
+        for moving, symmetries in [(False, PLACING_SYMMETRIES),
+                                   (True, MOVING_SYMMETRIES)]:
+            for colour in [WHITE, BLACK]:
+                key, transform = board.canonical_key(colour, moving)
+                mover, other = (white, black) if colour == WHITE \
+                               else (black, white)
+                assert key[:2] == (transform_mask(mover, transform),
+                                   transform_mask(other, transform))
+
+                # Every symmetric position has the same key, and actions
+                # map onto the same actions there and back again
+                legal = actions(board, colour, moving)
+                for symmetry in symmetries:
+                    copy = mirrored(board, symmetry)
+                    assert copy.canonical_key(colour, moving)[0] == key
+                    assert copy.get_masks() == \
+                           (transform_mask(white, symmetry),
+                            transform_mask(black, symmetry))
+                    assert sorted(transform_action(action, symmetry)
+                                  for action in legal) == \
+                           sorted(actions(copy, colour, moving))
+                    assert [transform_action(transform_action(action,
+                                                              symmetry),
+                                             symmetry)
+                            for action in legal] == legal
+
+                # Swapping the teams gives the same key while moving
+                if moving:
+                    copy = mirrored(board, IDENTITY, swap=True)
+                    assert copy.canonical_key(OPPONENT[colour],
+                                              True)[0] == key
+    random_play(sample(check, 25), games=3)
+
+def test_threats():
+    def check(board):
+        for colour in [WHITE, BLACK]:
+            assert board.get_threats(colour) == \
+                   scratch_threats(board, colour)
+    # Checking only some positions lets changes build up between updates
+    random_play(sample(check, 3))
+
+def test_moves():
+    def check(board):
+        for colour, team in [(WHITE, board.white_pieces),
+                             (BLACK, board.black_pieces)]:
+            mobility = 0
+            for pos, piece in team.items():
+                assert board.get_moves(pos) == piece.listmoves(0)
+                mobility += len(piece.listmoves(0))
+            assert board.get_mobility(colour) == mobility
+        # Nothing is left cached for squares the pieces have left
+        assert set(board.moves) == set(board.white_pieces) | \
+                                   set(board.black_pieces)
+        assert not board.moves_dirty
+    random_play(sample(check, 3))
+
+def test_snapshots():
+    def position(board):
+        return (dict(board.grid), sorted(board.playingarea),
+                board.numOfShrinks, board.get_masks(),
+                sorted(board.white_pieces), sorted(board.black_pieces))
+
+    turns = 0
+    def check(board):
+        nonlocal turns
+        turns += 1
+        for phase in PHASES:
+            data = board.to_bytes(phase, turns)
+            assert len(data) == SNAPSHOT.size
+            copy, copy_phase, copy_turns = Board.from_bytes(data)
+            assert (copy_phase, copy_turns) == (phase, turns)
+            assert position(copy) == position(board)
+
+        # A clone has the same caches and is independent of the board
+        copy = board.clone()
+        assert position(copy) == position(board)
+        for colour, team in [(WHITE, board.white_pieces),
+                             (BLACK, board.black_pieces)]:
+            assert copy.get_threats(colour) == board.get_threats(colour)
+            assert copy.get_mobility(colour) == board.get_mobility(colour)
+            for pos in team:
+                assert copy.get_moves(pos) == board.get_moves(pos)
+        before = position(board)
+        for pos, piece in list(copy.get_alive(WHITE).items())[:1]:
+            for move in piece.listmoves(0)[:1]:
+                piece.make_move(move)
+        assert position(board) == before
+    random_play(sample(check, 5))
+
+def test_placements():
+    def check(board):
+        for colour in [WHITE, BLACK]:
+            free = board.placements(colour)
+            assert len(free) == len(set(free))
+            assert set(free) == {pos for pos in board.starting_zone(colour)
+                                 if board.grid[pos] == EMPTY}
+        for pos, value in board.grid.items():
+            piece = board.get_piece(pos)
+            if value in (WHITE, BLACK):
+                assert piece.pos == pos and piece.player == value
+            else:
+                assert piece is None
+    random_play(check)
+
+def test_accumulator():
+    network = nnue.random_network(seed=0)
+    def check(board):
+        values = network.attach(board).refresh()
+        assert np.allclose(values, network.accumulate(board))
+    # Refreshing only some positions lets changes build up (and cancel out
+    # when undone) between refreshes
+    random_play(sample(check, 3))
@@ -0,0 +1,67 @@
+"""
+Checks that batch_eval gives the same values as Player.evaluate_board, for
+both input forms, on every position of some random games
+
+Usage: python -m pytest test_batch_eval.py
+"""
+import random
+
+import numpy as np
+
+import batch_eval
+from minimax_module import Player, WHITE, BLACK, PLACING, MOVING
+from minimax_module import MOVING_PHASE, SHRINK, CONTINUE
+from watchyourback import Board, EMPTY
+
+def random_positions(games=20, seed=0):
+    """
+    Yields (board, phase) after every action of 'games' games of random
+    play (the same Board instance until the game ends)
+    """
+    rng = random.Random(seed)
+    for _ in range(games):
+        board = Board(8)
+        for index in range(MOVING_PHASE + 200):
+            colour = WHITE if index % 2 == 0 else BLACK
+            if index < MOVING_PHASE:
+                phase = PLACING
+                squares = [pos for pos in board.starting_zone(colour)
+                           if board.grid[pos] == EMPTY]
+                board.place_piece(colour, rng.choice(squares))
+            else:
+                phase = MOVING
+                moves = [(pos, move)
+                         for pos, piece in board.get_alive(colour).items()
+                         for move in piece.listmoves(0)]
+                if moves:
+                    oldpos, newpos = rng.choice(moves)
+                    board.get_piece(oldpos).make_move(newpos)
+                if index - MOVING_PHASE + 1 in SHRINK:
+                    board.shrink()
+            yield board, phase
+            if phase == MOVING and board.check_win(WHITE) != CONTINUE:
+                break
+
+def test_batch_matches_evaluate_board():
+    players = {WHITE: Player('white'), BLACK: Player('black')}
+    boards, masks, expected = [], [], []
+    for board, phase in random_positions():
+        boards.append(batch_eval.encode_board(board))
+        masks.append(board.get_masks())
+        values = {}
+        for colour, player in players.items():
+            player.phase = phase
+            values[colour] = player.evaluate_board(board)
+        expected.append((phase, values))
+
+    batch = np.stack(boards)
+    masks = np.array(masks, dtype=np.uint64)
+    for phase in [PLACING, MOVING]:
+        rows = [i for i, (row_phase, _) in enumerate(expected)
+                if row_phase == phase]
+        for colour in [WHITE, BLACK]:
+            wanted = [expected[i][1][colour] for i in rows]
+            assert batch_eval.evaluate_batch(
+                    batch[rows], colour, phase).tolist() == wanted
+            assert batch_eval.evaluate_masks(
+                    masks[rows], colour, phase).tolist() == wanted
@@ -0,0 +1,53 @@
+"""
+Round trip checks of gamerecord.py: records written to a file and read back
+(including forfeited moves, unencodable final actions and long names)
+
+Usage: python -m pytest test_gamerecord.py
+"""
+import gamerecord
+from gamerecord import GameRecord, MOVING_PHASE, MAX_NAME, INVALID
+
+def placements():
+    return [(x, y) for y in range(8) for x in range(8)][1:MOVING_PHASE + 1]
+
+def roundtrip(record):
+    return GameRecord.from_bytes(record.to_bytes())
+
+def test_roundtrip(tmp_path):
+    actions = placements() + [((1, 2), (1, 3)), None, ((7, 6), (5, 6))]
+    records = [GameRecord('minimax_module', 'random_module', 'W',
+                          'completed', actions, [0.5] * len(actions)),
+               GameRecord('a', 'b', None, 'unfinished', [(3, 4)], [0.0]),
+               GameRecord('a', 'b', 'draw', 'resource')]
+    path = tmp_path / 'games.wyb'
+    gamerecord.write_records(path, records[:2])
+    gamerecord.write_records(path, records[2:])
+
+    for record, read in zip(records, gamerecord.read_records(path)):
+        assert (read.white, read.black, read.winner, read.ending) == \
+               (record.white, record.black, record.winner, record.ending)
+        assert read.actions == record.actions
+        assert read.times == record.times
+    assert len(list(gamerecord.read_records(path))) == len(records)
+
+def test_unencodable_actions():
+    # Off the board, not a square at all, or the wrong shape: every one is
+    # read back as INVALID
+    for bad in [(8, 0), (-1, 3), (2, 300), 'e4', None, (1, 2, 3)]:
+        record = GameRecord('a', 'b', 'B', 'invalid', [bad])
+        assert roundtrip(record).actions == [INVALID]
+
+    for bad in [((0, 1), (8, 1)), ((0, 1),), (3, 4), 'pass']:
+        actions = placements() + [((1, 2), (1, 3)), bad]
+        record = GameRecord('a', 'b', 'W', 'invalid', actions)
+        assert roundtrip(record).actions == actions[:-1] + [INVALID]
+
+    # The invalid final action is never played when replaying
+    record = GameRecord('a', 'b', 'B', 'invalid', placements()[:3] + [(8, 0)])
+    assert len(list(roundtrip(record).replay())) == 3
+
+def test_long_names():
+    record = roundtrip(GameRecord('w' * 300, 'é' * 200))
+    assert record.white == 'w' * MAX_NAME
+    # Cut between characters rather than in the middle of one
+    assert record.black == 'é' * (MAX_NAME // 2)
@@ -0,0 +1,101 @@
+"""
+Checks of posdb.py: bulk loading games, looking positions up, merging the
+results of repeated positions and recovering an interrupted append
+
+Usage: python -m pytest test_posdb.py
+"""
+import random
+
+import numpy as np
+
+import posdb
+import gamerecord
+from gamerecord import GameRecord, MOVING_PHASE, WHITE, BLACK
+from watchyourback import Board, EMPTY
+
+def random_game(seed, winner, opening=()):
+    """
+    Returns a GameRecord of random placements (starting with 'opening')
+    followed by a few random moves
+    """
+    rng = random.Random(seed)
+    record = GameRecord('random_module', 'random_module', winner, 'completed')
+    board = Board(8)
+    for index in range(MOVING_PHASE + 10):
+        colour = WHITE if index % 2 == 0 else BLACK
+        if index < MOVING_PHASE:
+            if index < len(opening):
+                action = opening[index]
+            else:
+                action = rng.choice([pos for pos in board.starting_zone(colour)
+                                     if board.grid[pos] == EMPTY])
+            board.place_piece(colour, action)
+        else:
+            moves = [(pos, move)
+                     for pos, piece in board.get_alive(colour).items()
+                     for move in piece.listmoves(0)]
+            action = rng.choice(moves) if moves else None
+            if action is not None:
+                board.get_piece(action[0]).make_move(action[1])
+        record.add(action)
+    return record
+
+OPENING = [(3, 3), (4, 4), (2, 5), (5, 2)]
+
+def test_add_games_and_lookup(tmp_path):
+    games = [random_game(0, 'W', OPENING), random_game(1, 'B', OPENING),
+             random_game(2, 'draw')]
+    db = posdb.PositionDB(str(tmp_path / 'positions'))
+    added = db.add_games(games, batch=10)
+    assert added == len(db) == len(np.unique(db.records['hash']))
+
+    # Every position of every game can be found, and positions reached in
+    # more than one game count all of them
+    seen = {}
+    for game in games:
+        result = posdb.RESULTS[game.winner]
+        for record in posdb.game_positions(game):
+            games_count, total = seen.get(record['hash'], (0, 0))
+            seen[record['hash']] = (games_count + 1, total + result)
+    assert len(seen) == len(db)
+    for game in games:
+        for index, _, board in game.replay(len(game.actions) - 1):
+            phase, turns = gamerecord.turn_info(index + 1)
+            stored = db.lookup(board, turns, phase)
+            assert stored is not None
+            games_count, total = seen[stored['hash']]
+            assert (stored['games'], stored['result_sum']) == \
+                   (games_count, total)
+
+    # The opening is shared by the first two games, with opposite results
+    board = Board(8)
+    board.place_piece(WHITE, OPENING[0])
+    stored = db.lookup(board, 1, gamerecord.PLACING)
+    assert (stored['games'], stored['result_sum']) == (2, 0)
+    assert stored['result'] == posdb.WHITE_WIN
+
+    # Adding the same games again adds no positions, only their results
+    assert db.add_games(games) == 0
+    reopened = posdb.PositionDB(db.path)
+    assert len(reopened) == len(seen)
+    assert reopened.lookup(board, 1, gamerecord.PLACING)['games'] == 4
+    assert np.all(reopened.records['games'] % 2 == 0)
+
+def test_interrupted_append(tmp_path):
+    first, second = random_game(0, 'W', OPENING), random_game(1, 'B', OPENING)
+    db = posdb.PositionDB(str(tmp_path / 'positions'))
+    db.add_games([first])
+    size = len(db)
+
+    # Records written but the index never replaced, with positions that are
+    # already stored among them
+    with open(db.path, 'ab') as file:
+        file.write(posdb.game_positions(second).tobytes())
+    db = posdb.PositionDB(db.path)
+    assert len(db.index) == len(db) == len(np.unique(db.records['hash']))
+    assert len(db) > size
+    board = Board(8)
+    board.place_piece(WHITE, OPENING[0])
+    stored = db.lookup(board, 1, gamerecord.PLACING)
+    assert (stored['games'], stored['result_sum']) == (2, 0)
+    assert all(db.find(db.records['hash']) == np.arange(len(db)))
@@ -0,0 +1,106 @@
+"""
+End-to-end checks of server.py: games between two random players played
+through a local MatchServer and the request_matches stand-in client, a
+player killed for running out of wall clock time and a malformed request
+
+Usage: python -m pytest test_server.py
+"""
+import os
+import json
+import asyncio
+
+import server
+
+SLOW = 2.0      # seconds the slow player takes over each action
+MOVE_WALL = 1.0 # wall clock limit per move given to it
+
+# Random player which takes longer than MOVE_WALL (wall clock) to act, as a
+# module for the workers to load
+SLOW_PLAYER = f"""
+import time
+import random_module
+
+class Player(random_module.Player):
+    def action(self, turns):
+        time.sleep({SLOW})
+        return super().action(turns)
+"""
+
+def run_server(client):
+    """
+    Starts a MatchServer on a free port, awaits client(match_server, port)
+    and returns its result after shutting the server down
+    """
+    async def run():
+        match_server = server.MatchServer(max_games=1)
+        listener = await asyncio.start_server(match_server.handle,
+                                              server.HOST, 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            return await client(match_server, port)
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            await match_server.close()
+    return asyncio.run(run())
+
+async def request(requests, port):
+    return [event async for event in
+            server.request_matches(requests, server.HOST, port)]
+
+def test_match_streams_result():
+    match = {'white': 'random_module', 'black': 'random_module', 'seed': 1}
+    events = run_server(lambda match_server, port: request([match], port))
+    actions = [event for event in events if event['event'] == 'action']
+    results = [event for event in events if event['event'] == 'result']
+
+    assert len(results) == 1 and events[-1] is results[0]
+    result = results[0]
+    assert result['ending'] == 'completed'
+    assert result['winner'] in ['W', 'B', 'draw']
+    assert result['actions'] == len(actions) > 24
+    assert [event['colour'] for event in actions[:2]] == ['white', 'black']
+    assert set(result['space']) == {'white', 'black'}
+
+def test_killed_worker_not_reused(tmp_path, monkeypatch):
+    (tmp_path / 'slow_player.py').write_text(SLOW_PLAYER)
+    monkeypatch.setenv('PYTHONPATH', str(tmp_path), prepend=os.pathsep)
+    match = {'white': 'slow_player', 'black': 'random_module',
+             'move_wall': MOVE_WALL}
+
+    async def client(match_server, port):
+        events = await request([match], port)
+        idle = {module: [worker.alive() for worker in workers]
+                for module, workers in match_server.idle.items()}
+        return events, idle
+
+    events, idle = run_server(client)
+    result = events[-1]
+    assert result['ending'] == 'resource' and result['winner'] == 'B'
+    assert 'wall clock' in result['reason']
+
+    # Only the worker which was still alive goes back to the pool
+    assert idle.get('slow_player', []) == []
+    assert idle['random_module'] == [True]
+
+def test_malformed_request():
+    match = {'white': 'random_module', 'black': 'random_module', 'seed': 2}
+
+    async def client(match_server, port):
+        reader, writer = await asyncio.open_connection(server.HOST, port)
+        writer.write(b'{"white": \n' + json.dumps(match).encode() + b'\n')
+        writer.write_eof()
+        events = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            events.append(json.loads(line))
+        writer.close()
+        return events
+
+    events = run_server(client)
+    errors = [event for event in events if event['event'] == 'error']
+    assert len(errors) == 1 and errors[0]['line'] == '{"white":'
+    assert events[-1]['event'] == 'result'
+    assert events[-1]['ending'] == 'completed'
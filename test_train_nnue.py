@@ -0,0 +1,75 @@
+"""
+Checks of train_nnue.py: its network gives the same values as nnue.Network,
+its gradients match finite differences and training fits a learnable target
+
+Usage: python -m pytest test_train_nnue.py
+"""
+import numpy as np
+
+import nnue
+import train_nnue
+from test_batch_eval import random_positions
+from watchyourback import WHITE, BLACK
+
+def position_batch(positions):
+    """
+    Returns (white, black, shrinks) arrays for a list of boards
+    """
+    masks = np.array([board.get_masks() for board in positions],
+                     dtype=np.uint64)
+    shrinks = np.array([board.numOfShrinks for board in positions])
+    return masks[:, 0], masks[:, 1], shrinks
+
+def sample_boards(count=200):
+    return [board.clone() for board, _ in random_positions(games=3)][:count]
+
+def test_forward_matches_network():
+    network = nnue.random_network(seed=1)
+    boards = sample_boards()
+    own, other = train_nnue.batch_inputs(*position_batch(boards))
+    output, _ = train_nnue.forward(train_nnue.parameters(network), own,
+                                   other)
+    expected = [network.evaluate(board, WHITE) for board in boards] + \
+               [network.evaluate(board, BLACK) for board in boards]
+    assert np.allclose(output, expected)
+
+def test_gradients():
+    network = nnue.random_network(hidden=8, hidden2=4, seed=2)
+    params = train_nnue.parameters(network)
+    own, other = train_nnue.batch_inputs(*position_batch(sample_boards(20)))
+    weights = np.random.default_rng(0).normal(size=2 * 20)
+
+    def objective(params):
+        return weights @ train_nnue.forward(params, own, other)[0]
+
+    _, cache = train_nnue.forward(params, own, other)
+    grads = train_nnue.backward(params, cache, weights)
+    rng = np.random.default_rng(1)
+    for param, grad in zip(params, grads):
+        for index in rng.choice(param.size, min(param.size, 10),
+                                replace=False):
+            index = np.unravel_index(index, param.shape)
+            saved = param[index]
+            param[index] = saved + 1e-6
+            high = objective(params)
+            param[index] = saved - 1e-6
+            low = objective(params)
+            param[index] = saved
+            assert np.isclose(grad[index], (high - low) / 2e-6, atol=1e-5)
+
+def test_training_fits():
+    # Results decided by the difference in pieces, which the network can
+    # learn from its inputs
+    boards = sample_boards(400)
+    white, black, shrinks = position_batch(boards)
+    difference = np.array([len(board.white_pieces) - len(board.black_pieces)
+                           for board in boards])
+    targets = np.where(difference > 0, 1.0, np.where(difference < 0, 0.0,
+                                                     0.5))
+    dataset = (white, black, shrinks, targets, np.ones(len(boards)))
+    k = 0.02
+    network = nnue.random_network(seed=3)
+    before = train_nnue.loss(train_nnue.parameters(network), dataset, k)
+    trained = train_nnue.train(network, dataset, k, epochs=200, rate=0.01)
+    after = train_nnue.loss(train_nnue.parameters(trained), dataset, k)
+    assert after < before / 4
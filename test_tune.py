@@ -0,0 +1,55 @@
+"""
+Checks that tune.py recovers known weights from synthetic positions whose
+results follow its own model
+
+Usage: python -m pytest test_tune.py
+"""
+import numpy as np
+
+import tune
+import posdb
+import batch_eval
+from minimax_module import WEIGHTS
+
+TRUE_WEIGHTS = np.array([30.0, -10.0, -2.0])
+K = 0.02
+
+def synthetic_rows(seed=0):
+    """
+    Returns (features, targets, counts) for random feature vectors in the
+    range of real positions, with targets from the true weights
+    """
+    rng = np.random.default_rng(seed)
+    own = rng.integers(2, 13, 400)
+    enemy = rng.integers(2, 13, 400)
+    distance = rng.integers(0, 4 * own + 1)
+    features = np.stack([own, enemy, distance], axis=1).astype(np.float64)
+    targets = tune.sigmoid(K * (features @ TRUE_WEIGHTS))
+    return features, targets, rng.integers(1, 20, 400).astype(np.float64)
+
+def test_fit_converges():
+    features, targets, counts = synthetic_rows()
+    initial = np.array([WEIGHTS[name] for name in batch_eval.FEATURES])
+    before = tune.loss(features, targets, counts, initial, K)
+    fitted = tune.fit_weights(features, targets, counts, initial, K,
+                              iterations=3000)
+    after = tune.loss(features, targets, counts, fitted, K)
+    assert after < before / 100
+    assert np.allclose(fitted, TRUE_WEIGHTS, rtol=0.05, atol=0.2)
+
+def test_fit_scale():
+    features, targets, counts = synthetic_rows()
+    k = tune.fit_scale(features, targets, counts, TRUE_WEIGHTS)
+    assert abs(k - K) < 1e-4
+
+def test_dataset_counts_every_game():
+    # The same position reached in three games (two won by white) and a
+    # position with no known result
+    records = posdb.make_records([0b111, 0b1111], [0b111 << 40, 0], 0,
+                                 [30, 30], posdb.MOVING_CODE)
+    records['games'] = [3, 0]
+    records['result_sum'] = [1, 0]
+    features, targets, counts = tune.build_dataset(records)
+    assert counts.tolist() == [3, 3]
+    assert np.allclose(sorted(targets), [1 / 3, 2 / 3])
+    assert sorted(features[:, 0].tolist()) == [3, 3]
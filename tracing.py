@@ -0,0 +1,188 @@
+"""
+Chrome trace-event recording of what a Player spends each turn doing
+
+When the environment variable WYB_TRACE is set to a file name, players
+record spans (a name, category, start, duration and some arguments) for each
+turn and the parts of it: proof searches, border evacuation, every iteration
+of the search, every action searched at the root and a sample of quiescence
+searches. The file is written in the Chrome trace-event JSON format so a game
+can be opened in chrome://tracing or ui.perfetto.dev, with one track for each
+player.
+
+Events are buffered in memory as tuples and only converted to JSON when
+BUFFER_SIZE of them have built up (between turns) or the process exits, and
+quiescence searches (which happen thousands of times a turn) are recorded
+one in WYB_TRACE_SAMPLE (default SAMPLE), so tracing a game changes its
+timing by only a few percent. '{pid}' in the file name is replaced by the
+process id, for tracing players run in worker processes.
+
+Usage: WYB_TRACE=game.json python referee.py minimax_module random_module
+"""
+import os
+import json
+import math
+import time
+import atexit
+
+# CONSTANTS
+TRACE_ENV = 'WYB_TRACE'
+SAMPLE_ENV = 'WYB_TRACE_SAMPLE'
+SAMPLE = 64         # one in SAMPLE frequent spans is recorded
+BUFFER_SIZE = 20000 # events held before they are written out
+
+# CLASSES
+class Span:
+    """
+    Context manager recording a complete event for the code it wraps.
+    Arguments can be added with set before it ends
+    """
+    __slots__ = ['tracer', 'name', 'cat', 'tid', 'args', 'start']
+
+    def __init__(self, tracer, name, cat, tid, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.tid = tid
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.complete(self.name, self.cat, self.tid, self.start,
+                             self.args)
+
+class NullSpan:
+    """
+    Span used when tracing is off, which records nothing
+    """
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Tracer:
+    """
+    Buffer of trace events written to 'path' in the Chrome trace-event JSON
+    array format
+    """
+    def __init__(self, path, sample=SAMPLE, buffer_size=BUFFER_SIZE):
+        self.pid = os.getpid()
+        self.path = path.format(pid=self.pid)
+        self.sample_every = sample
+        self.buffer_size = buffer_size
+        self.events = []
+        self.counts = {}
+        self.tracks = 0
+        self.file = None
+        self.written = 0
+        self.origin = time.perf_counter()
+
+    def track(self, name):
+        """
+        Returns the id of a new track (thread) called 'name'
+        """
+        self.tracks += 1
+        self.events.append(('M', 'thread_name', None, self.tracks, 0, 0,
+                            {'name': name}))
+        return self.tracks
+
+    def sample(self, name):
+        """
+        Returns true for one in every 'sample_every' calls with 'name'
+        """
+        count = self.counts.get(name, 0) + 1
+        self.counts[name] = count
+        return count % self.sample_every == 0
+
+    def span(self, name, cat, tid, args=None):
+        return Span(self, name, cat, tid, {} if args is None else args)
+
+    def complete(self, name, cat, tid, start, args=None):
+        """
+        Records an event which started at perf_counter time 'start' and has
+        just ended
+        """
+        self.events.append(('X', name, cat, tid, start,
+                            time.perf_counter() - start, args))
+
+    def maybe_flush(self):
+        """
+        Writes out the buffered events if there are enough of them. Only
+        called between turns so that writing doesn't land in a search
+        """
+        if len(self.events) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes out the buffered events. The closing bracket is only written
+        by close but trace viewers accept a file without it
+        """
+        if not self.events:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'w')
+            self.file.write('[\n')
+        lines = []
+        for ph, name, cat, tid, start, duration, args in self.events:
+            event = {'ph': ph, 'name': name, 'pid': self.pid, 'tid': tid,
+                     'ts': round((start - self.origin) * 1e6, 1)
+                           if ph != 'M' else 0}
+            if cat is not None:
+                event['cat'] = cat
+            if ph == 'X':
+                event['dur'] = round(duration * 1e6, 1)
+            if args:
+                event['args'] = {key: json_safe(value)
+                                 for key, value in args.items()}
+            lines.append(json.dumps(event, default=str))
+        if self.written:
+            self.file.write(',\n')
+        self.file.write(',\n'.join(lines))
+        self.file.flush()
+        self.written += len(lines)
+        self.events = []
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.write('\n]\n')
+            self.file.close()
+            self.file = None
+
+# HELPER FUNCTIONS
+def json_safe(value):
+    """
+    Returns 'value' with infinite floats (search values) replaced by strings
+    since JSON has no infinity
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    return value
+
+_tracer = None
+
+def get_tracer():
+    """
+    Returns the process's Tracer if WYB_TRACE is set, otherwise None. The
+    trace is written out when the process exits
+    """
+    global _tracer
+    if _tracer is None and os.environ.get(TRACE_ENV):
+        sample = int(os.environ.get(SAMPLE_ENV, SAMPLE))
+        _tracer = Tracer(os.environ[TRACE_ENV], max(sample, 1))
+        atexit.register(_tracer.close)
+    return _tracer
@@ -0,0 +1,229 @@
+"""
+Training of the evaluation network of nnue.py from a position database
+
+Every position of a position database (see posdb.py) which reached the end
+of at least one game is used twice, once from each team's side, and the
+network is fitted so that sigmoid(K * output) predicts the mean final result
+of those games (1 for a win, 0.5 for a draw, 0 for a loss) with each
+position weighted by its number of games. K is the one tune.py finds for the
+current weights, so the trained network gives values on the same scale as
+Player.evaluate_board (which the search's windows and margins assume). The
+inputs are built from the stored piece masks one mini-batch at a time and the
+gradients are worked out by hand through the clipped ReLUs, so training only
+needs NumPy. The result is written to nnue.npz, which minimax_module loads at
+startup in place of the weighted evaluation.
+
+Usage: python train_nnue.py DATABASE [--games RECORDS] [-o nnue.npz]
+"""
+import argparse
+import numpy as np
+
+import nnue
+import tune
+import posdb
+import batch_eval
+import gamerecord
+from minimax_module import WEIGHTS, NNUE_FILE
+
+# CONSTANTS
+EPOCHS = 20
+BATCH = 4096
+LEARNING_RATE = 0.001
+
+# Rows of the network's input for the squares y*8+x seen from black (the
+# board mirrored top to bottom, see nnue.feature)
+MIRRORED = np.array([(7 - y)*8 + x for y in range(8) for x in range(8)])
+
+# HELPER FUNCTIONS
+def parameters(network):
+    """
+    Returns the weights of a Network as a list in the order of its
+    constructor's arguments (with b3 as an array)
+    """
+    return [network.w1, network.b1, network.w2, network.b2, network.w3,
+            np.array([network.b3])]
+
+def build_dataset(records):
+    """
+    Takes a RECORD array and returns (white, black, shrinks, targets,
+    counts): the piece masks and shrinks of every position with a known
+    result, the mean result of its games for white and their number.
+    Positions which have already been won, lost or tied are skipped (as in
+    tune.build_dataset)
+    """
+    records = records[records['games'] > 0]
+    white, black = batch_eval.unpack_masks(
+        np.stack([records['white'], records['black']], axis=1))
+    ongoing = ((records['phase'] == posdb.PLACING_CODE)
+               | ((white.sum(axis=1) >= 2) & (black.sum(axis=1) >= 2)))
+    records = records[ongoing]
+    counts = records['games'].astype(np.float64)
+    targets = (records['result_sum'] / counts + 1.0) / 2.0
+    return (records['white'], records['black'],
+            records['shrinks'].astype(np.intp), targets, counts)
+
+def inputs(own, enemy, shrinks):
+    """
+    Returns the (N, FEATURES) network input for boolean occupancy arrays of
+    a team's own and enemy pieces (already seen from its side) and the
+    number of shrinks of each position
+    """
+    x = np.zeros((len(own), nnue.FEATURES))
+    x[:, :nnue.SQUARES] = own
+    x[:, nnue.SQUARES:2*nnue.SQUARES] = enemy
+    x[np.arange(len(own)), 2*nnue.SQUARES + shrinks] = 1.0
+    return x
+
+def batch_inputs(white, black, shrinks):
+    """
+    Returns (own, other) inputs for a batch of positions seen from both
+    sides: white's rows first, then black's. 'own' is the side evaluated
+    for and 'other' its opponent, matching the halves of the accumulator
+    """
+    white, black = batch_eval.unpack_masks(np.stack([white, black], axis=1))
+    from_white = inputs(white, black, shrinks)
+    from_black = inputs(black[:, MIRRORED], white[:, MIRRORED], shrinks)
+    return (np.concatenate([from_white, from_black]),
+            np.concatenate([from_black, from_white]))
+
+def forward(params, own, other):
+    """
+    Returns the network output for a batch with the intermediate values
+    needed by backward. Gives the same values as nnue.Network.evaluate
+    """
+    w1, b1, w2, b2, w3, b3 = params
+    first = np.concatenate([own @ w1 + b1, other @ w1 + b1], axis=1)
+    hidden = np.clip(first, 0.0, 1.0) @ w2 + b2
+    output = np.clip(hidden, 0.0, 1.0) @ w3 + b3[0]
+    return output, (own, other, first, hidden)
+
+def backward(params, cache, grad):
+    """
+    Returns the gradients of the parameters given that of the loss with
+    respect to each output
+    """
+    w1, b1, w2, b2, w3, b3 = params
+    own, other, first, hidden = cache
+    active2 = np.clip(hidden, 0.0, 1.0)
+    g_w3 = active2.T @ grad
+    g_b3 = np.array([grad.sum()])
+    g_hidden = np.outer(grad, w3) * ((hidden > 0.0) & (hidden < 1.0))
+    g_w2 = np.clip(first, 0.0, 1.0).T @ g_hidden
+    g_b2 = g_hidden.sum(axis=0)
+    g_first = (g_hidden @ w2.T) * ((first > 0.0) & (first < 1.0))
+    size = w1.shape[1]
+    g_own, g_other = g_first[:, :size], g_first[:, size:]
+    g_w1 = own.T @ g_own + other.T @ g_other
+    g_b1 = g_own.sum(axis=0) + g_other.sum(axis=0)
+    return [g_w1, g_b1, g_w2, g_b2, g_w3, g_b3]
+
+def loss(params, dataset, k):
+    """
+    Mean squared error between predicted results and the mean result of
+    each position, weighted by its number of games, over both sides
+    """
+    white, black, shrinks, targets, counts = dataset
+    total = 0.0
+    for start in range(0, len(targets), BATCH):
+        part = slice(start, start + BATCH)
+        own, other = batch_inputs(white[part], black[part], shrinks[part])
+        output, _ = forward(params, own, other)
+        wanted = np.concatenate([targets[part], 1.0 - targets[part]])
+        games = np.concatenate([counts[part], counts[part]])
+        total += np.sum(games * (tune.sigmoid(k * output) - wanted) ** 2)
+    return total / (2 * np.sum(counts))
+
+def train(network, dataset, k, epochs=EPOCHS, rate=LEARNING_RATE, seed=0):
+    """
+    Trains a copy of a Network on a dataset from build_dataset with
+    mini-batch gradient descent (with Adam step sizes). Returns the trained
+    Network
+    """
+    white, black, shrinks, targets, counts = dataset
+
+    # The output layer is trained in units of K * output (where a step of
+    # the learning rate means as much as in the layers before it) and
+    # scaled back at the end
+    params = [param.copy() for param in parameters(network)]
+    params[4] *= k
+    params[5] *= k
+    m = [np.zeros_like(param) for param in params]
+    v = [np.zeros_like(param) for param in params]
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    total = np.sum(counts)
+    rng = np.random.default_rng(seed)
+    t = 0
+    for _ in range(epochs):
+        order = rng.permutation(len(targets))
+        for start in range(0, len(order), BATCH):
+            rows = order[start:start + BATCH]
+            own, other = batch_inputs(white[rows], black[rows], shrinks[rows])
+            output, cache = forward(params, own, other)
+            wanted = np.concatenate([targets[rows], 1.0 - targets[rows]])
+            share = np.concatenate([counts[rows], counts[rows]]) \
+                    * len(order) / (len(rows) * 2 * total)
+            p = tune.sigmoid(output)
+            grads = backward(params, cache,
+                             share * 2.0 * (p - wanted) * p * (1.0 - p))
+            t += 1
+            for param, grad, m_i, v_i in zip(params, grads, m, v):
+                m_i *= beta1
+                m_i += (1 - beta1) * grad
+                v_i *= beta2
+                v_i += (1 - beta2) * grad * grad
+                param -= rate * (m_i / (1 - beta1 ** t)) \
+                         / (np.sqrt(v_i / (1 - beta2 ** t)) + eps)
+    params[4] /= k
+    params[5] /= k
+    return nnue.Network(*params)
+
+def scale(records):
+    """
+    Returns the K of tune.py for the current weights and a RECORD array
+    """
+    features, targets, counts = tune.build_dataset(records)
+    initial = np.array([WEIGHTS[name] for name in batch_eval.FEATURES])
+    return tune.fit_scale(features, targets, counts, initial)
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Train the evaluation network against logged "
+                "positions and game results")
+    parser.add_argument('database',
+            help="position database (see posdb.py)")
+    parser.add_argument('--games', action='append', default=[],
+            help="game record file to add to the database first")
+    parser.add_argument('-o', '--output', default=NNUE_FILE,
+            help="where to write the network")
+    parser.add_argument('--init', default=None,
+            help="network to continue training from (default random)")
+    parser.add_argument('-e', '--epochs', type=int, default=EPOCHS,
+            help="passes over the positions")
+    parser.add_argument('-r', '--rate', type=float, default=LEARNING_RATE,
+            help="step size")
+    parser.add_argument('-s', '--seed', type=int, default=0,
+            help="random seed for the initial weights and batch order")
+    args = parser.parse_args()
+
+    db = posdb.PositionDB(args.database)
+    for path in args.games:
+        added = db.add_games(gamerecord.read_records(path))
+        print(f"added {added} positions from {path}")
+
+    dataset = build_dataset(db.records)
+    if len(dataset[3]) == 0:
+        raise SystemExit('no labelled positions to train on')
+    k = scale(db.records)
+    network = nnue.load_network(args.init) if args.init else None
+    if network is None:
+        network = nnue.random_network(seed=args.seed)
+    before = loss(parameters(network), dataset, k)
+    network = train(network, dataset, k, args.epochs, args.rate, args.seed)
+    after = loss(parameters(network), dataset, k)
+    print(f"{len(dataset[3])} positions, K = {k:.5f}")
+    print(f"loss: {before:.6f} (initial) -> {after:.6f} (trained)")
+    network.save(args.output)
+    print(f"network written to {args.output}")
+
+if __name__ == '__main__':
+    main()
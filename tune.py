@@ -0,0 +1,172 @@
+"""
+Texel-style tuning of the weights used by Player.evaluate_board
+
+Every labelled position in a position database (see posdb.py) is scored from
+both teams' points of view with the features of batch_eval, and the weights
+are fitted so that sigmoid(K * evaluation) predicts the mean final result
+of the games which reached it (1 for a win, 0.5 for a draw, 0 for a loss). K
+is first chosen so that the current weights fit as well as possible, which
+keeps the tuned weights on the same scale as the hand-tweaked ones. Since
+every feature is a small integer, positions with identical features are
+merged first (keeping their count and mean result), so each vectorised
+gradient step runs over a few thousand distinct rows no matter how many
+millions of positions were logged. The result is written as a JSON weight
+file which minimax_module loads at startup.
+
+Usage: python tune.py DATABASE [--games RECORDS] [-o weights.json]
+"""
+import json
+import argparse
+import numpy as np
+
+import posdb
+import batch_eval
+import gamerecord
+from minimax_module import WEIGHTS, WEIGHTS_FILE, WHITE, BLACK
+
+# CONSTANTS
+ITERATIONS = 500
+LEARNING_RATE = 0.05
+
+# HELPER FUNCTIONS
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+def build_dataset(records):
+    """
+    Takes a RECORD array and returns (features, targets, counts) with one
+    row per distinct feature vector, where targets is the mean result of the
+    'counts' games reaching positions (seen by either team) with those
+    features. Positions without a known result and positions which have
+    already been won, lost or tied are skipped
+    """
+    records = records[records['games'] > 0]
+    white, black = batch_eval.unpack_masks(
+        np.stack([records['white'], records['black']], axis=1))
+    counts = np.stack([white.sum(axis=1), black.sum(axis=1)], axis=1)
+    ongoing = ((records['phase'] == posdb.PLACING_CODE)
+               | (counts.min(axis=1) >= 2))
+    white, black, records = white[ongoing], black[ongoing], records[ongoing]
+
+    # Results are stored from white's point of view (1, 0, -1), summed over
+    # every game which reached the position
+    games = records['games'].astype(np.float64)
+    result = (records['result_sum'] / games + 1.0) / 2.0
+    features = np.concatenate([
+        batch_eval.extract_features(white, black, WHITE),
+        batch_eval.extract_features(white, black, BLACK)])
+    targets = np.concatenate([result, 1.0 - result])
+    games = np.concatenate([games, games])
+
+    # Merge rows with equal (integer) features
+    keys = features.astype(np.int64)
+    keys = keys[:, 0] + 64 * (keys[:, 1] + 64 * keys[:, 2])
+    keys, first, inverse = np.unique(keys, return_index=True,
+                                     return_inverse=True)
+    counts = np.bincount(inverse, weights=games)
+    targets = np.bincount(inverse, weights=games * targets) / counts
+    return features[first], targets, counts
+
+def loss(features, targets, counts, weights, k):
+    """
+    Mean squared error between predicted results and the mean result of
+    each row of features (ignores the constant variance within rows)
+    """
+    error = (sigmoid(k * (features @ weights)) - targets) ** 2
+    return np.sum(counts * error) / np.sum(counts)
+
+def fit_scale(features, targets, counts, weights, low=1e-4, high=1.0,
+              steps=60):
+    """
+    Returns the K minimising the loss of 'weights' (golden section search
+    over log K)
+    """
+    ratio = (np.sqrt(5) - 1) / 2
+    a, b = np.log(low), np.log(high)
+    for _ in range(steps):
+        c = b - ratio * (b - a)
+        d = a + ratio * (b - a)
+        if loss(features, targets, counts, weights, np.exp(c)) < \
+           loss(features, targets, counts, weights, np.exp(d)):
+            b = d
+        else:
+            a = c
+    return float(np.exp((a + b) / 2))
+
+def fit_weights(features, targets, counts, weights, k,
+                iterations=ITERATIONS, rate=LEARNING_RATE):
+    """
+    Full batch gradient descent (with Adam step sizes) starting from
+    'weights'. Returns the fitted weight vector
+    """
+    weights = np.array(weights, dtype=np.float64)
+    m = np.zeros_like(weights)
+    v = np.zeros_like(weights)
+    share = counts / np.sum(counts)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for t in range(1, iterations + 1):
+        p = sigmoid(k * (features @ weights))
+        grad = features.T @ (share * 2.0 * (p - targets) * p * (1.0 - p) * k)
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        step = m / (1 - beta1 ** t) / (np.sqrt(v / (1 - beta2 ** t)) + eps)
+        weights -= rate * np.abs(weights).clip(1.0) * step
+    return weights
+
+def tune(records, iterations=ITERATIONS, rate=LEARNING_RATE):
+    """
+    Tunes WEIGHTS against a RECORD array. Returns (weights, k, before, after)
+    where weights is a new dictionary in the same format as WEIGHTS
+    """
+    features, targets, counts = build_dataset(records)
+    if len(targets) == 0:
+        raise ValueError('no labelled positions to tune against')
+    initial = np.array([WEIGHTS[name] for name in batch_eval.FEATURES])
+    k = fit_scale(features, targets, counts, initial)
+    fitted = fit_weights(features, targets, counts, initial, k, iterations,
+                         rate)
+
+    weights = dict(WEIGHTS)
+    weights.update(zip(batch_eval.FEATURES, fitted.tolist()))
+    return (weights, k, loss(features, targets, counts, initial, k),
+            loss(features, targets, counts, fitted, k))
+
+def save_weights(weights, path=WEIGHTS_FILE):
+    """
+    Writes a weight dictionary in the format read by
+    minimax_module.load_weights
+    """
+    with open(path, 'w') as file:
+        json.dump(weights, file, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Tune the evaluation weights against logged "
+                "positions and game results")
+    parser.add_argument('database',
+            help="position database (see posdb.py)")
+    parser.add_argument('--games', action='append', default=[],
+            help="game record file to add to the database first")
+    parser.add_argument('-o', '--output', default=WEIGHTS_FILE,
+            help="where to write the tuned weights")
+    parser.add_argument('-i', '--iterations', type=int, default=ITERATIONS,
+            help="number of gradient steps")
+    parser.add_argument('-r', '--rate', type=float, default=LEARNING_RATE,
+            help="relative step size")
+    args = parser.parse_args()
+
+    db = posdb.PositionDB(args.database)
+    for path in args.games:
+        added = db.add_games(gamerecord.read_records(path))
+        print(f"added {added} positions from {path}")
+
+    weights, k, before, after = tune(db.records, args.iterations, args.rate)
+    print(f"{len(db)} positions, K = {k:.5f}")
+    print(f"loss: {before:.6f} (current) -> {after:.6f} (tuned)")
+    for name in batch_eval.FEATURES:
+        print(f"  {name}: {WEIGHTS[name]:.3f} -> {weights[name]:.3f}")
+    save_weights(weights, args.output)
+    print(f"weights written to {args.output}")
+
+if __name__ == '__main__':
+    main()
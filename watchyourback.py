@@ -9,11 +9,28 @@ strategy. It also allows moves to be reversed to aid the Player class.
 Authors: Ckyever Gaviola, Samuel Fatone
 May 2018
 """
+import struct
+
 # CONSTANTS
 WHITE, BLACK, CORNER, EMPTY = ['O','@','X','-']
 DIRECTIONS = UP, DOWN, LEFT, RIGHT = (0, -1), (0, 1), (-1, 0), (1, 0)
 WHITE_ZONE, BLACK_ZONE = range(6), range(2, 8)
 WIN, TIE, LOSS, CONTINUE = [3,2,1,0]
+OPPONENT = {WHITE: BLACK, BLACK: WHITE}
+ENEMIES = {WHITE: frozenset([BLACK, CORNER]), BLACK: frozenset([WHITE, CORNER])}
+POOL_SIZE = 12 # number of pieces each player places
+PHASES = PLACING, MOVING = ['placing', 'moving']
+
+# Packed position: white and black masks, number of shrinks, turns, index of
+# the phase in PHASES (the same fields as a posdb.py record)
+SNAPSHOT = struct.Struct('<QQBHB')
+
+# Symmetries of the board (bit 1 mirrors x, bit 2 mirrors y), only 
+# IDENTITY and MIRROR_X apply during the placing phase
+IDENTITY, MIRROR_X, MIRROR_Y, MIRROR_XY = range(4)
+PLACING_SYMMETRIES = [IDENTITY, MIRROR_X]
+MOVING_SYMMETRIES = [IDENTITY, MIRROR_X, MIRROR_Y, MIRROR_XY]
+REVERSED_BITS = bytes(int(format(i, '08b')[::-1], 2) for i in range(256))
 
 # HELPER FUNCTIONS
 def step(position, direction):
@@ -25,6 +42,152 @@ def step(position, direction):
     dx, dy = direction
     return (px+dx, py+dy)
 
+def border_ring(s):
+    """
+    Returns set of squares that are eliminated by the next shrink when the
+    board has been shrunk 's' times: the outer ring of the playing area plus
+    the four squares that become corners
+    """
+    ring = set()
+    for i in range(s, 8-s):
+        for j in range(s, 8-s):
+            if i==s or i==7-s or j==s or j==7-s:
+                ring.add((i, j))
+    ring.update([(s+1, s+1), (s+1, 6-s), (6-s, s+1), (6-s, 6-s)])
+    return frozenset(ring)
+
+def safety_distances(s):
+    """
+    Returns dictionary mapping each square in the playing area (after 's' 
+    shrinks) to the number of single steps needed to reach a square that 
+    survives the next shrink, ignoring other pieces (BFS outwards from the 
+    safe squares)
+    """
+    ring = BORDER_RINGS[s]
+    corners = [(s, s), (s, 7-s), (7-s, s), (7-s, 7-s)]
+    area = [(x, y) for x in range(s, 8-s) for y in range(s, 8-s)
+            if (x, y) not in corners]
+    
+    distances = {square: 0 for square in area if square not in ring}
+    frontier = list(distances)
+    while frontier:
+        next_frontier = []
+        for square in frontier:
+            for dir in DIRECTIONS:
+                adjacent_square = step(square, dir)
+                if adjacent_square in area and \
+                adjacent_square not in distances:
+                    distances[adjacent_square] = distances[square] + 1
+                    next_frontier.append(adjacent_square)
+        frontier = next_frontier
+    return distances
+
+def transform_mask(mask, transform):
+    """
+    Applies one of the board symmetries to a mask of squares (bit y*8+x)
+    """
+    rows = mask.to_bytes(8, 'little')
+    if transform & MIRROR_X:
+        rows = rows.translate(REVERSED_BITS)
+    return int.from_bytes(rows, 'big' if transform & MIRROR_Y else 'little')
+
+def transform_square(pos, transform):
+    """
+    Applies one of the board symmetries to position (x,y). Every symmetry is
+    its own inverse so this also maps a square back
+    """
+    x, y = pos
+    if transform & MIRROR_X:
+        x = 7 - x
+    if transform & MIRROR_Y:
+        y = 7 - y
+    return (x, y)
+
+def transform_action(action, transform):
+    """
+    Applies one of the board symmetries to a placing (x,y) or moving 
+    ((a,b),(c,d)) action, e.g. to map a move stored under a canonical key 
+    back onto the actual board
+    """
+    if action is None or transform == IDENTITY:
+        return action
+    if isinstance(action[0], int):
+        return transform_square(action, transform)
+    oldpos, newpos = action
+    return (transform_square(oldpos, transform), 
+            transform_square(newpos, transform))
+
+def square_bit(pos):
+    """
+    Returns the bit of (x,y) in a mask of squares
+    """
+    x, y = pos
+    return 1 << (y*8 + x)
+
+def capture_lines(pos):
+    """
+    Returns list of (neighbour, beyond, bit of neighbour) for each direction
+    from (x,y) that stays on the board: a piece arriving at (x,y) captures
+    an enemy on 'neighbour' if 'beyond' holds a friendly piece or corner
+    """
+    lines = []
+    for dir in DIRECTIONS:
+        neighbour = step(pos, dir)
+        beyond = step(neighbour, dir)
+        if beyond in SQUARES:
+            lines.append((neighbour, beyond, square_bit(neighbour)))
+    return lines
+
+def arrival_lines(pos):
+    """
+    Returns list of (neighbour, beyond) for each direction from (x,y) that 
+    stays on the board, where 'beyond' is None if it is off the board: a
+    piece on 'neighbour' can step to (x,y) and one on 'beyond' can jump to it
+    over 'neighbour'
+    """
+    lines = []
+    for dir in DIRECTIONS:
+        neighbour = step(pos, dir)
+        beyond = step(neighbour, dir)
+        if neighbour in SQUARES:
+            lines.append((neighbour, beyond if beyond in SQUARES else None))
+    return lines
+
+# Precomputed rings and distance maps for each number of shrinks
+BORDER_RINGS = [border_ring(s) for s in range(3)]
+SAFETY_DISTANCES = [safety_distances(s) for s in range(3)]
+
+# Capture geometry of each square, and the squares whose threats can change
+# when a square changes (itself and the squares up to two away in a line)
+SQUARES = frozenset((x, y) for x in range(8) for y in range(8))
+PLAYING_AREAS = [frozenset((x, y) for x in range(s, 8-s) for y in range(s, 8-s))
+                 for s in range(3)]
+SQUARE_BITS = {pos: square_bit(pos) for pos in SQUARES}
+CAPTURE_LINES = {pos: capture_lines(pos) for pos in SQUARES}
+ARRIVAL_LINES = {pos: arrival_lines(pos) for pos in SQUARES}
+AFFECTED = {pos: frozenset([pos] + [square for square in SQUARES
+                                    for neighbour, beyond, _ 
+                                    in CAPTURE_LINES[square]
+                                    if pos in (neighbour, beyond)])
+            for pos in SQUARES}
+# The squares whose moves can change when a square changes: a piece's moves
+# depend on the squares one and two away from it in each direction, even
+# where the line runs off the board
+MOVES_AFFECTED = {pos: frozenset([pos] + [square
+                                          for line in ARRIVAL_LINES[pos]
+                                          for square in line
+                                          if square is not None])
+                  for pos in SQUARES}
+
+# Squares of each team's starting zone (in the order of the playing area) 
+# and the teams which can place on each square
+ZONE_SQUARES = {colour: [(x, y) for y in zone for x in range(8)
+                         if (x, y) not in [(0,0), (0,7), (7,0), (7,7)]]
+                for colour, zone in [(WHITE, WHITE_ZONE), (BLACK, BLACK_ZONE)]}
+ZONE_COLOURS = {pos: tuple(colour for colour in [WHITE, BLACK]
+                           if pos in ZONE_SQUARES[colour])
+                for pos in SQUARES}
+
 # CLASSES
 class Board:
     """
@@ -39,39 +202,134 @@ class Board:
         included in the active zone (allows us to shrink board easier) and
         dictionary of each players pieces
         """
-        self.grid = {}
         self.size = size
-        self.playingarea = []
+        self.playingarea = [(x, y) for y in range(size) for x in range(size)]
+        self.grid = dict.fromkeys(self.playingarea, EMPTY)
         self.playingsize = size
         self.numOfShrinks = 0
-        for y, row in enumerate(range(size)):
-            for x, char in enumerate(range(size)):
-                self.grid[x, y] = EMPTY
-                self.playingarea.append((x,y))
         for corner in [(0,0), (0,size-1), (size-1,0), (size-1,size-1)]:
             self.grid[corner] = CORNER
             
-        # Initialise dictionary holding each players pieces
+        # Initialise dictionary holding each players pieces (only those alive)
         self.white_pieces = {}
         self.black_pieces = {}
+
+        # Preallocated pieces reused by place_piece and undo_place (pieces
+        # in the pool are off the board, so not alive)
+        self.pool = {colour: [Piece(colour, None, self)
+                              for _ in range(POOL_SIZE)]
+                     for colour in [WHITE, BLACK]}
+        for pool in self.pool.values():
+            for piece in pool:
+                piece.alive = False
+        
+        # Threat map: for each team, the empty squares where one of its
+        # pieces would capture and the mask of enemy pieces it would capture
+        # there. Squares which have changed since it was last brought up to
+        # date are kept in 'threat_dirty' with their value at that time (see
+        # set_square)
+        self.threats = {WHITE: {}, BLACK: {}}
+        self.threat_dirty = {}
+        
+        # Move cache: (colour, moves) of the piece on each occupied square 
+        # and the total number of moves of each team, with changed squares
+        # kept in 'moves_dirty' in the same way. A move only changes the
+        # moves of pieces up to two squares away in a line from the squares
+        # it changed (see MOVES_AFFECTED), so only those are recomputed
+        self.moves = {}
+        self.mobility = {WHITE: 0, BLACK: 0}
+        self.moves_dirty = {}
+        
+        # Masks of each team's pieces (see get_masks), kept up to date by 
+        # set_square
+        self.white_mask = 0
+        self.black_mask = 0
+        
+        # Empty squares of each team's starting zone (the squares it can
+        # place on), as dicts used as ordered sets and kept up to date by
+        # set_square
+        self.free = {}
+        self.reset_free()
+        
+        # First layer of an evaluation network (see nnue.py), which is told
+        # of the squares changed by set_square. None unless one is attached
+        self.accumulator = None
+        
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Returns (board, phase, turns) for a snapshot made by to_bytes
+        """
+        white, black, shrinks, turns, phase = SNAPSHOT.unpack(data)
+        board = cls(8)
+        if shrinks:
+            board.set_shrinks(shrinks)
+        for colour, mask in [(WHITE, white), (BLACK, black)]:
+            while mask:
+                bit = mask & -mask
+                index = bit.bit_length() - 1
+                board.add_piece(colour, (index % 8, index // 8))
+                mask ^= bit
+        return board, PHASES[phase], turns
+    
+    def to_bytes(self, phase=PLACING, turns=0):
+        """
+        Returns a fixed size snapshot of the board (SNAPSHOT.size bytes) 
+        along with the phase and number of turns into it, which the Board 
+        can be rebuilt from with from_bytes
+        """
+        return SNAPSHOT.pack(self.white_mask, self.black_mask, 
+                             self.numOfShrinks, turns, PHASES.index(phase))
+    
+    def clone(self):
+        """
+        Returns a new Board holding the same position as this one
+        """
+        return Board.from_bytes(self.to_bytes())[0]
+    
+    def set_shrinks(self, shrinks):
+        """
+        Sets up the playing area and corners of an empty board after 
+        'shrinks' shrinks, without the eliminations of shrink (for setting 
+        up a given position)
+        """
+        area = PLAYING_AREAS[shrinks]
+        self.playingarea = [square for square in self.playingarea 
+                            if square in area]
+        self.playingsize = self.size - 2*shrinks
+        for s in range(shrinks + 1):
+            value = CORNER if s == shrinks else EMPTY
+            for corner in [(s, s), (s, 7-s), (7-s, 7-s), (7-s, s)]:
+                self.set_square(corner, value)
+        self.numOfShrinks = shrinks
+        self.threat_dirty = dict.fromkeys(self.grid)
+        self.moves_dirty = dict.fromkeys(self.grid)
+        self.reset_free()
         
     def starting_zone(self, colour):
         """
         Returns a list which represents all tuples in selected teams zone
         during the placing phase
         """
-        zone = []
-        
-        for x, y in self.playingarea:
-            if (x, y) not in [(0,0), (0,7), (7,0), (7,7)]:
-                if colour == WHITE:
-                    if y in WHITE_ZONE:
-                        zone.append((x, y))
-                else:
-                    if y in BLACK_ZONE:
-                        zone.append((x, y))
+        area = PLAYING_AREAS[self.numOfShrinks]
+        return [pos for pos in ZONE_SQUARES[colour] if pos in area]
     
-        return zone
+    def placements(self, colour):
+        """
+        Returns list of the empty squares in the team's starting zone (where
+        it can place a piece)
+        """
+        return list(self.free[colour])
+    
+    def reset_free(self):
+        """
+        Rebuilds the free squares of each starting zone from the grid
+        """
+        grid = self.grid
+        for colour in [WHITE, BLACK]:
+            self.free[colour] = dict.fromkeys(
+                    pos for pos in self.starting_zone(colour)
+                    if grid[pos] == EMPTY)
     
     def get_piece(self, pos):
         """
@@ -103,40 +361,61 @@ class Board:
             for key, piece in self.black_pieces.items():
                 if piece.alive == True:
                     dictionary[key] = piece
-                    
+
         return dictionary
+
+    def get_masks(self):
+        """
+        Returns a tuple of integers (white, black) where bit y*8+x is set if
+        that team has an alive piece at (x,y)
+        """
+        return self.white_mask, self.black_mask
+
+    def canonical_key(self, colour, moving):
+        """
+        Returns (key, transform) where key is the same for every position in
+        the symmetry class of this one with 'colour' to move, and transform 
+        maps actions between this board and the canonical one (see 
+        transform_action). Keys hold the mover's and opponent's masks so 
+        during the moving phase swapping colours gives the same key; during 
+        the placing phase the starting zones differ so the colour is kept
+        """
+        white, black = self.get_masks()
+        if colour == WHITE:
+            mover, other = white, black
+        else:
+            mover, other = black, white
+        
+        if moving:
+            symmetries = MOVING_SYMMETRIES
+            extra = (self.numOfShrinks, True)
+        else:
+            symmetries = PLACING_SYMMETRIES
+            extra = (self.numOfShrinks, colour)
+        
+        best = None
+        for transform in symmetries:
+            masks = (transform_mask(mover, transform), 
+                     transform_mask(other, transform))
+            if best is None or masks < best[0]:
+                best = (masks, transform)
+        masks, transform = best
+        return masks + extra, transform
     
     def get_border_pieces(self, colour):
         """
         Gets pieces that are currently on the border if a shrink were to occur
         now
         """
-        dictionary = {}
-        
-        s = self.numOfShrinks
+        ring = BORDER_RINGS[self.numOfShrinks]
         
         if colour == WHITE:
-            for key, piece in self.white_pieces.items():
-                if piece.alive == True:
-                    if key[0]==s or key[0]==7-s or key[1]==s or key[1]==7-s:
-                        dictionary[key] = piece
-                    elif (key[0]==s+1 and key[1]==s+1) or \
-                    (key[0]==s+1 and key[1]==6-s) or \
-                    (key[0]==6-s and key[1]==s+1) or \
-                    (key[0]==6-s and key[1]==6-s):
-                        dictionary[key] = piece
+            pieces = self.white_pieces
         else:
-            for key, piece in self.black_pieces.items():
-                if piece.alive == True:
-                    if key[0]==s or key[0]==7-s or key[1]==s or key[1]==7-s:
-                        dictionary[key] = piece
-                    elif (key[0]==s+1 and key[1]==s+1) or \
-                    (key[0]==s+1 and key[1]==6-s) or \
-                    (key[0]==6-s and key[1]==s+1) or \
-                    (key[0]==6-s and key[1]==6-s):
-                        dictionary[key] = piece
+            pieces = self.black_pieces
                     
-        return dictionary
+        return {key: piece for key, piece in pieces.items() 
+                if key in ring and piece.alive == True}
         
     def place_piece(self, colour, pos):
         """
@@ -148,40 +427,248 @@ class Board:
         if pos in self.playingarea:
             if self.grid[pos] == EMPTY:
                 if colour == WHITE:
-                    self.white_pieces[pos] = (Piece(WHITE, pos, self))
-                    self.grid[pos] = WHITE
-                    eliminated_pieces = \
-                    self.white_pieces[pos].eliminate_surrounding()
+                    piece = self.take_piece(WHITE, pos)
+                    self.white_pieces[pos] = piece
+                    self.set_square(pos, WHITE)
+                    eliminated_pieces = piece.eliminate_surrounding()
                 elif colour == BLACK:
-                    self.black_pieces[pos] = (Piece(BLACK, pos, self))
-                    self.grid[pos] = BLACK
-                    eliminated_pieces = \
-                    self.black_pieces[pos].eliminate_surrounding()    
+                    piece = self.take_piece(BLACK, pos)
+                    self.black_pieces[pos] = piece
+                    self.set_square(pos, BLACK)
+                    eliminated_pieces = piece.eliminate_surrounding()
                 return eliminated_pieces
             
         return None
     
     def undo_place(self, colour, pos, eliminated):
         """
-        Undo the most recent placing move by specified player
+        Undo the most recent placing move by specified player and return the
+        placed piece to the pool
         """
         for piece in eliminated:
             piece.resurrect()
             
         self.remove_piece(pos)    
         if colour == WHITE:
-            if pos in self.white_pieces:
-                del self.white_pieces[pos]
+            piece = self.white_pieces.pop(pos, None)
+        else:
+            piece = self.black_pieces.pop(pos, None)
+        if piece is not None:
+            piece.alive = False
+            self.pool[colour].append(piece)
+    
+    def add_piece(self, colour, pos):
+        """
+        Puts a piece of 'colour' on the empty square 'pos' without checking
+        for eliminations (for setting up a given position)
+        """
+        piece = self.take_piece(colour, pos)
+        if colour == WHITE:
+            self.white_pieces[pos] = piece
+        else:
+            self.black_pieces[pos] = piece
+        self.set_square(pos, colour)
+        return piece
+
+    def take_piece(self, colour, pos):
+        """
+        Returns a piece from the pool (or a new one if the pool is empty) 
+        which is alive at 'pos' but not yet on the grid
+        """
+        pool = self.pool[colour]
+        if pool:
+            piece = pool.pop()
+            piece.pos = pos
+            piece.alive = True
+            return piece
+        return Piece(colour, pos, self)
+    
+    def kill_piece(self, piece):
+        """
+        Removes an eliminated piece from the grid and its team dictionary
+        """
+        self.remove_piece(piece.pos)
+        piece.alive = False
+        if piece.player == WHITE:
+            dictionary = self.white_pieces
         else:
-            if pos in self.black_pieces:
-                del self.black_pieces[pos]
+            dictionary = self.black_pieces
+        if dictionary.get(piece.pos) is piece:
+            del dictionary[piece.pos]
     
     def remove_piece(self, pos):
         """
         Remove pieces character from the grid
         """
         if pos in self.grid:
-            self.grid[pos] = EMPTY
+            self.set_square(pos, EMPTY)
+    
+    def set_square(self, pos, value):
+        """
+        Sets the character of a square on the grid. Every change to the grid
+        goes through here so that the masks, free squares, threat map, 
+        move cache and accumulator can be kept up to date
+        """
+        grid = self.grid
+        old = grid[pos]
+        if pos not in self.threat_dirty:
+            self.threat_dirty[pos] = old
+        if pos not in self.moves_dirty:
+            self.moves_dirty[pos] = old
+        accumulator = self.accumulator
+        if accumulator is not None and pos not in accumulator.dirty:
+            accumulator.dirty[pos] = old
+        grid[pos] = value
+        
+        if value == EMPTY:
+            for colour in ZONE_COLOURS[pos]:
+                self.free[colour][pos] = None
+        elif old == EMPTY:
+            for colour in ZONE_COLOURS[pos]:
+                self.free[colour].pop(pos, None)
+        
+        if old == WHITE:
+            self.white_mask ^= SQUARE_BITS[pos]
+        elif old == BLACK:
+            self.black_mask ^= SQUARE_BITS[pos]
+        if value == WHITE:
+            self.white_mask |= SQUARE_BITS[pos]
+        elif value == BLACK:
+            self.black_mask |= SQUARE_BITS[pos]
+    
+    def update_moves(self):
+        """
+        Brings the move cache up to date, recomputing the moves of pieces 
+        near squares which have changed since it was last updated
+        """
+        if not self.moves_dirty:
+            return
+        grid = self.grid
+        
+        affected = set()
+        for pos, value in self.moves_dirty.items():
+            if grid[pos] != value:
+                affected |= MOVES_AFFECTED[pos]
+        self.moves_dirty = {}
+        
+        # Same moves (in the same order) as Piece.listmoves(0)
+        area = PLAYING_AREAS[self.numOfShrinks]
+        cache, mobility = self.moves, self.mobility
+        for square in affected:
+            entry = cache.pop(square, None)
+            if entry is not None:
+                mobility[entry[0]] -= len(entry[1])
+            colour = grid[square]
+            if colour == WHITE or colour == BLACK:
+                moves = []
+                for neighbour, beyond in ARRIVAL_LINES[square]:
+                    if neighbour in area:
+                        if grid[neighbour] == EMPTY:
+                            moves.append(neighbour)
+                        elif beyond in area and grid[beyond] == EMPTY:
+                            moves.append(beyond)
+                cache[square] = (colour, moves)
+                mobility[colour] += len(moves)
+    
+    def get_moves(self, pos):
+        """
+        Returns list of moves of the piece at 'pos' (as Piece.listmoves(0)).
+        The list is shared with the cache so must not be changed
+        """
+        self.update_moves()
+        return self.moves[pos][1]
+    
+    def get_mobility(self, colour):
+        """
+        Returns the total number of moves available to a team
+        """
+        self.update_moves()
+        return self.mobility[colour]
+    
+    def update_threats(self):
+        """
+        Brings the threat map up to date by recomputing the squares affected
+        by every change since it was last updated
+        """
+        if not self.threat_dirty:
+            return
+        grid = self.grid
+        
+        # Squares which were changed and then changed back (e.g. a move that
+        # was undone) don't affect anything
+        affected = set()
+        for pos, value in self.threat_dirty.items():
+            if grid[pos] != value:
+                affected |= AFFECTED[pos]
+        self.threat_dirty = {}
+        
+        area = PLAYING_AREAS[self.numOfShrinks]
+        white_allies, black_allies = ENEMIES[BLACK], ENEMIES[WHITE]
+        white, black = self.threats[WHITE], self.threats[BLACK]
+        for square in affected:
+            white_mask = black_mask = 0
+            if grid[square] == EMPTY and square in area:
+                for neighbour, beyond, bit in CAPTURE_LINES[square]:
+                    target = grid[neighbour]
+                    if target == BLACK:
+                        if grid[beyond] in white_allies:
+                            white_mask |= bit
+                    elif target == WHITE:
+                        if grid[beyond] in black_allies:
+                            black_mask |= bit
+            if white_mask:
+                white[square] = white_mask
+            else:
+                white.pop(square, None)
+            if black_mask:
+                black[square] = black_mask
+            else:
+                black.pop(square, None)
+    
+    def get_threats(self, colour):
+        """
+        Returns dictionary mapping every empty square where a piece of
+        'colour' would capture to the mask of enemy pieces captured there
+        """
+        self.update_threats()
+        return self.threats[colour]
+    
+    def capture_mask(self, colour, pos, origin=None):
+        """
+        Returns mask of enemy pieces captured by a piece of 'colour' arriving
+        at 'pos', from 'origin' if it is a move (a piece jumping over an 
+        enemy can't also capture it)
+        """
+        mask = self.get_threats(colour).get(pos, 0)
+        if mask and origin is not None:
+            (x, y), (a, b) = pos, origin
+            if abs(x - a) + abs(y - b) == 2 and (x == a or y == b):
+                mask &= ~square_bit(((x + a) // 2, (y + b) // 2))
+        return mask
+    
+    def arrivals(self, pos):
+        """
+        Returns list of squares from which a piece could move to the empty
+        square 'pos', by a single step or jumping over an adjacent piece 
+        (the same moves as Piece.listmoves)
+        """
+        squares = []
+        for neighbour, beyond in ARRIVAL_LINES[pos]:
+            if self.grid[neighbour] != EMPTY:
+                squares.append(neighbour)
+                if beyond is not None:
+                    squares.append(beyond)
+        return squares
+    
+    def threatened(self, colour):
+        """
+        Returns mask of pieces of 'colour' that an enemy piece arriving on a
+        single square would capture (pieces en prise)
+        """
+        mask = 0
+        for captured in self.get_threats(OPPONENT[colour]).values():
+            mask |= captured
+        return mask
         
     def update_team(self, colour, newpos, oldpos):
         """
@@ -200,20 +687,88 @@ class Board:
         Counts the number of pieces that would be eliminated if a shrink were
         to occur now
         """
-        count = 0
+        return len(self.get_border_pieces(colour))
+    
+    def reachable(self, pos, ignore=None):
+        """
+        Returns list of squares a piece at 'pos' could move to, treating the
+        square 'ignore' as empty (used when planning several moves ahead)
+        """
+        def free(square):
+            return square in self.playingarea and \
+                (self.grid[square] == EMPTY or square == ignore)
         
-        s = self.numOfShrinks
-        for i in range(s, 8-s):
-            for j in range(s, 8-s):
-                if ((i==s or i==7-s or j==s or j==7-s) and \
-                    self.grid[i, j] == colour):
-                    count += 1
-                elif ((i==s+1 and j==s+1) or (i==s+1 and j==6-s) or \
-                      (i==6-s and j==s+1) or \
-                      (i==6-s and j==6-s)) and self.grid[i, j] == colour:
-                    count += 1
-        
-        return count
+        squares = []
+        for dir in DIRECTIONS:
+            adjacent_square = step(pos, dir)
+            if free(adjacent_square):
+                squares.append(adjacent_square)
+            elif adjacent_square in self.playingarea and \
+            adjacent_square != ignore and \
+            self.grid[adjacent_square] in (WHITE, BLACK):
+                jump_square = step(adjacent_square, dir)
+                if free(jump_square):
+                    squares.append(jump_square)
+        return squares
+    
+    def escape_route(self, piece, limit):
+        """
+        Breadth first search for the fewest moves taking 'piece' off the 
+        border (other pieces stay where they are). Returns (moves, first move)
+        or None if no square that survives the shrink can be reached within 
+        'limit' moves
+        """
+        ring = BORDER_RINGS[self.numOfShrinks]
+        start = piece.pos
+        first_move = {start: None}
+        frontier = [start]
+        
+        for moves in range(1, limit + 1):
+            next_frontier = []
+            for square in frontier:
+                for target in self.reachable(square, ignore=start):
+                    if target in first_move:
+                        continue
+                    first_move[target] = first_move[square] or target
+                    if target not in ring:
+                        return moves, first_move[target]
+                    next_frontier.append(target)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return None
+    
+    def escape_cost(self, colour):
+        """
+        Lower bound on the number of moves needed to get all of the team's
+        pieces off the border (from the precomputed distance maps)
+        """
+        distances = SAFETY_DISTANCES[self.numOfShrinks]
+        return sum(distances.get(pos, 0)
+                   for pos in self.get_border_pieces(colour))
+    
+    def escape_plan(self, colour, limit):
+        """
+        Plans the cheapest set of escape moves for the team's border pieces
+        given 'limit' moves before the next shrink. Returns list of 
+        (moves, piece, first move) for the pieces that can be saved, cheapest
+        first (ties broken by position so the plan is deterministic)
+        """
+        routes = []
+        for pos, piece in sorted(self.get_border_pieces(colour).items()):
+            route = self.escape_route(piece, limit)
+            if route is not None:
+                moves, first = route
+                routes.append((moves, pos, piece, first))
+        routes.sort(key=lambda route: route[:2])
+        
+        plan = []
+        for moves, pos, piece, first in routes:
+            if moves > limit:
+                break
+            limit -= moves
+            plan.append((moves, piece, first))
+        return plan
     
     def shrink(self):
         """
@@ -240,7 +795,7 @@ class Board:
         
         # Replace existing corners with '-'
         for corner in [(s, s), (s, 7-s), (7-s, 7-s), (7-s, s)]:
-            self.grid[corner] = EMPTY
+            self.set_square(corner, EMPTY)
             
         # Add new corners and check if any pieces eliminated as a result
         # (moving counterclockwise starting from top left corner)
@@ -248,11 +803,12 @@ class Board:
         
         for corner in [(s, s), (s, 7-s), (7-s, 7-s), (7-s, s)]:
             # If corner replaces a piece make sure to eliminate it
-            if corner in {**self.get_alive(WHITE), **self.get_alive(BLACK)}:
-                self.get_piece(corner).alive = False
+            piece = self.get_piece(corner)
+            if piece is not None:
+                self.kill_piece(piece)
                 
             # Check eliminations surrounding new corner
-            self.grid[corner] = CORNER
+            self.set_square(corner, CORNER)
             for dir in DIRECTIONS:
                 adjacent_square = step(corner, dir)
                 if adjacent_square in self.playingarea:
@@ -264,6 +820,11 @@ class Board:
                 
         # Change size of playable area    
         self.playingsize -= 2   
+        
+        # The playing area has changed so every square needs updating
+        self.threat_dirty = dict.fromkeys(self.grid)
+        self.moves_dirty = dict.fromkeys(self.grid)
+        self.reset_free()
     
     def check_win(self, colour):
         """
@@ -309,17 +870,16 @@ class Piece:
     """
     Class representing each piece in terms of player (WHITE/BLACK), 
     pos (x,y), board (instance of Board it belongs to), alive (whether
-    or not it is on the board) and its enemies (WHITE/BLACK)
+    or not it is on the board) and its enemies (set shared by each team)
     """
+    __slots__ = ['player', 'pos', 'board', 'alive', 'enemy']
+    
     def __init__(self, player, pos, board):
         self.player = player
         self.pos = pos
         self.board = board
         self.alive = True
-        if player == WHITE:
-            self.enemy = [BLACK, CORNER]
-        else:
-            self.enemy = [WHITE, CORNER]
+        self.enemy = ENEMIES[player]
         
     def listmoves(self, exclude_borders):
         """
@@ -371,8 +931,7 @@ class Piece:
         
         # Check if piece is outside of playing area
         if self.pos not in self.board.playingarea:
-            self.board.remove_piece(self.pos)
-            self.alive = False
+            self.board.kill_piece(self)
             return True
         
         # Check if piece has been surrounded horizontally or vertically
@@ -383,16 +942,19 @@ class Piece:
             and back_square in self.board.playingarea:
                 if self.board.grid[front_square] in self.enemy \
                 and self.board.grid[back_square] in self.enemy:
-                    self.board.remove_piece(self.pos)
-                    self.alive = False
+                    self.board.kill_piece(self)
                     return True
                     
     def resurrect(self):
         """
         Places piece back on the board and sets alive = True
         """
-        self.board.grid[self.pos] = self.player
+        self.board.set_square(self.pos, self.player)
         self.alive = True
+        if self.player == WHITE:
+            self.board.white_pieces[self.pos] = self
+        else:
+            self.board.black_pieces[self.pos] = self
         
     def eliminate_surrounding(self):
         """
@@ -410,9 +972,10 @@ class Piece:
         for dir in DIRECTIONS:
             adjacent_square = step(self.pos, dir)
             if adjacent_square in self.board.playingarea:
-                if self.board.grid[adjacent_square] == self.enemy[0]:
-                    if enemy_pieces[adjacent_square].check_eliminated():
-                        eliminated_pieces.append(enemy_pieces[adjacent_square])
+                if self.board.grid[adjacent_square] == OPPONENT[self.player]:
+                    enemy = enemy_pieces[adjacent_square]
+                    if enemy.check_eliminated():
+                        eliminated_pieces.append(enemy)
                         
         # Now check if piece has itself been eliminated
         if self.check_eliminated():
@@ -428,8 +991,8 @@ class Piece:
         """
         oldpos = self.pos
         self.pos = newpos   
-        self.board.grid[oldpos] = EMPTY
-        self.board.grid[newpos] = self.player
+        self.board.set_square(oldpos, EMPTY)
+        self.board.set_square(newpos, self.player)
         self.board.update_team(self.player, newpos, oldpos)
         
         eliminated_pieces = self.eliminate_surrounding()
@@ -445,19 +1008,17 @@ class Piece:
             
         newpos = self.pos
         self.pos = oldpos
-        self.board.grid[newpos] = EMPTY
-        self.board.grid[oldpos] = self.player
+        self.board.set_square(newpos, EMPTY)
+        self.board.set_square(oldpos, self.player)
         
         if self.player == WHITE:
             dictionary = self.board.white_pieces
         else:
             dictionary = self.board.black_pieces
         
-        # If piece has not been overridden in its team dictionary, update it
-        if self.pos in dictionary:
-            self.board.update_team(self.player, oldpos, newpos)
-        
-        # Overridden during alpha beta search so insert into dictionary again   
-        else:
-            dictionary[oldpos] = self
+        # Piece may have been eliminated by the move (and so already removed
+        # from its team dictionary) but is now alive again at newpos
+        if dictionary.get(newpos) is self:
+            del dictionary[newpos]
+        dictionary[oldpos] = self
                  